@@ -2,11 +2,16 @@ from flask import Flask
 from flask_cors import CORS
 import logging
 import os
+from threading import Thread
 from .config import Config
 from .db import init_pool, close_conn, ensure_schema
 from .auth import app as auth
 from .admin import app as admin
 from .api import api
+from .services.embeddings import warm_up
+from .services.llm_client import warm_up_llm
+from .services.faq_index_builder import schedule_missing_index
+from .services.retreival import load_faiss_index
 
 def create_app():
     logging.basicConfig(level=logging.DEBUG)
@@ -46,10 +51,21 @@ def create_app():
     # Best-effort schema updates for runtime features (safe to run repeatedly)
     ensure_schema()
 
+    if Config.EMBEDDING_WARMUP:
+        # Loads the embedding models off the request path; the first query would otherwise pay for it.
+        Thread(target=warm_up, daemon=True).start()
+    if Config.OLLAMA_WARMUP:
+        Thread(target=warm_up_llm, daemon=True).start()
+
     app.register_blueprint(auth)
     app.register_blueprint(admin)
     app.register_blueprint(api)
 
+    # Only map the prebuilt FAQ index (manage_indexes.py); if there is none, one worker
+    # builds it in the background while searches return no FAQ matches.
+    if not load_faiss_index():
+        schedule_missing_index(app)
+
     @app.teardown_appcontext
     def close_db(error):
         close_conn()
@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify, current_app, url_for
 import json
 from ..db import get_conn
-from ..services.retreival import build_faiss_index
+from ..services.faq_index_builder import schedule_chatbot_removal
+from ..services.faq_corpus import HYBRID_SETTINGS, invalidate_faq_cache
+from ..services.faq_hybrid import FUSIONS
 from werkzeug.utils import secure_filename
 import traceback
 import os
@@ -668,6 +670,8 @@ def atualizar_chatbot(chatbot_id):
         else:
             cur.execute("INSERT INTO fonte_resposta (chatbot_id, fonte) VALUES (%s, %s)", (chatbot_id, fonte))
         conn.commit()
+        # video_enabled is served from the cached FAQ corpus
+        invalidate_faq_cache(chatbot_id)
 
         # Only regenerate videos when explicitly needed.
         # IMPORTANT: Do NOT regenerate if only descricao, cor, mensagem_sem_resposta, fonte, or categorias changed.
@@ -782,7 +786,7 @@ def eliminar_chatbot(chatbot_id):
         cur.execute("DELETE FROM pdf_documents WHERE chatbot_id = %s", (chatbot_id,))
         cur.execute("DELETE FROM chatbot WHERE chatbot_id = %s", (chatbot_id,))
         conn.commit()
-        build_faiss_index()
+        schedule_chatbot_removal(chatbot_id)
 
         # If we deleted the active chatbot, promote another one to active (best-effort)
         if was_active:
@@ -863,6 +867,71 @@ def definir_fonte_chatbot():
         cur.close()
         conn.close()
 
+@app.route("/chatbots/<int:chatbot_id>/pesquisa-hibrida", methods=["GET"])
+def obter_pesquisa_hibrida(chatbot_id):
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"SELECT {', '.join(HYBRID_SETTINGS)} FROM chatbot WHERE chatbot_id = %s",
+            (chatbot_id,),
+        )
+        row = cur.fetchone()
+        if not row:
+            return jsonify({"success": False, "erro": "Chatbot não encontrado."}), 404
+        return jsonify({"success": True, **dict(zip(HYBRID_SETTINGS, row))})
+    except Exception as e:
+        return jsonify({"success": False, "erro": str(e)}), 500
+    finally:
+        cur.close()
+        conn.close()
+
+@app.route("/chatbots/<int:chatbot_id>/pesquisa-hibrida", methods=["PUT"])
+def definir_pesquisa_hibrida(chatbot_id):
+    """Override the hybrid FAQ search settings of a chatbot; null restores the default."""
+    data = request.get_json() or {}
+    valores = {}
+    for campo in HYBRID_SETTINGS:
+        if campo not in data:
+            continue
+        valor = data[campo]
+        if valor is None or valor == "":
+            valores[campo] = None
+        elif campo == "faq_fusion":
+            valor = str(valor).strip().lower()
+            if valor not in FUSIONS:
+                return jsonify({"success": False, "erro": "Fusão inválida (rrf ou weighted)."}), 400
+            valores[campo] = valor
+        else:
+            try:
+                valor = float(valor)
+            except (TypeError, ValueError):
+                return jsonify({"success": False, "erro": f"Valor inválido para {campo}."}), 400
+            if not 0.0 <= valor <= 1.0:
+                return jsonify({"success": False, "erro": f"{campo} deve estar entre 0 e 1."}), 400
+            valores[campo] = valor
+    if not valores:
+        return jsonify({"success": False, "erro": "Nenhum parâmetro a atualizar."}), 400
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"UPDATE chatbot SET {', '.join(f'{campo} = %s' for campo in valores)} WHERE chatbot_id = %s",
+            (*valores.values(), chatbot_id),
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return jsonify({"success": False, "erro": "Chatbot não encontrado."}), 404
+        conn.commit()
+        invalidate_faq_cache(chatbot_id)
+        return jsonify({"success": True})
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"success": False, "erro": str(e)}), 500
+    finally:
+        cur.close()
+        conn.close()
+
 @app.route("/chatbots/<int:chatbot_id>/categorias", methods=["GET"])
 def get_categorias_chatbot(chatbot_id):
     conn = get_conn()
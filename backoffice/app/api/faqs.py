@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify
 from ..db import get_conn
-from ..services.retreival import build_faiss_index
+from ..services.faq_index_builder import schedule_faqs
 from ..services.video_service import get_video_job_status
 import os
 from pathlib import Path
@@ -283,7 +283,7 @@ def update_faq(faq_id):
                         (faq_id, rel_id),
                     )
             conn.commit()
-            build_faiss_index()
+            schedule_faqs([faq_id])
         except Exception as update_error:
             error_msg = str(update_error)
             # Check for unique constraint violation
@@ -368,7 +368,7 @@ def add_faq():
                     (faq_id, rel_id),
                 )
         conn.commit()
-        build_faiss_index()
+        schedule_faqs([faq_id])
 
         # Vídeo para FAQ deixa de ser gerado automaticamente: passa a ser pedido explicitamente na página de FAQs.
         return jsonify({"success": True, "faq_id": faq_id, "video_queued": False})
@@ -392,7 +392,7 @@ def delete_faq(faq_id):
 
         cur.execute("DELETE FROM faq WHERE faq_id = %s", (faq_id,))
         conn.commit()
-        build_faiss_index()
+        schedule_faqs([faq_id], chatbot_ids=[chatbot_id])
 
         # Delete video file if it exists
         if video_path and os.path.isfile(video_path):
@@ -1,14 +1,130 @@
-﻿from flask import Blueprint, request, jsonify
+﻿from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask import url_for
+from ..config import Config
 from ..db import get_conn
 from ..services.text import detectar_saudacao, registar_pergunta_nao_respondida, normalizar_idioma
-from ..services.retreival import obter_faq_mais_semelhante, pesquisar_faiss, build_faiss_index
-from ..services.rag import pesquisar_pdf_pgvector, obter_mensagem_sem_resposta
+from ..services.retreival import obter_faq_exata, obter_faq_mais_semelhante
+from ..services.faq_hybrid import obter_faq_hibrida, obter_faqs_hibridas
+from ..services.faq_corpus import normalize_question
+from ..services.single_flight import shared_flight, single_flight, single_flight_stats
+from ..services.response_cache import cache_response, get_cached_response, response_cache_key, response_cache_stats
+from ..services.faq_index_builder import get_index_build_status, schedule_rebuild
+from ..services.rag import pesquisar_pdf_pgvector, pesquisar_pdf_pgvector_stream, obter_mensagem_sem_resposta
+from ..services.rag_cache import rag_answer_cache_stats
+from ..services.llm_client import LLMBusy, llm_client_stats
+from ..services.embeddings import model_stats, query_cache_stats
+import json
 import traceback
 
 app = Blueprint('respostas', __name__)
 
 
+def _com_score(faq, score):
+    """Exact matches carry a perfect score on the scale of the branch (fuzzy 0-100, hybrid 0-1)."""
+    if not faq:
+        return None
+    return {**faq, "score": score}
+
+
+SEM_RESPOSTA_SEMELHANTE = "NÃ£o encontrei nenhuma resposta suficientemente semelhante na base de dados."
+
+
+def _resposta_faq(resultado, idioma, video=False):
+    """Payload of a FAQ answer (fontes faq / faq+raga)."""
+    resposta = {
+        "success": True,
+        "fonte": "FAQ",
+        "resposta": resultado["resposta"],
+        "faq_id": resultado["faq_id"],
+        "faq_idioma": idioma,
+        "categoria_id": resultado["categoria_id"],
+        "video_status": resultado["video_status"],
+        "score": resultado["score"],
+        "pergunta_faq": resultado["pergunta"],
+        "documentos": resultado["documentos"]
+    }
+    if video:
+        # IMPORTANT: nÃ£o gerar vÃ­deo automaticamente ao usar a FAQ no chat.
+        # A geraÃ§Ã£o deve ser manual (backoffice) e o chat apenas reflete estados.
+        resposta.update({
+            "video_enabled": resultado.get("video_enabled", False),
+            "video_queued": False,
+            "video_busy": False,
+        })
+    return resposta
+
+
+def _resposta_hibrida(resultado, idioma):
+    """Payload of a hybrid search answer (fonte faiss).
+
+    "fonte" keeps the values of the former FAISS-then-fuzzy search: FUZZY when only the
+    lexical side matched, FAISS otherwise (exact matches included). "fusion" tells how
+    the match was ranked (rrf / weighted; None for exact matches).
+    """
+    lexical_only = not resultado.get("dense_score") and bool(resultado.get("lexical_score"))
+    return {
+        "success": True,
+        "fonte": "FUZZY" if lexical_only else "FAISS",
+        "resposta": resultado["resposta"],
+        "faq_id": resultado["faq_id"],
+        "faq_idioma": idioma,
+        "categoria_id": resultado["categoria_id"],
+        "video_status": resultado["video_status"],
+        "score": resultado["score"],
+        "dense_score": resultado.get("dense_score"),
+        "lexical_score": resultado.get("lexical_score"),
+        "fusion": resultado.get("fusion"),
+        "pergunta_faq": resultado["pergunta"],
+        "documentos": resultado["documentos"]
+    }
+
+
+SEM_RESPOSTA_PDF = "Nao foi possivel encontrar uma resposta nos documentos PDF."
+LLM_OCUPADO = "O assistente está ocupado de momento. Tente novamente dentro de alguns segundos."
+
+
+def _aviso_ai(chatbot_id):
+    """Optional AI warning message configured per chatbot."""
+    cur = get_conn().cursor()
+    try:
+        cur.execute("SELECT mensagem_gerada_ai FROM chatbot WHERE chatbot_id = %s", (chatbot_id,))
+        r = cur.fetchone()
+        return (r[0] or "").strip() if r else ""
+    except Exception:
+        return ""
+    finally:
+        cur.close()
+
+
+def _documentos_pdf(fontes):
+    pdf_ids = []
+    for f in fontes:
+        if f["pdf_id"] not in pdf_ids:
+            pdf_ids.append(f["pdf_id"])
+    # Return URLs that are valid behind reverse-proxy (avoid leaking server paths)
+    return [url_for("api.uploads.get_pdf", pdf_id=pid) for pid in pdf_ids]
+
+
+def _resposta_rag(resposta_rag, fontes, chatbot_id):
+    """Payload of an answer generated from the chatbot's PDFs (fonte faq+raga, try_rag)."""
+    return {
+        "success": True,
+        "fonte": "RAG-PGVECTOR",
+        "resposta": resposta_rag,
+        "ai_generated": True,
+        "ai_notice": _aviso_ai(chatbot_id),
+        "faq_id": None,
+        "categoria_id": None,
+        "score": None,
+        "pergunta_faq": None,
+        "documentos": _documentos_pdf(fontes)
+    }
+
+
+def _sse(evento, dados):
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
 @app.route("/obter-resposta", methods=["POST"])
 def obter_resposta():
     conn = get_conn()
@@ -53,48 +169,24 @@ def obter_resposta():
                 "erro": "Por favor utilize os botÃµes abaixo para confirmar.",
                 "prompt_rag": True
             })
+        # Before any lookup: an unknown fonte must not load the FAQ corpus.
+        if fonte not in ("faq", "faiss", "faq+raga"):
+            return jsonify({"success": False, "erro": "Fonte inválida."}), 400
         try:
+            cache_key = response_cache_key(chatbot_id, idioma, fonte, pergunta)
+            cached = get_cached_response(cache_key)
+            if cached is not None:
+                return jsonify(cached)
+            # Identical questions arriving together share one search (and one LLM call).
+            flight_key = (chatbot_id, idioma, fonte, normalize_question(pergunta))
+            # Suggested questions come back verbatim: answer them without any scoring.
+            exata = obter_faq_exata(pergunta, chatbot_id, idioma=idioma)
             if fonte == "faq":
-                resultado = obter_faq_mais_semelhante(pergunta, chatbot_id, idioma=idioma)
+                resultado = _com_score(exata, 100.0) or single_flight(
+                    flight_key, lambda: obter_faq_mais_semelhante(pergunta, chatbot_id, idioma=idioma)
+                )
                 if resultado:
-                    cur.execute("""
-                        SELECT faq_id, categoria_id, video_status FROM faq
-                        WHERE LOWER(pergunta) = LOWER(%s) AND chatbot_id = %s AND idioma = %s
-                    """, (resultado["pergunta"], chatbot_id, idioma))
-                    row = cur.fetchone()
-                    faq_id, categoria_id, video_status = row if row else (None, None, None)
-
-                    # Se o chatbot tiver vÃ­deo ativo e o vÃ­deo ainda nÃ£o estiver pronto, tentar enfileirar.
-                    video_enabled = False
-                    try:
-                        cur.execute("SELECT video_enabled FROM chatbot WHERE chatbot_id = %s", (chatbot_id,))
-                        r = cur.fetchone()
-                        video_enabled = bool(r[0]) if r else False
-                    except Exception:
-                        video_enabled = False
-
-                    # IMPORTANT: nÃ£o gerar vÃ­deo automaticamente ao usar a FAQ no chat.
-                    # A geraÃ§Ã£o deve ser manual (backoffice) e o chat apenas reflete estados.
-                    video_queued = False
-                    video_busy = False
-
-                    cur.execute("SELECT link FROM faq_documento WHERE faq_id = %s", (faq_id,))
-                    docs = [r[0] for r in cur.fetchall()]
-                    return jsonify({
-                        "success": True,
-                        "fonte": "FAQ",
-                        "resposta": resultado["resposta"],
-                        "faq_id": faq_id,
-                        "faq_idioma": idioma,
-                        "categoria_id": categoria_id,
-                        "video_status": video_status,
-                        "video_enabled": video_enabled,
-                        "video_queued": video_queued,
-                        "video_busy": video_busy,
-                        "score": resultado["score"],
-                        "pergunta_faq": resultado["pergunta"],
-                        "documentos": docs
-                    })
+                    return jsonify(cache_response(cache_key, _resposta_faq(resultado, idioma, video=True)))
                 registar_pergunta_nao_respondida(chatbot_id, pergunta, "faq")
                 return jsonify({
                     "success": False,
@@ -102,114 +194,34 @@ def obter_resposta():
                     "no_answer": True
                 })
             elif fonte == "faiss":
-                faiss_resultados = pesquisar_faiss(
-                    pergunta,
-                    chatbot_id=chatbot_id,
-                    idioma=idioma,
-                    k=3,
-                    min_sim=0.6,
-                    relax_min_sim=0.5,
+                # Hybrid search: vector index and BM25 fused in a single pass.
+                resultado = _com_score(exata, 1.0) or single_flight(
+                    flight_key, lambda: obter_faq_hibrida(pergunta, chatbot_id, idioma=idioma)
                 )
-                if faiss_resultados:
-                    faq_id = faiss_resultados[0]['faq_id']
-                    cur.execute("SELECT link FROM faq_documento WHERE faq_id = %s", (faq_id,))
-                    docs = [r[0] for r in cur.fetchall()]
-                    return jsonify({
-                        "success": True,
-                        "fonte": "FAISS",
-                        "resposta": faiss_resultados[0]['resposta'],
-                        "faq_id": faq_id,
-                        "faq_idioma": idioma,
-                        "score": faiss_resultados[0]['score'],
-                        "pergunta_faq": faiss_resultados[0]['pergunta'],
-                        "documentos": docs
-                    })
-                else:
-                    resultado = obter_faq_mais_semelhante(pergunta, chatbot_id, idioma=idioma, threshold=75)
-                    if resultado:
-                        cur.execute("""
-                            SELECT faq_id, categoria_id, video_status FROM faq
-                            WHERE LOWER(pergunta) = LOWER(%s) AND chatbot_id = %s AND idioma = %s
-                        """, (resultado["pergunta"], chatbot_id, idioma))
-                        row = cur.fetchone()
-                        faq_id, categoria_id, video_status = row if row else (None, None, None)
-                        cur.execute("SELECT link FROM faq_documento WHERE faq_id = %s", (faq_id,))
-                        docs = [r[0] for r in cur.fetchall()]
-                        return jsonify({
-                            "success": True,
-                            "fonte": "FUZZY",
-                            "resposta": resultado["resposta"],
-                            "faq_id": faq_id,
-                            "faq_idioma": idioma,
-                            "categoria_id": categoria_id,
-                            "video_status": video_status,
-                            "score": resultado["score"],
-                            "pergunta_faq": resultado["pergunta"],
-                            "documentos": docs
-                        })
-                    return jsonify({
-                        "success": False,
-                        "erro": "NÃ£o encontrei nenhuma resposta suficientemente semelhante na base de dados."
-                    })
-            elif fonte == "faq+raga":
-                resultado = obter_faq_mais_semelhante(pergunta, chatbot_id, idioma=idioma)
                 if resultado:
-                    cur.execute("""
-                        SELECT faq_id, categoria_id, video_status FROM faq
-                        WHERE LOWER(pergunta) = LOWER(%s) AND chatbot_id = %s AND idioma = %s
-                    """, (resultado["pergunta"], chatbot_id, idioma))
-                    row = cur.fetchone()
-                    faq_id, categoria_id, video_status = row if row else (None, None, None)
-                    cur.execute("SELECT link FROM faq_documento WHERE faq_id = %s", (faq_id,))
-                    docs = [r[0] for r in cur.fetchall()]
-                    return jsonify({
-                        "success": True,
-                        "fonte": "FAQ",
-                        "resposta": resultado["resposta"],
-                        "faq_id": faq_id,
-                        "faq_idioma": idioma,
-                        "categoria_id": categoria_id,
-                        "video_status": video_status,
-                        "score": resultado["score"],
-                        "pergunta_faq": resultado["pergunta"],
-                        "documentos": docs
-                    })
+                    return jsonify(cache_response(cache_key, _resposta_hibrida(resultado, idioma)))
+                return jsonify({
+                    "success": False,
+                    "erro": SEM_RESPOSTA_SEMELHANTE,
+                    "no_answer": True
+                })
+            else:
+                resultado = _com_score(exata, 100.0) or single_flight(
+                    flight_key, lambda: obter_faq_mais_semelhante(pergunta, chatbot_id, idioma=idioma)
+                )
+                if resultado:
+                    return jsonify(cache_response(cache_key, _resposta_faq(resultado, idioma)))
                 elif feedback and feedback.strip().lower() == "try_rag":
                     print("DEBUG: A tentar responder via RAG (PDF) via pgvector")
-                    resposta_rag, fontes = pesquisar_pdf_pgvector(pergunta, chatbot_id=chatbot_id)
+                    resposta_rag, fontes = shared_flight(
+                        ("rag",) + flight_key, lambda: pesquisar_pdf_pgvector(pergunta, chatbot_id=chatbot_id)
+                    )
                     if resposta_rag:
-                        # Optional AI warning message configured per chatbot
-                        ai_notice = ""
-                        try:
-                            cur.execute(
-                                "SELECT mensagem_gerada_ai FROM chatbot WHERE chatbot_id = %s",
-                                (chatbot_id,),
-                            )
-                            r = cur.fetchone()
-                            ai_notice = (r[0] or "").strip() if r else ""
-                        except Exception:
-                            ai_notice = ""
-                        pdf_ids = []
-                        for f in fontes:
-                            if f["pdf_id"] not in pdf_ids:
-                                pdf_ids.append(f["pdf_id"])
-                        return jsonify({
-                            "success": True,
-                            "fonte": "RAG-PGVECTOR",
-                            "resposta": resposta_rag,
-                            "ai_generated": True,
-                            "ai_notice": ai_notice,
-                            "faq_id": None,
-                            "categoria_id": None,
-                            "score": None,
-                            "pergunta_faq": None,
-                            # Return URLs that are valid behind reverse-proxy (avoid leaking server paths)
-                            "documentos": [url_for("api.uploads.get_pdf", pdf_id=pid) for pid in pdf_ids]
-                        })
+                        return jsonify(_resposta_rag(resposta_rag, fontes, chatbot_id))
                     else:
                         return jsonify({
                             "success": False,
-                            "erro": "Nao foi possivel encontrar uma resposta nos documentos PDF."
+                            "erro": SEM_RESPOSTA_PDF
                         })
                 else:
                     print("DEBUG: feedback != 'try_rag' -> devolve prompt_rag")
@@ -218,8 +230,9 @@ def obter_resposta():
                         "erro": "Pergunta nÃ£o encontrada nas FAQs. Deseja tentar encontrar uma resposta nos documentos PDF? Isso pode levar alguns segundos.",
                         "prompt_rag": True
                     })
-            else:
-                return jsonify({"success": False, "erro": "Fonte invÃ¡lida."}), 400
+        except LLMBusy:
+            # The LLM is saturated: fail fast instead of holding this worker.
+            return jsonify({"success": False, "erro": LLM_OCUPADO, "busy": True}), 503, {"Retry-After": "10"}
         except Exception as inner_e:
             print(traceback.format_exc())
             return jsonify({"success": False, "erro": str(inner_e)}), 500
@@ -236,6 +249,153 @@ def obter_resposta():
         except Exception:
             pass
 
+@app.route("/obter-resposta/stream", methods=["POST"])
+def obter_resposta_stream():
+    """RAG answer as Server-Sent Events, forwarding the LLM output as it is generated.
+
+    Body: {"chatbot_id", "pergunta"}; this is the PDF step of fonte faq+raga (what
+    /obter-resposta does with feedback try_rag). Events, in order:
+
+        fontes    {"documentos", "fontes"}: the PDFs and chunks the answer is based on
+        token     {"texto"}: the next piece of the answer, one per LLM chunk
+        resposta  the payload /obter-resposta returns for the same question
+        erro      {"success": false, "erro"} instead of resposta when there is no answer
+
+    A client that disconnects stops the generation.
+    """
+    dados = request.get_json(silent=True) or {}
+    pergunta = (dados.get("pergunta") or "").strip()
+    try:
+        chatbot_id = int(dados.get("chatbot_id"))
+    except Exception:
+        return jsonify({"success": False, "erro": "Chatbot ID invÃ¡lido."}), 400
+    if not pergunta:
+        return jsonify({"success": False, "erro": "Pergunta em falta."}), 400
+
+    def eventos():
+        fontes = []
+        resposta_rag = None
+        try:
+            for evento, valor in pesquisar_pdf_pgvector_stream(pergunta, chatbot_id=chatbot_id):
+                if evento == "fontes":
+                    fontes = valor
+                    yield _sse("fontes", {"documentos": _documentos_pdf(fontes), "fontes": fontes})
+                elif evento == "token":
+                    yield _sse("token", {"texto": valor})
+                else:
+                    resposta_rag = valor
+            if resposta_rag:
+                yield _sse("resposta", _resposta_rag(resposta_rag, fontes, chatbot_id))
+            else:
+                yield _sse("erro", {"success": False, "erro": SEM_RESPOSTA_PDF})
+        except LLMBusy:
+            yield _sse("erro", {"success": False, "erro": LLM_OCUPADO, "busy": True})
+        except Exception as e:
+            print(traceback.format_exc())
+            yield _sse("erro", {"success": False, "erro": str(e)})
+
+    return Response(
+        stream_with_context(eventos()),
+        mimetype="text/event-stream",
+        # Reverse proxies (nginx) must pass the events through instead of buffering them.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/obter-respostas", methods=["POST"])
+def obter_respostas():
+    """Answers for a list of questions of one chatbot, for coverage tests and batch runs.
+
+    Body: {"chatbot_id", "perguntas": [...], "fonte", "idioma"}. Each item of
+    "resultados" has the schema /obter-resposta returns for that question. Only FAQ
+    answers are looked up: questions without one come back with no_answer (no RAG
+    generation, and they are not registered as unanswered questions). For faq+raga
+    that differs from /obter-resposta, which asks whether to search the PDFs
+    (prompt_rag) instead; here the miss has no prompt_rag. The fonte faiss
+    encodes all questions in one call and searches the index with one matrix query;
+    FAQ documents come with the cached FAQ corpus, so there are no per-question queries.
+    """
+    dados = request.get_json(silent=True) or {}
+    perguntas = dados.get("perguntas")
+    fonte = dados.get("fonte", "faq")
+    idioma = normalizar_idioma(dados.get("idioma", "pt"))
+    try:
+        chatbot_id = int(dados.get("chatbot_id"))
+    except Exception:
+        return jsonify({"success": False, "erro": "Chatbot ID inválido."}), 400
+    if not isinstance(perguntas, list) or not perguntas:
+        return jsonify({"success": False, "erro": "Indique uma lista de perguntas."}), 400
+    if len(perguntas) > Config.ANSWER_BATCH_MAX_QUESTIONS:
+        return jsonify({
+            "success": False,
+            "erro": f"No máximo {Config.ANSWER_BATCH_MAX_QUESTIONS} perguntas por pedido."
+        }), 400
+    if fonte not in ("faq", "faiss", "faq+raga"):
+        return jsonify({"success": False, "erro": "Fonte inválida."}), 400
+    try:
+        resultados = [None] * len(perguntas)
+        cache_keys = [None] * len(perguntas)
+        pendentes = []
+        for i, pergunta in enumerate(perguntas):
+            pergunta = pergunta.strip() if isinstance(pergunta, str) else ""
+            saudacao = detectar_saudacao(pergunta)
+            if saudacao:
+                resultados[i] = {
+                    "success": True,
+                    "fonte": "SAUDACAO",
+                    "resposta": saudacao,
+                    "faq_id": None,
+                    "categoria_id": None,
+                    "pergunta_faq": None,
+                    "documentos": []
+                }
+                continue
+            if not pergunta or (len(pergunta) < 4 and not any(char.isalpha() for char in pergunta)):
+                resultados[i] = {
+                    "success": False,
+                    "erro": "Pergunta demasiado curta ou não reconhecida como válida."
+                }
+                continue
+            cache_keys[i] = response_cache_key(chatbot_id, idioma, fonte, pergunta)
+            resultados[i] = get_cached_response(cache_keys[i])
+            if resultados[i] is None:
+                pendentes.append((i, pergunta))
+
+        if pendentes:
+            exatas = [obter_faq_exata(pergunta, chatbot_id, idioma=idioma) for _, pergunta in pendentes]
+            por_pesquisar = [pergunta for (_, pergunta), exata in zip(pendentes, exatas) if not exata]
+            if fonte == "faiss":
+                encontrados = iter(obter_faqs_hibridas(por_pesquisar, chatbot_id, idioma=idioma))
+            else:
+                encontrados = iter([
+                    obter_faq_mais_semelhante(pergunta, chatbot_id, idioma=idioma) for pergunta in por_pesquisar
+                ])
+            sem_resposta = None
+            for (i, _), exata in zip(pendentes, exatas):
+                if fonte == "faiss":
+                    resultado = _com_score(exata, 1.0) or next(encontrados)
+                    resposta = resultado and _resposta_hibrida(resultado, idioma)
+                else:
+                    resultado = _com_score(exata, 100.0) or next(encontrados)
+                    resposta = resultado and _resposta_faq(resultado, idioma, video=fonte == "faq")
+                if resposta:
+                    resultados[i] = cache_response(cache_keys[i], resposta)
+                    continue
+                if sem_resposta is None:
+                    sem_resposta = obter_mensagem_sem_resposta(chatbot_id) if fonte == "faq" else SEM_RESPOSTA_SEMELHANTE
+                resultados[i] = {"success": False, "erro": sem_resposta, "no_answer": True}
+
+        return jsonify({
+            "success": True,
+            "chatbot_id": chatbot_id,
+            "fonte": fonte,
+            "total": len(resultados),
+            "respondidas": sum(1 for r in resultados if r.get("success")),
+            "resultados": resultados
+        })
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({"success": False, "erro": str(e)}), 500
+
 @app.route("/perguntas-semelhantes", methods=["POST"])
 def perguntas_semelhantes():
     conn = get_conn()
@@ -245,15 +405,13 @@ def perguntas_semelhantes():
     chatbot_id = dados.get("chatbot_id")
     idioma = dados.get("idioma", "pt")
     try:
-        cur.execute("""
-            SELECT categoria_id
-            FROM faq
-            WHERE LOWER(pergunta) = LOWER(%s) AND chatbot_id = %s AND idioma = %s
-        """, (pergunta_atual.strip().lower(), chatbot_id, idioma))
-        categoria_row = cur.fetchone()
-        if not categoria_row or categoria_row[0] is None:
+        try:
+            faq = obter_faq_exata(pergunta_atual, int(chatbot_id), idioma=idioma)
+        except (TypeError, ValueError):
+            faq = None
+        if not faq or faq["categoria_id"] is None:
             return jsonify({"success": True, "sugestoes": []})
-        categoria_id = categoria_row[0]
+        categoria_id = faq["categoria_id"]
         cur.execute("""
             SELECT pergunta
             FROM faq
@@ -308,8 +466,32 @@ def faqs_aleatorias():
 
 @app.route("/rebuild-faiss", methods=["POST"])
 def rebuild_faiss():
-    build_faiss_index()
-    return jsonify({"success": True, "msg": "FAISS index rebuilt."})
+    # Only queues the rebuild; progress is reported by /faq-index/status.
+    data = request.get_json(silent=True) or {}
+    chatbot_id = data.get("chatbot_id") or request.args.get("chatbot_id")
+    if chatbot_id:
+        try:
+            chatbot_id = int(chatbot_id)
+        except Exception:
+            return jsonify({"success": False, "erro": "Chatbot ID inválido."}), 400
+    job = schedule_rebuild(chatbot_id or None)
+    return jsonify({"success": True, "msg": "FAISS index rebuild scheduled.", "job": job}), 202
+
+@app.route("/faq-index/status", methods=["GET"])
+def faq_index_status():
+    return jsonify({"success": True, **get_index_build_status()})
+
+@app.route("/obter-resposta/metricas", methods=["GET"])
+def metricas_cache_respostas():
+    return jsonify({
+        "success": True,
+        **response_cache_stats(),
+        "single_flight": single_flight_stats(),
+        "rag_answer_cache": rag_answer_cache_stats(),
+        "llm": llm_client_stats(),
+        "embedding_models": model_stats(),
+        "query_embedding_cache": query_cache_stats(),
+    })
 
 @app.route("/faq-categoria/<categoria>", methods=["GET"])
 def obter_faq_por_categoria(categoria):
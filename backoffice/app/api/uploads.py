@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask import send_file
 from ..db import get_conn
-from ..services.retreival import build_faiss_index
+from ..services.faq_index_builder import schedule_faqs
 from ..services.rag import index_pdf_documents
+from ..services.rag_ann_index import ann_index_status, schedule_ann_maintenance
 from ..services.text import normalizar_idioma
 from ..config import Config
 from ..services.video_service import can_start_new_video_job
@@ -238,6 +239,7 @@ def upload_pdf():
         try:
             index_pdf_documents(chatbot_id=int(chatbot_id), pdf_ids=uploaded_pdf_ids)
             rag_indexed = True
+            schedule_ann_maintenance()
         except Exception:
             traceback.print_exc()
         return jsonify({
@@ -278,12 +280,26 @@ def get_pdf(pdf_id: int):
 def rebuild_rag():
     data = request.get_json(silent=True) or {}
     chatbot_id = data.get("chatbot_id")
+    # Unchanged PDFs are skipped unless "force" is set.
+    force = bool(data.get("force"))
     try:
         if chatbot_id:
-            chunks = index_pdf_documents(chatbot_id=int(chatbot_id))
+            report = index_pdf_documents(chatbot_id=int(chatbot_id), force=force)
         else:
-            chunks = index_pdf_documents()
-        return jsonify({"success": True, "chunks": chunks})
+            report = index_pdf_documents(force=force)
+        # Resize the pgvector index to the new table size if needed, off the request.
+        schedule_ann_maintenance()
+        return jsonify({"success": True, **report})
+    except Exception as exc:
+        traceback.print_exc()
+        return jsonify({"success": False, "error": str(exc)}), 500
+
+
+@app.route("/rag-index/status", methods=["GET"])
+def rag_index_status():
+    """Type, size and tuned search settings of the rag_chunks pgvector index."""
+    try:
+        return jsonify({"success": True, **ann_index_status()})
     except Exception as exc:
         traceback.print_exc()
         return jsonify({"success": False, "error": str(exc)}), 500
@@ -336,6 +352,7 @@ def upload_faq_docx():
         idioma = normalizar_idioma(idioma_lido)
         links_documentos = dados.get("links_documentos", "")
         serve_text = dados.get("serve_text")
+        inserted_faq_ids = []
         chatbot_ids = []
         if chatbot_id_raw == "todos":
             cur.execute("SELECT chatbot_id FROM chatbot")
@@ -364,6 +381,7 @@ def upload_faq_docx():
                 (serve_text or "").strip() or None,
             ))
             faq_id = cur.fetchone()[0]
+            inserted_faq_ids.append(faq_id)
             if categoria:
                 cur.execute("SELECT categoria_id FROM categoria WHERE nome ILIKE %s", (categoria,))
                 result = cur.fetchone()
@@ -378,7 +396,7 @@ def upload_faq_docx():
                             (faq_id, link)
                         )
         conn.commit()
-        build_faiss_index()
+        schedule_faqs(inserted_faq_ids)
         return jsonify({"success": True, "message": "FAQ e links inseridos com sucesso."})
     except Exception as e:
         conn.rollback()
@@ -418,6 +436,8 @@ def upload_faq_docx_multiplos():
     files = request.files.getlist('files') or request.files.getlist('file')
     total_inseridas = 0
     erros = []
+    # Ids rolled back by a later failing file are dropped again by the index upsert
+    inserted_faq_ids = []
     for file in files:
         try:
             dados = _parse_faq_upload(file)
@@ -461,6 +481,7 @@ def upload_faq_docx_multiplos():
                     (serve_text or "").strip() or None,
                 ))
                 faq_id = cur.fetchone()[0]
+                inserted_faq_ids.append(faq_id)
                 if categoria:
                     cur.execute("SELECT categoria_id FROM categoria WHERE nome ILIKE %s", (categoria,))
                     result = cur.fetchone()
@@ -479,6 +500,6 @@ def upload_faq_docx_multiplos():
             erros.append(str(e))
             conn.rollback()
     conn.commit()
-    build_faiss_index()
+    schedule_faqs(inserted_faq_ids)
     return jsonify({"success": True, "inseridas": total_inseridas, "erros": erros})
 
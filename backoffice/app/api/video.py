@@ -7,6 +7,7 @@ from flask import Blueprint, jsonify, request, send_file, current_app
 from ..db import get_conn
 from ..config import Config
 from ..services.signed_media import verify_media_sig, sign_media
+from ..services.faq_index_builder import schedule_chatbot_removal
 from ..services.video_service import (
     queue_video_for_faq,
     get_video_job_status,
@@ -292,6 +293,7 @@ def cancel_video_job():
             cur.execute("DELETE FROM pdf_documents WHERE chatbot_id = %s", (chatbot_id,))
             cur.execute("DELETE FROM chatbot WHERE chatbot_id = %s", (chatbot_id,))
             conn.commit()
+            schedule_chatbot_removal(chatbot_id)
 
             # Clean up FAQ video files
             try:
@@ -32,18 +32,131 @@ class Config:
     PG_USER = os.getenv("PG_USER", "postgres")
     PG_PASS = os.getenv("PG_PASS", "admin")
     INDEX_PATH = _resolve_path(os.getenv("INDEX_PATH", "backoffice/faiss.index"))
+    # Legacy pickled FAQ embeddings (read only until the first snapshot in FAQ_INDEX_DIR exists)
     FAQ_EMBEDDINGS_PATH = _resolve_path(os.getenv("FAQ_EMB_PATH", "backoffice/faq_embeddings.pkl"))
+    # Versioned, memory-mapped FAQ index snapshots (see services/faq_index_store.py)
+    FAQ_INDEX_DIR = _resolve_path(os.getenv("FAQ_INDEX_DIR", "backoffice/faq_index"))
+    # FAQ count from which fuzzy matching prunes candidates instead of scoring every FAQ
+    FUZZY_PRUNE_MIN_FAQS = int(os.getenv("FUZZY_PRUNE_MIN_FAQS", "300"))
+    # Hybrid FAQ search (fonte "faiss", services/faq_corpus.py): BM25 + vector index fused
+    # by reciprocal rank (rrf) or a weighted sum of the normalized scores (weighted).
+    # Chatbots can override the fusion and thresholds (chatbot.faq_fusion / faq_*_min).
+    FAQ_HYBRID_FUSION = os.getenv("FAQ_HYBRID_FUSION", "rrf")
+    # Candidates taken from each retriever before fusing, and the RRF rank constant
+    FAQ_HYBRID_CANDIDATES = int(os.getenv("FAQ_HYBRID_CANDIDATES", "20"))
+    FAQ_HYBRID_RRF_K = int(os.getenv("FAQ_HYBRID_RRF_K", "60"))
+    # rrf: the top fused FAQ is answered if its cosine or its normalized BM25 score reaches these
+    FAQ_HYBRID_DENSE_MIN = float(os.getenv("FAQ_HYBRID_DENSE_MIN", "0.6"))
+    FAQ_HYBRID_LEXICAL_MIN = float(os.getenv("FAQ_HYBRID_LEXICAL_MIN", "0.6"))
+    # weighted: dense weight (the rest goes to BM25) and minimum fused score
+    FAQ_HYBRID_DENSE_WEIGHT = float(os.getenv("FAQ_HYBRID_DENSE_WEIGHT", "0.7"))
+    FAQ_HYBRID_MIN_SCORE = float(os.getenv("FAQ_HYBRID_MIN_SCORE", "0.5"))
+    FAQ_BM25_K1 = float(os.getenv("FAQ_BM25_K1", "1.2"))
+    FAQ_BM25_B = float(os.getenv("FAQ_BM25_B", "0.75"))
+    # Answers of /obter-resposta (services/response_cache.py): per-worker LRU and an optional
+    # Postgres tier shared by all workers; entries expire after the TTL (0 = only on writes)
+    RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "1").strip().lower() in {"1", "true", "yes", "on"}
+    RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "0").strip().lower() in {"1", "true", "yes", "on"}
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+    RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "32"))
+    RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+    # Most questions accepted by one /obter-respostas (batch) request
+    ANSWER_BATCH_MAX_QUESTIONS = int(os.getenv("ANSWER_BATCH_MAX_QUESTIONS", "500"))
+    # Sentence-transformers model used for the FAQ vector index
+    FAQ_EMBEDDING_MODEL = os.getenv("FAQ_EMBEDDING_MODEL", "all-MiniLM-L12-v2")
+    # Load the embedding models in the background at startup instead of on the first request
+    EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "1").strip().lower() in {"1", "true", "yes", "on"}
+    # Persistent cache of document embeddings in Postgres (services/embedding_store.py);
+    # entries unused for the retention period are pruned after full rebuilds (0 = never)
+    EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "1").strip().lower() in {"1", "true", "yes", "on"}
+    EMBEDDING_CACHE_RETENTION_DAYS = int(os.getenv("EMBEDDING_CACHE_RETENTION_DAYS", "30"))
+    # Processes encoding uncached texts during index builds (0/1 = in the worker itself)
+    EMBEDDING_ENCODE_PROCESSES = int(os.getenv("EMBEDDING_ENCODE_PROCESSES", "0"))
+    # Query-embedding cache (per worker), shared by FAQ and RAG searches
+    QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "4096"))
+    QUERY_EMBEDDING_CACHE_MAX_MB = float(os.getenv("QUERY_EMBEDDING_CACHE_MAX_MB", "16"))
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+    # FAISS index type per FAQ partition: auto, flat, hnsw, ivfflat, ivfpq, sq8
+    # (see services/faq_index_factory.py; compare them with `python -m app.services.faq_index_factory`)
+    FAQ_INDEX_TYPE = os.getenv("FAQ_INDEX_TYPE", "auto")
+    # auto: exact search below this many FAQs per partition, HNSW above, IVF-PQ from the next one
+    FAQ_INDEX_AUTO_HNSW_MIN = int(os.getenv("FAQ_INDEX_AUTO_HNSW_MIN", "20000"))
+    FAQ_INDEX_AUTO_IVFPQ_MIN = int(os.getenv("FAQ_INDEX_AUTO_IVFPQ_MIN", "1000000"))
+    FAQ_INDEX_HNSW_M = int(os.getenv("FAQ_INDEX_HNSW_M", "32"))
+    FAQ_INDEX_HNSW_EF_CONSTRUCTION = int(os.getenv("FAQ_INDEX_HNSW_EF_CONSTRUCTION", "80"))
+    FAQ_INDEX_EF_SEARCH = int(os.getenv("FAQ_INDEX_EF_SEARCH", "64"))
+    # IVF lists (0 = 4 * sqrt(n)) and lists probed per query
+    FAQ_INDEX_NLIST = int(os.getenv("FAQ_INDEX_NLIST", "0"))
+    FAQ_INDEX_NPROBE = int(os.getenv("FAQ_INDEX_NPROBE", "16"))
+    FAQ_INDEX_PQ_M = int(os.getenv("FAQ_INDEX_PQ_M", "48"))
+    # Incremental changes logged on top of a snapshot before it is rewritten
+    FAQ_INDEX_DELTA_MAX_ENTRIES = int(os.getenv("FAQ_INDEX_DELTA_MAX_ENTRIES", "500"))
+    # Rows fetched (server-side cursor) and encoded per step of a full/chatbot index build
+    FAQ_INDEX_BUILD_BATCH_SIZE = int(os.getenv("FAQ_INDEX_BUILD_BATCH_SIZE", "1000"))
+    # Background index builds (services/faq_index_builder.py): quiet period that closes a
+    # burst of edits, longest wait after the first edit, retry delay after a failed build,
+    # and age after which a job that stopped reporting progress is shown as stale
+    FAQ_INDEX_BUILD_DEBOUNCE_SECONDS = float(os.getenv("FAQ_INDEX_BUILD_DEBOUNCE_SECONDS", "2"))
+    FAQ_INDEX_BUILD_MAX_DELAY_SECONDS = float(os.getenv("FAQ_INDEX_BUILD_MAX_DELAY_SECONDS", "30"))
+    FAQ_INDEX_BUILD_RETRY_SECONDS = float(os.getenv("FAQ_INDEX_BUILD_RETRY_SECONDS", "60"))
+    FAQ_INDEX_BUILD_STALE_SECONDS = float(os.getenv("FAQ_INDEX_BUILD_STALE_SECONDS", "900"))
+    # How often (seconds) each worker re-reads cache_version to detect stale indexes/caches
+    CACHE_VERSION_CHECK_SECONDS = float(os.getenv("CACHE_VERSION_CHECK_SECONDS", "2"))
     # Store uploaded PDF documents under extras/documents (ignored by git)
     PDF_STORAGE_PATH = _resolve_path(os.getenv("PDF_PATH", "backoffice/app/extras/documents"))
     ICON_STORAGE_PATH = _resolve_path(os.getenv("ICON_PATH", "backoffice/app/static/icons"))
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
     RAG_EMBEDDING_MODEL = os.getenv("RAG_EMBEDDING_MODEL", "all-MiniLM-L12-v2")
     RAG_EMBEDDING_DIM = int(os.getenv("RAG_EMBEDDING_DIM", "384"))
+    # Manifests of the RAG ingestions run with manage_indexes.py (chunks live in pgvector)
+    RAG_INDEX_DIR = _resolve_path(os.getenv("RAG_INDEX_DIR", "backoffice/rag_index"))
     RAG_CHUNK_SIZE_CHARS = int(os.getenv("RAG_CHUNK_SIZE_CHARS", "1000"))
     RAG_CHUNK_OVERLAP_CHARS = int(os.getenv("RAG_CHUNK_OVERLAP_CHARS", "150"))
+    # PDF ingestion: processes extracting pages (0 = one per core, 1 = in the worker itself),
+    # pages per extraction task and chunks encoded and written per batch
+    RAG_INGEST_PROCESSES = int(os.getenv("RAG_INGEST_PROCESSES", "0"))
+    RAG_INGEST_PAGES_PER_TASK = int(os.getenv("RAG_INGEST_PAGES_PER_TASK", "25"))
+    RAG_INGEST_BATCH_SIZE = int(os.getenv("RAG_INGEST_BATCH_SIZE", "256"))
+    # How chunks are written: "copy" (binary COPY, falls back by itself) or "values"
+    RAG_CHUNK_LOADER = os.getenv("RAG_CHUNK_LOADER", "copy").strip().lower()
+    # pgvector index of rag_chunks (services/rag_ann_index.py): auto, none, hnsw or ivfflat.
+    # auto = no index below RAG_ANN_MIN_ROWS chunks, hnsw up to RAG_ANN_AUTO_IVFFLAT_MIN, then ivfflat
+    RAG_ANN_INDEX = os.getenv("RAG_ANN_INDEX", "auto")
+    RAG_ANN_MIN_ROWS = int(os.getenv("RAG_ANN_MIN_ROWS", "5000"))
+    RAG_ANN_AUTO_IVFFLAT_MIN = int(os.getenv("RAG_ANN_AUTO_IVFFLAT_MIN", "1000000"))
+    # ivfflat (lists = sqrt(rows)) is rebuilt when the table grew or shrank by this factor
+    RAG_ANN_REBUILD_GROWTH = float(os.getenv("RAG_ANN_REBUILD_GROWTH", "2"))
+    RAG_ANN_HNSW_M = int(os.getenv("RAG_ANN_HNSW_M", "16"))
+    RAG_ANN_HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_ANN_HNSW_EF_CONSTRUCTION", "64"))
+    # hnsw.ef_search until tuned (ivfflat.probes defaults to sqrt(lists))
+    RAG_ANN_EF_SEARCH = int(os.getenv("RAG_ANN_EF_SEARCH", "40"))
+    # Tuning: p95 latency target per search, sampled queries, and whether to tune after each rebuild
+    RAG_ANN_TARGET_MS = float(os.getenv("RAG_ANN_TARGET_MS", "20"))
+    RAG_ANN_TUNE_QUERIES = int(os.getenv("RAG_ANN_TUNE_QUERIES", "50"))
+    RAG_ANN_AUTOTUNE = os.getenv("RAG_ANN_AUTOTUNE", "1").strip().lower() in {"1", "true", "yes", "on"}
     RAG_TOP_K = int(os.getenv("RAG_TOP_K", "6"))
     RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.2"))
     RAG_MAX_CONTEXT_CHARS = int(os.getenv("RAG_MAX_CONTEXT_CHARS", "12000"))
+    # Semantic cache of RAG answers (services/rag_cache.py): a question within this cosine
+    # distance of one already answered from the same documents reuses its answer
+    RAG_ANSWER_CACHE = os.getenv("RAG_ANSWER_CACHE", "1").strip().lower() in {"1", "true", "yes", "on"}
+    RAG_ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("RAG_ANSWER_CACHE_MAX_DISTANCE", "0.08"))
+    RAG_ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("RAG_ANSWER_CACHE_MAX_ENTRIES", "500"))
+    RAG_ANSWER_CACHE_TTL_SECONDS = float(os.getenv("RAG_ANSWER_CACHE_TTL_SECONDS", "604800"))
     OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
     OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
     OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", "120"))
+    # LLM client (services/llm_client.py), per worker: generations running at once, callers
+    # allowed to wait for a slot (more fail at once) and for how long
+    OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+    OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "4"))
+    OLLAMA_QUEUE_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_QUEUE_TIMEOUT_SECONDS", "30"))
+    # How long Ollama keeps the model loaded after a request ("30m", or seconds; -1 = always)
+    OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+    OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1").strip().lower() in {"1", "true", "yes", "on"}
+    # Identical RAG questions in flight at the same time share one generation, also across
+    # workers (services/single_flight.py): longest wait for the worker computing it, and
+    # how long its result stays readable for the ones that waited
+    RAG_SINGLE_FLIGHT = os.getenv("RAG_SINGLE_FLIGHT", "1").strip().lower() in {"1", "true", "yes", "on"}
+    RAG_SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("RAG_SINGLE_FLIGHT_WAIT_SECONDS", "150"))
+    RAG_SINGLE_FLIGHT_RESULT_SECONDS = float(os.getenv("RAG_SINGLE_FLIGHT_RESULT_SECONDS", "30"))
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import psycopg2
 from psycopg2.pool import SimpleConnectionPool
 from pgvector.psycopg2 import register_vector
@@ -43,6 +45,70 @@ def put_pool_conn(conn):
         return
     _pool.putconn(conn)
 
+@contextmanager
+def advisory_lock(key, shared=False):
+    """Hold a Postgres session advisory lock (cross-worker) for the duration of the block.
+
+    Yields the pooled connection holding the lock, or None when the pool is not
+    initialized yet (e.g. at import time), in which case the block runs unlocked.
+    """
+    try:
+        conn = get_pool_conn()
+    except RuntimeError:
+        yield None
+        return
+    fn = "pg_advisory_lock_shared" if shared else "pg_advisory_lock"
+    unlock_fn = "pg_advisory_unlock_shared" if shared else "pg_advisory_unlock"
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT {fn}(%s);", (key,))
+        conn.commit()
+        yield conn
+    finally:
+        try:
+            conn.rollback()
+            cur.execute(f"SELECT {unlock_fn}(%s);", (key,))
+            conn.commit()
+        except Exception:
+            pass
+        try:
+            cur.close()
+        except Exception:
+            pass
+        put_pool_conn(conn)
+
+@contextmanager
+def try_advisory_lock(key):
+    """Like `advisory_lock`, without waiting: yields whether the lock was acquired.
+
+    Yields True when the pool is not initialized (the block runs unlocked).
+    """
+    try:
+        conn = get_pool_conn()
+    except RuntimeError:
+        yield True
+        return
+    cur = conn.cursor()
+    acquired = False
+    try:
+        cur.execute("SELECT pg_try_advisory_lock(%s);", (key,))
+        acquired = bool(cur.fetchone()[0])
+        conn.commit()
+        yield acquired
+    finally:
+        try:
+            conn.rollback()
+            if acquired:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (key,))
+                conn.commit()
+        except Exception:
+            pass
+        try:
+            cur.close()
+        except Exception:
+            pass
+        put_pool_conn(conn)
+
 def get_conn():
     if "db_conn" not in g:
         g.db_conn = _pool.getconn()
@@ -60,7 +126,18 @@ def ensure_schema() -> None:
 
     - Adds chatbot.ativo (global active chatbot) if missing
     - Adds faq.identificador if missing
+    - Adds the chatbot.faq_* hybrid search settings if missing
+    - Adds the pdf_documents columns recording what each PDF was last indexed from
     - Creates/initializes video_job singleton row (global cross-worker video job status)
+    - Creates cache_version (cross-worker version counters for indexes/caches)
+    - Creates index_build_job (background FAQ index builds)
+    - Creates embedding_cache (document embeddings by model + text hash)
+    - Creates response_cache (shared tier of the /obter-resposta answer cache)
+    - Creates rag_flight (claims and results of RAG answers shared by concurrent identical
+      questions)
+    - Creates rag_answer_cache (semantic cache of RAG answers)
+    - Creates rag_ann_index (state of the rag_chunks ANN index; the index itself is managed
+      by services/rag_ann_index.py)
     - Ensures there is at least one active chatbot when any exist
     """
     global _pool
@@ -92,6 +169,17 @@ def ensure_schema() -> None:
         cur.execute("ALTER TABLE chatbot ADD COLUMN IF NOT EXISTS video_no_answer_path TEXT;")
         # Optional: store last generated AI video path (reserved for future use)
         cur.execute("ALTER TABLE chatbot ADD COLUMN IF NOT EXISTS video_generated_path TEXT;")
+        # Per-chatbot hybrid FAQ search settings (NULL = Config default)
+        cur.execute("ALTER TABLE chatbot ADD COLUMN IF NOT EXISTS faq_fusion VARCHAR(16);")
+        cur.execute("ALTER TABLE chatbot ADD COLUMN IF NOT EXISTS faq_dense_min REAL;")
+        cur.execute("ALTER TABLE chatbot ADD COLUMN IF NOT EXISTS faq_lexical_min REAL;")
+        cur.execute("ALTER TABLE chatbot ADD COLUMN IF NOT EXISTS faq_dense_weight REAL;")
+        cur.execute("ALTER TABLE chatbot ADD COLUMN IF NOT EXISTS faq_hybrid_min REAL;")
+        # What each PDF was last indexed from: file hash, chunker and embedding model (NULL = never)
+        cur.execute("ALTER TABLE pdf_documents ADD COLUMN IF NOT EXISTS content_sha256 VARCHAR(64);")
+        cur.execute("ALTER TABLE pdf_documents ADD COLUMN IF NOT EXISTS chunker_version VARCHAR(64);")
+        cur.execute("ALTER TABLE pdf_documents ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(255);")
+        cur.execute("ALTER TABLE pdf_documents ADD COLUMN IF NOT EXISTS indexed_at TIMESTAMP;")
         # Add FAQ identifier (safe to run repeatedly)
         cur.execute("ALTER TABLE faq ADD COLUMN IF NOT EXISTS identificador VARCHAR(120);")
         # Add FAQ 'serve' field (A quem se destina / para que serve)
@@ -141,11 +229,114 @@ def ensure_schema() -> None:
             ON rag_chunks (pdf_id);
             """
         )
+        # The ANN index of rag_chunks.embedding is sized to the data by services/rag_ann_index.py;
+        # this row records how it was built and the tuned search settings
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rag_ann_index (
+                id INT PRIMARY KEY DEFAULT 1,
+                index_type VARCHAR(16) NOT NULL,
+                lists INT,
+                rows_at_build BIGINT,
+                built_at TIMESTAMPTZ,
+                build_seconds REAL,
+                probes INT,
+                ef_search INT,
+                tuned_at TIMESTAMPTZ,
+                report JSONB
+            );
+            """
+        )
+        # Semantic cache of RAG answers (services/rag_cache.py)
         cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS rag_answer_cache (
+                cache_id SERIAL PRIMARY KEY,
+                chatbot_id INT NOT NULL REFERENCES chatbot(chatbot_id) ON DELETE CASCADE,
+                doc_version BIGINT NOT NULL,
+                llm_model TEXT NOT NULL,
+                embedding vector({Config.RAG_EMBEDDING_DIM}) NOT NULL,
+                pergunta TEXT NOT NULL,
+                chunk_ids INT[] NOT NULL DEFAULT '{{}}',
+                resposta TEXT NOT NULL,
+                fontes JSONB NOT NULL DEFAULT '[]',
+                hits INT NOT NULL DEFAULT 0,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                last_hit_at TIMESTAMPTZ
+            );
+            """
+        )
+        cur.execute(
+            """
+            CREATE INDEX IF NOT EXISTS rag_answer_cache_chatbot_idx
+            ON rag_answer_cache (chatbot_id, doc_version);
+            """
+        )
+        # Version counters used by workers to detect stale in-memory indexes/caches
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_version (
+                scope TEXT PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        # Background FAQ index build jobs (services/faq_index_builder.py)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS index_build_job (
+                job_id SERIAL PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                chatbot_ids INT[],
+                faq_count INT NOT NULL DEFAULT 0,
+                progress INT NOT NULL DEFAULT 0,
+                message TEXT NOT NULL DEFAULT '',
+                error TEXT,
+                version BIGINT,
+                worker TEXT,
+                requested_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                started_at TIMESTAMPTZ,
+                finished_at TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        # Persistent document-embedding cache (services/embedding_store.py)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash BYTEA NOT NULL,
+                dim INT NOT NULL,
+                embedding BYTEA NOT NULL,
+                used_on DATE NOT NULL DEFAULT CURRENT_DATE,
+                PRIMARY KEY (model, text_hash)
+            );
             """
-            CREATE INDEX IF NOT EXISTS rag_chunks_embedding_idx
-            ON rag_chunks USING ivfflat (embedding vector_cosine_ops)
-            WITH (lists = 100);
+        )
+        # Shared tier of the /obter-resposta answer cache (services/response_cache.py)
+        cur.execute(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS response_cache (
+                cache_key BYTEA PRIMARY KEY,
+                chatbot_id INT NOT NULL,
+                payload JSONB NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS response_cache_created_idx ON response_cache (created_at);")
+        # RAG answers handed to concurrent identical questions (services/single_flight.py)
+        cur.execute(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS rag_flight (
+                flight_key BYTEA PRIMARY KEY,
+                result JSONB,
+                started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                finished_at TIMESTAMPTZ
+            );
             """
         )
         # Ensure singleton row exists
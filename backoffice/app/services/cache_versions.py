@@ -0,0 +1,148 @@
+"""Cross-worker version counters (table `cache_version`).
+
+Every gunicorn worker keeps in-memory indexes/caches. Writers bump the version of a
+scope (e.g. "faq_index") after changing the data behind it; readers compare the
+version they loaded against `get_versions()` and refresh when it moved. Reads are
+throttled to one query every CACHE_VERSION_CHECK_SECONDS per process.
+"""
+
+import logging
+import time
+from threading import Lock
+from typing import Dict, Optional
+
+from ..config import Config
+from ..db import get_pool_conn, put_pool_conn
+
+_versions: Dict[str, int] = {}
+_checked_at = 0.0
+_refresh_lock = Lock()
+
+
+def get_versions(max_age: Optional[float] = None) -> Dict[str, int]:
+    """Return {scope: version}, refreshed from the DB at most every `max_age` seconds.
+
+    Never blocks on a concurrent refresh: callers get the previous snapshot instead.
+    """
+    global _versions, _checked_at
+    if max_age is None:
+        max_age = Config.CACHE_VERSION_CHECK_SECONDS
+    if time.monotonic() - _checked_at < max_age:
+        return _versions
+    if not _refresh_lock.acquire(blocking=False):
+        return _versions
+    conn = None
+    cur = None
+    try:
+        conn = get_pool_conn()
+        cur = conn.cursor()
+        cur.execute("SELECT scope, version FROM cache_version;")
+        _versions = {scope: int(version) for scope, version in cur.fetchall()}
+        conn.commit()
+    except Exception as exc:
+        logging.debug("cache_version indisponível: %s", exc)
+        try:
+            if conn:
+                conn.rollback()
+        except Exception:
+            pass
+    finally:
+        _checked_at = time.monotonic()
+        try:
+            if cur:
+                cur.close()
+        except Exception:
+            pass
+        try:
+            if conn:
+                put_pool_conn(conn)
+        except Exception:
+            pass
+        _refresh_lock.release()
+    return _versions
+
+
+def get_version(scope: str) -> int:
+    return get_versions().get(scope, 0)
+
+
+def fetch_version(scope: str, conn=None) -> int:
+    """Unthrottled read of one scope (0 if missing or the DB is unavailable)."""
+    own_conn = conn is None
+    cur = None
+    try:
+        if own_conn:
+            conn = get_pool_conn()
+        cur = conn.cursor()
+        cur.execute("SELECT version FROM cache_version WHERE scope = %s;", (scope,))
+        row = cur.fetchone()
+        conn.commit()
+        return int(row[0]) if row else 0
+    except Exception:
+        try:
+            if conn:
+                conn.rollback()
+        except Exception:
+            pass
+        return 0
+    finally:
+        try:
+            if cur:
+                cur.close()
+        except Exception:
+            pass
+        if own_conn and conn is not None:
+            try:
+                put_pool_conn(conn)
+            except Exception:
+                pass
+
+
+def bump_version(scope: str, at_least: int = 0, conn=None) -> Optional[int]:
+    """Increment the version of `scope` and return it (None if the DB is unavailable).
+
+    `at_least` lets the caller keep versions monotonic with artifacts it already
+    persisted (e.g. after the table was recreated). When `conn` is given the bump
+    runs (and commits) on that connection.
+    """
+    global _versions
+    own_conn = conn is None
+    cur = None
+    try:
+        if own_conn:
+            conn = get_pool_conn()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO cache_version (scope, version) VALUES (%s, %s + 1)
+            ON CONFLICT (scope) DO UPDATE
+            SET version = GREATEST(cache_version.version, %s) + 1,
+                updated_at = NOW()
+            RETURNING version;
+            """,
+            (scope, at_least, at_least),
+        )
+        version = int(cur.fetchone()[0])
+        conn.commit()
+        # Our own writes are visible immediately, without waiting for the next refresh.
+        _versions = {**_versions, scope: version}
+        return version
+    except Exception as exc:
+        logging.warning("Não foi possível atualizar cache_version[%s]: %s", scope, exc)
+        try:
+            if conn:
+                conn.rollback()
+        except Exception:
+            pass
+        return None
+    finally:
+        try:
+            if cur:
+                cur.close()
+        except Exception:
+            pass
+        if own_conn and conn is not None:
+            try:
+                put_pool_conn(conn)
+            except Exception:
+                pass
@@ -0,0 +1,162 @@
+"""Persistent document-embedding cache (table `embedding_cache`).
+
+Embeddings are keyed by (model name, sha256 of the exact text encoded), so a rebuild
+only runs the model on texts it hasn't seen: unchanged FAQs, a restart or a bulk
+re-import of the same DOCX files are served from Postgres. Entries are stored as raw
+float32 bytes, already normalized.
+
+Lookups refresh `used_on` at most once a day per entry; `prune_embedding_cache`
+drops entries unused for EMBEDDING_CACHE_RETENTION_DAYS. Any database error makes the
+call fall back to encoding everything, so the cache can never fail a build.
+"""
+
+import hashlib
+import logging
+from threading import Lock
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from ..config import Config
+from ..db import get_pool_conn, put_pool_conn
+from .embeddings import embedding_dim, encode_documents
+
+# Keys per SELECT / rows per INSERT.
+_DB_CHUNK = 1000
+# Texts per encode call when reporting progress.
+_ENCODE_CHUNK = 512
+
+_stats_lock = Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def _fetch(cur, model_name, hashes, dim):
+    found = {}
+    for start in range(0, len(hashes), _DB_CHUNK):
+        chunk = hashes[start:start + _DB_CHUNK]
+        cur.execute(
+            """
+            SELECT text_hash, embedding FROM embedding_cache
+            WHERE model = %s AND dim = %s AND text_hash = ANY(%s)
+            """,
+            (model_name, dim, chunk),
+        )
+        for text_hash, embedding in cur.fetchall():
+            found[bytes(text_hash)] = np.frombuffer(bytes(embedding), dtype=np.float32)
+        cur.execute(
+            """
+            UPDATE embedding_cache SET used_on = CURRENT_DATE
+            WHERE model = %s AND text_hash = ANY(%s) AND used_on < CURRENT_DATE
+            """,
+            (model_name, chunk),
+        )
+    return found
+
+
+def _store(cur, model_name, dim, items):
+    for start in range(0, len(items), _DB_CHUNK):
+        execute_values(
+            cur,
+            """
+            INSERT INTO embedding_cache (model, text_hash, dim, embedding) VALUES %s
+            ON CONFLICT (model, text_hash) DO UPDATE
+            SET dim = EXCLUDED.dim, embedding = EXCLUDED.embedding, used_on = CURRENT_DATE
+            """,
+            [(model_name, text_hash, dim, emb.tobytes()) for text_hash, emb in items[start:start + _DB_CHUNK]],
+        )
+
+
+def _encode_missing(texts, model_name, progress, pool=None):
+    if progress is None or len(texts) <= _ENCODE_CHUNK:
+        return encode_documents(texts, model_name, pool=pool)
+    chunks = []
+    for start in range(0, len(texts), _ENCODE_CHUNK):
+        chunks.append(encode_documents(texts[start:start + _ENCODE_CHUNK], model_name, pool=pool))
+        done = min(start + _ENCODE_CHUNK, len(texts))
+        progress(done / len(texts), f"{done}/{len(texts)} textos codificados")
+    return np.vstack(chunks)
+
+
+def _run(fn, *args):
+    """Run `fn(cur, *args)` in its own transaction on a pooled connection."""
+    conn = get_pool_conn()
+    cur = conn.cursor()
+    try:
+        result = fn(cur, *args)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        put_pool_conn(conn)
+
+
+def encode_cached(texts, model_name=None, dim=None, progress=None, pool=None):
+    """Like `encode_documents`, but only texts missing from the cache are encoded.
+
+    `progress(fraction, message)` is called while the misses are encoded; `pool` is an
+    optional `EncodePool` for them.
+    """
+    model_name = model_name or Config.FAQ_EMBEDDING_MODEL
+    texts = list(texts)
+    if not Config.EMBEDDING_CACHE or not texts:
+        return _encode_missing(texts, model_name, progress, pool)
+    if dim is None:
+        dim = embedding_dim(model_name)
+    hashes = [_text_hash(text) for text in texts]
+    unique = list(dict.fromkeys(hashes))
+    try:
+        found = _run(_fetch, model_name, unique, dim)
+    except Exception as exc:
+        logging.warning(f"Cache de embeddings indisponível, a codificar tudo: {exc}")
+        return _encode_missing(texts, model_name, progress, pool)
+
+    # No connection is held while the model runs.
+    first = {}
+    for text_hash, text in zip(hashes, texts):
+        if text_hash not in found:
+            first.setdefault(text_hash, text)
+    if first:
+        missing = list(first)
+        new_items = list(zip(missing, _encode_missing([first[h] for h in missing], model_name, progress, pool)))
+        found.update(new_items)
+        try:
+            _run(_store, model_name, dim, new_items)
+        except Exception as exc:
+            logging.warning(f"Não foi possível gravar embeddings na cache: {exc}")
+
+    hits = len(unique) - len(first)
+    with _stats_lock:
+        _stats["hits"] += hits
+        _stats["misses"] += len(first)
+    logging.info(
+        f"Cache de embeddings ({model_name}): {hits}/{len(unique)} textos em cache, "
+        f"{len(first)} codificados"
+    )
+    return np.vstack([found[text_hash] for text_hash in hashes]).astype(np.float32, copy=False)
+
+
+def embedding_cache_stats():
+    """Hits / misses (unique texts) of this process since startup."""
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {**_stats, "hit_rate": round(_stats["hits"] / lookups, 4) if lookups else 0.0}
+
+
+def _prune(cur, days):
+    cur.execute("DELETE FROM embedding_cache WHERE used_on < CURRENT_DATE - %s", (days,))
+    return cur.rowcount
+
+
+def prune_embedding_cache(days=None):
+    """Delete entries unused for `days` (EMBEDDING_CACHE_RETENTION_DAYS by default)."""
+    days = Config.EMBEDDING_CACHE_RETENTION_DAYS if days is None else days
+    if days <= 0:
+        return 0
+    return _run(_prune, int(days))
@@ -0,0 +1,178 @@
+"""Shared sentence-embedding models.
+
+Each distinct model is loaded once per process, on first use or through `warm_up`,
+and shared by the FAQ retrieval and RAG paths. Encoding is serialized per model:
+the fast tokenizers are not safe to call from several threads at once.
+"""
+
+import logging
+import time
+from threading import Lock
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from ..config import Config
+from .cache import LRUCache
+
+_models = {}
+_stats = {}
+_load_locks = {}
+_encode_locks = {}
+_registry_lock = Lock()
+
+# (model_name, query text) -> read-only embedding row. Kiosk traffic repeats a few
+# hundred questions, so most queries skip the forward pass.
+_query_cache = LRUCache(
+    max_entries=Config.QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+    max_bytes=int(Config.QUERY_EMBEDDING_CACHE_MAX_MB * 1024 * 1024),
+    ttl=Config.QUERY_EMBEDDING_CACHE_TTL_SECONDS or None,
+)
+
+
+def _locks_for(model_name):
+    with _registry_lock:
+        if model_name not in _load_locks:
+            _load_locks[model_name] = Lock()
+            _encode_locks[model_name] = Lock()
+        return _load_locks[model_name], _encode_locks[model_name]
+
+
+def get_model(model_name):
+    """Return the loaded model, loading it on first use."""
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    load_lock, _ = _locks_for(model_name)
+    # Per-model lock: loading one model doesn't block users of another one.
+    with load_lock:
+        model = _models.get(model_name)
+        if model is not None:
+            return model
+        started = time.perf_counter()
+        model = SentenceTransformer(model_name)
+        elapsed = time.perf_counter() - started
+        try:
+            param_bytes = sum(p.numel() * p.element_size() for p in model.parameters())
+        except Exception:
+            param_bytes = None
+        _stats[model_name] = {
+            "model": model_name,
+            "dim": model.get_sentence_embedding_dimension(),
+            "load_seconds": round(elapsed, 3),
+            "param_bytes": param_bytes,
+        }
+        _models[model_name] = model
+        logging.info(
+            f"Modelo de embeddings '{model_name}' carregado em {elapsed:.2f}s "
+            f"({(param_bytes or 0) / 1e6:.1f} MB de parâmetros)"
+        )
+        return model
+
+
+def _encode(texts, model_name, batch_size):
+    model = get_model(model_name)
+    _, encode_lock = _locks_for(model_name)
+    with encode_lock:
+        embeddings = model.encode(
+            list(texts),
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def encode_queries(texts, model_name=None):
+    """L2-normalized float32 embeddings (n, dim) for short query strings.
+
+    Results are cached per (model, text): callers pass already normalized text so
+    that trivial variations of a question share one entry.
+    """
+    model_name = model_name or Config.FAQ_EMBEDDING_MODEL
+    texts = list(texts)
+    rows = [_query_cache.get((model_name, text)) for text in texts]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        embeddings = _encode([texts[i] for i in missing], model_name, batch_size=32)
+        for i, emb in zip(missing, embeddings):
+            emb = emb.copy()
+            emb.setflags(write=False)
+            _query_cache.put((model_name, texts[i]), emb)
+            rows[i] = emb
+    return np.vstack(rows) if rows else np.zeros((0, embedding_dim(model_name)), dtype=np.float32)
+
+
+def query_cache_stats():
+    return _query_cache.stats()
+
+
+def encode_documents(texts, model_name=None, batch_size=64, pool=None):
+    """L2-normalized float32 embeddings (n, dim) for documents / chunks.
+
+    With an `EncodePool`, batches larger than `batch_size` are spread over its processes.
+    """
+    if pool is not None and len(texts) > batch_size:
+        return pool.encode(texts, batch_size=batch_size)
+    return _encode(texts, model_name or Config.FAQ_EMBEDDING_MODEL, batch_size=batch_size)
+
+
+class EncodePool:
+    """Multi-process encoding for bulk index builds.
+
+    The worker processes (EMBEDDING_ENCODE_PROCESSES by default, each with its own copy
+    of the model) are only started on the first `encode`, so a build served from the
+    embedding cache doesn't pay for them. Use as a context manager; with fewer than
+    two processes it encodes in-process.
+    """
+
+    def __init__(self, model_name=None, processes=None):
+        self.model_name = model_name or Config.FAQ_EMBEDDING_MODEL
+        self.processes = Config.EMBEDDING_ENCODE_PROCESSES if processes is None else processes
+        self._pool = None
+
+    def encode(self, texts, batch_size=64):
+        if self.processes < 2:
+            return _encode(texts, self.model_name, batch_size=batch_size)
+        model = get_model(self.model_name)
+        if self._pool is None:
+            self._pool = model.start_multi_process_pool(target_devices=["cpu"] * self.processes)
+            logging.info(f"Pool de codificação iniciado com {self.processes} processos ({self.model_name})")
+        embeddings = model.encode_multi_process(
+            list(texts), self._pool, batch_size=batch_size, normalize_embeddings=True
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def close(self):
+        if self._pool is not None:
+            get_model(self.model_name).stop_multi_process_pool(self._pool)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def embedding_dim(model_name=None):
+    return get_model(model_name or Config.FAQ_EMBEDDING_MODEL).get_sentence_embedding_dimension()
+
+
+def configured_models():
+    return list(dict.fromkeys([Config.FAQ_EMBEDDING_MODEL, Config.RAG_EMBEDDING_MODEL]))
+
+
+def warm_up(model_names=None):
+    """Load the models and run one encode so the first request doesn't pay for it."""
+    for model_name in model_names or configured_models():
+        try:
+            _encode(["warm-up"], model_name, batch_size=1)
+        except Exception as e:
+            logging.error(f"Erro ao pré-carregar modelo de embeddings '{model_name}': {e}")
+
+
+def model_stats():
+    """Load time, parameter memory and dimension of the models loaded so far."""
+    return [dict(stats) for stats in _stats.values()]
@@ -0,0 +1,374 @@
+"""Per-(chatbot, idioma) in-memory FAQ corpus for fuzzy and lexical matching.
+
+Keeps the FAQ questions already run through `preprocess_text_for_matching`, together
+with the fields the chat endpoints return (categoria, video status, documents), so a
+fuzzy lookup is a single batched RapidFuzz call with no DB round trip. A BM25 index
+over the same questions is built on the first lexical lookup (used by the hybrid
+search, services/faq_hybrid.py), as are the chatbot's hybrid search settings.
+
+Invalidation goes through cache_version: every write to a chatbot's FAQs (or to its
+video settings) calls `invalidate_faq_cache(chatbot_id)`, which bumps the scope
+`faq:<chatbot_id>`; each worker reloads the corpus on the next lookup.
+"""
+
+import logging
+from threading import Lock
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from ..config import Config
+from ..db import get_conn
+from .cache_versions import bump_version, get_version
+from .text import preprocess_text, preprocess_text_for_matching
+
+# idioma values that narrow the corpus; anything else searches all the chatbot's FAQs.
+_IDIOMAS = {"pt", "en"}
+
+
+def normalize_question(text):
+    """Key of the exact-match map: what LOWER(pergunta) = LOWER(%s) matched, minus
+    leading/trailing/repeated whitespace."""
+    return " ".join((text or "").lower().split())
+
+
+def faq_scope(chatbot_id):
+    return f"faq:{int(chatbot_id)}"
+
+
+def invalidate_faq_cache(*chatbot_ids):
+    """Mark the cached FAQ corpus of the given chatbots as stale (in every worker)."""
+    for chatbot_id in {int(c) for c in chatbot_ids if c is not None}:
+        bump_version(faq_scope(chatbot_id))
+        # list(): request threads insert into _corpora while we look.
+        for key in [k for k in list(_corpora) if k[0] == chatbot_id]:
+            _corpora.pop(key, None)
+
+
+class FaqCorpus:
+    """Columns of one chatbot's FAQs (optionally a single idioma), ordered by faq_id."""
+
+    __slots__ = (
+        "version", "video_enabled", "faq_ids", "perguntas", "respostas", "idiomas",
+        "categoria_ids", "video_status", "documentos", "processed", "hybrid", "_exact", "_prune",
+        "_positions", "_bm25",
+    )
+
+    def __init__(self, version, rows, video_enabled=False, hybrid=None):
+        self.version = version
+        self.video_enabled = video_enabled
+        # Per-chatbot overrides of the hybrid search settings (None = Config default).
+        self.hybrid = dict(hybrid or {})
+        self.faq_ids = [r[0] for r in rows]
+        self.perguntas = [r[1] for r in rows]
+        self.respostas = [r[2] for r in rows]
+        self.idiomas = [r[3] for r in rows]
+        self.categoria_ids = [r[4] for r in rows]
+        self.video_status = [r[5] for r in rows]
+        self.documentos = [list(r[6] or []) for r in rows]
+        self.processed = [preprocess_text_for_matching(p) for p in self.perguntas]
+        # normalized pergunta -> first position; suggested questions are sent back verbatim.
+        self._exact = {}
+        for pos, pergunta in enumerate(self.perguntas):
+            self._exact.setdefault(normalize_question(pergunta), pos)
+        # Candidate pruning structures, built on the first lookup of a large corpus.
+        self._prune = None
+        self._positions = {faq_id: pos for pos, faq_id in enumerate(self.faq_ids)}
+        self._bm25 = None
+
+    def __len__(self):
+        return len(self.faq_ids)
+
+    def record(self, pos, score=None):
+        return {
+            "faq_id": self.faq_ids[pos],
+            "pergunta": self.perguntas[pos],
+            "resposta": self.respostas[pos],
+            "idioma": self.idiomas[pos],
+            "categoria_id": self.categoria_ids[pos],
+            "video_status": self.video_status[pos],
+            "documentos": list(self.documentos[pos]),
+            "video_enabled": self.video_enabled,
+            "score": score,
+        }
+
+    def position(self, faq_id):
+        """Position of `faq_id` in the corpus, or None if it isn't (or no longer) there."""
+        return self._positions.get(int(faq_id))
+
+    def lexical_search(self, pergunta, n):
+        """Top `n` FAQs by BM25 over the questions: [(pos, score)], score in 0-1."""
+        if not self.perguntas or n <= 0:
+            return []
+        if self._bm25 is None:
+            self._bm25 = _Bm25Index([preprocess_text(p or "").split() for p in self.perguntas])
+        return self._bm25.top(preprocess_text(pergunta or "").split(), n)
+
+    def exact_match(self, pergunta):
+        """The FAQ whose question equals `pergunta` (case/whitespace-insensitive), or None."""
+        pos = self._exact.get(normalize_question(pergunta))
+        return None if pos is None else self.record(pos)
+
+    def best_match(self, pergunta, threshold):
+        """Best max(ratio, token_set_ratio) >= threshold; ties go to the lowest faq_id."""
+        if not self.processed:
+            return None
+        query = preprocess_text_for_matching(pergunta)
+        if len(self.processed) >= Config.FUZZY_PRUNE_MIN_FAQS and threshold > 0:
+            if self._prune is None:
+                self._prune = _PruneIndex(self.processed)
+            shared = self._prune.shared(query)
+            shared_scores = self._scores(query, shared, threshold)
+            # Only FAQs that can reach the best exact score so far are worth scoring.
+            cutoff = max(float(threshold), float(shared_scores.max(initial=0)))
+            others = self._prune.bounded(query, cutoff, exclude=shared)
+            positions = np.concatenate([shared, others])
+            scores = np.concatenate([shared_scores, self._scores(query, others, cutoff)])
+        else:
+            positions = np.arange(len(self.processed))
+            scores = self._scores(query, positions, threshold)
+        if not len(positions):
+            return None
+        # Highest score first, lowest position (= faq_id order) on ties.
+        best = int(np.lexsort((positions, -scores))[0])
+        score = float(scores[best])
+        if score <= 0 or score < threshold:
+            return None
+        return self.record(int(positions[best]), score)
+
+    def _scores(self, query, positions, cutoff):
+        if not len(positions):
+            return np.zeros(0, dtype=np.float64)
+        choices = self.processed if len(positions) == len(self.processed) else [self.processed[p] for p in positions]
+        # cdist may drop scores within float noise of score_cutoff; the caller compares
+        # against the real threshold anyway.
+        cutoff = max(0.0, cutoff - _CUTOFF_SLACK)
+        return np.maximum(
+            process.cdist([query], choices, scorer=fuzz.ratio, score_cutoff=cutoff, dtype=np.float64)[0],
+            process.cdist([query], choices, scorer=fuzz.token_set_ratio, score_cutoff=cutoff, dtype=np.float64)[0],
+        )
+
+
+_CUTOFF_SLACK = 0.01
+
+# Character classes of preprocess_text_for_matching output (lowercase ASCII after
+# unidecode, digits, "_" and the token separator); anything else shares one bucket.
+_ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789_ "
+_CHAR_BUCKET = {ch: i for i, ch in enumerate(_ALPHABET)}
+_OTHER_BUCKET = len(_ALPHABET)
+
+
+def _histogram(text):
+    hist = np.zeros(len(_ALPHABET) + 1, dtype=np.int32)
+    for ch in text:
+        hist[_CHAR_BUCKET.get(ch, _OTHER_BUCKET)] += 1
+    return hist
+
+
+def _token_set_text(text):
+    return " ".join(sorted(set(text.split())))
+
+
+class _PruneIndex:
+    """Candidate selection for `FaqCorpus.best_match` that never drops a FAQ that
+    could score >= the threshold.
+
+    * FAQs sharing a token with the query go through an inverted index and are always
+      scored exactly: token_set_ratio can reach 100 for them (subset match) and there
+      is no cheap bound.
+    * For the rest both scorers reduce to an Indel ratio, 200 * LCS / (len_a + len_b):
+      `ratio` on the strings, `token_set_ratio` on the sorted token sets (their
+      intersection is empty). LCS is bounded by min(len_a, len_b), which gives a length
+      window found by binary search, and by the overlap of the character histograms.
+      Only FAQs whose bound reaches the cutoff are scored.
+
+    The cutoff is raised to the best exact score among the token-sharing FAQs before
+    the bounds are applied. A plain trigram-count filter can't give this guarantee
+    at a 70% threshold: short strings can match at that level without sharing any
+    trigram.
+    """
+
+    def __init__(self, processed):
+        n = len(processed)
+        postings = {}
+        for pos, text in enumerate(processed):
+            for token in set(text.split()):
+                postings.setdefault(token, []).append(pos)
+        self.postings = {token: np.asarray(p, dtype=np.int32) for token, p in postings.items()}
+        set_texts = [_token_set_text(text) for text in processed]
+        self.len_raw = np.fromiter((len(t) for t in processed), dtype=np.int32, count=n)
+        self.len_set = np.fromiter((len(t) for t in set_texts), dtype=np.int32, count=n)
+        self.hist_raw = np.vstack([_histogram(t) for t in processed])
+        self.hist_set = np.vstack([_histogram(t) for t in set_texts])
+        if self.hist_raw.max(initial=0) < np.iinfo(np.uint16).max:
+            self.hist_raw = self.hist_raw.astype(np.uint16)
+            self.hist_set = self.hist_set.astype(np.uint16)
+        self.order_raw = np.argsort(self.len_raw, kind="stable").astype(np.int32)
+        self.order_set = np.argsort(self.len_set, kind="stable").astype(np.int32)
+        self.sorted_len_raw = self.len_raw[self.order_raw]
+        self.sorted_len_set = self.len_set[self.order_set]
+
+    @staticmethod
+    def _window(order, sorted_lengths, qlen, cutoff):
+        # 200 * min(q, c) / (q + c) >= cutoff  <=>  q*t/(200-t) <= c <= q*(200-t)/t
+        if cutoff >= 200:
+            return order[:0]
+        lo = qlen * cutoff / (200.0 - cutoff)
+        hi = qlen * (200.0 - cutoff) / cutoff
+        start = int(np.searchsorted(sorted_lengths, np.ceil(lo - 1e-9), side="left"))
+        end = int(np.searchsorted(sorted_lengths, np.floor(hi + 1e-9), side="right"))
+        return order[start:end]
+
+    @staticmethod
+    def _bound(hist, lengths, positions, qhist, qlen):
+        overlap = np.minimum(hist[positions], qhist).sum(axis=1, dtype=np.int64)
+        denom = lengths[positions].astype(np.int64) + qlen
+        # Two empty strings have ratio 100.
+        return np.where(denom > 0, 200.0 * overlap / np.maximum(denom, 1), 100.0)
+
+    def shared(self, query):
+        """Sorted positions of the FAQs sharing at least one token with `query`."""
+        hits = [self.postings[t] for t in set(query.split()) if t in self.postings]
+        if not hits:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(hits)).astype(np.int64)
+
+    def bounded(self, query, cutoff, exclude=()):
+        """Positions outside `exclude` whose upper bound reaches `cutoff`."""
+        query_set = _token_set_text(query)
+        qlen, qlen_set = len(query), len(query_set)
+        window = np.union1d(
+            self._window(self.order_raw, self.sorted_len_raw, qlen, cutoff),
+            self._window(self.order_set, self.sorted_len_set, qlen_set, cutoff),
+        )
+        if len(exclude):
+            window = np.setdiff1d(window, exclude, assume_unique=True)
+        if len(window):
+            upper = np.maximum(
+                self._bound(self.hist_raw, self.len_raw, window, _histogram(query), qlen),
+                self._bound(self.hist_set, self.len_set, window, _histogram(query_set), qlen_set),
+            )
+            window = window[upper >= cutoff - 1e-9]
+        return window.astype(np.int64)
+
+
+class _Bm25Index:
+    """Okapi BM25 over token lists, as an inverted index of precomputed term weights.
+
+    Each posting stores idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avglen)), so a
+    query only sums the postings of its tokens. Scores are divided by the sum of the
+    query tokens' idf (tokens the corpus doesn't have count with the highest idf): a FAQ
+    of average length containing every query token once scores 1, so the 0-1 scale
+    doesn't depend on the corpus size or the query length. Longer matches are capped at 1.
+    """
+
+    def __init__(self, docs, k1=None, b=None):
+        k1 = Config.FAQ_BM25_K1 if k1 is None else k1
+        b = Config.FAQ_BM25_B if b is None else b
+        self.n = len(docs)
+        lengths = np.fromiter((len(d) for d in docs), dtype=np.float64, count=self.n)
+        avglen = float(lengths.mean()) if self.n and lengths.sum() else 1.0
+        norm = k1 * (1.0 - b + b * lengths / avglen)
+        postings = {}
+        for pos, tokens in enumerate(docs):
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((pos, tf))
+        self.unknown_idf = self._idf(0)
+        self.idf = {}
+        self.postings = {}
+        for token, entries in postings.items():
+            idf = self._idf(len(entries))
+            positions = np.fromiter((p for p, _ in entries), dtype=np.int32, count=len(entries))
+            tf = np.fromiter((t for _, t in entries), dtype=np.float64, count=len(entries))
+            self.idf[token] = idf
+            self.postings[token] = (positions, (idf * tf * (k1 + 1.0) / (tf + norm[positions])).astype(np.float32))
+
+    def _idf(self, df):
+        return float(np.log(1.0 + (self.n - df + 0.5) / (df + 0.5)))
+
+    def top(self, tokens, n):
+        tokens = set(tokens)
+        hits = [self.postings[t] for t in tokens if t in self.postings]
+        if not hits:
+            return []
+        scores = np.zeros(self.n, dtype=np.float32)
+        for positions, weights in hits:
+            scores[positions] += weights
+        max_score = sum(self.idf.get(t, self.unknown_idf) for t in tokens)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > n:
+            candidates = candidates[np.argpartition(-scores[candidates], n - 1)[:n]]
+        # Highest score first, lowest position (= faq_id order) on ties.
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(int(pos), min(1.0, float(scores[pos]) / max_score)) for pos in candidates]
+
+
+_corpora = {}
+# One load lock per (chatbot_id, idioma): reloading one chatbot doesn't hold up the others.
+_load_locks = {}
+_registry_lock = Lock()
+
+# Hybrid search settings that chatbots can override (chatbot columns of the same name).
+HYBRID_SETTINGS = ("faq_fusion", "faq_dense_min", "faq_lexical_min", "faq_dense_weight", "faq_hybrid_min")
+
+
+def _load_corpus(chatbot_id, idioma, version):
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        sql = """
+            SELECT f.faq_id, f.pergunta, f.resposta, f.idioma, f.categoria_id, f.video_status,
+                   COALESCE(ARRAY_AGG(d.link ORDER BY d.link) FILTER (WHERE d.link IS NOT NULL), '{}')
+            FROM faq f
+            LEFT JOIN faq_documento d ON d.faq_id = f.faq_id
+            WHERE f.chatbot_id = %s
+        """
+        params = [chatbot_id]
+        if idioma:
+            sql += " AND f.idioma = %s"
+            params.append(idioma)
+        cur.execute(sql + " GROUP BY f.faq_id ORDER BY f.faq_id", params)
+        rows = cur.fetchall()
+        cur.execute(
+            f"SELECT video_enabled, {', '.join(HYBRID_SETTINGS)} FROM chatbot WHERE chatbot_id = %s",
+            (chatbot_id,),
+        )
+        row = cur.fetchone()
+        if not row:
+            return FaqCorpus(version, rows)
+        return FaqCorpus(version, rows, video_enabled=bool(row[0]), hybrid=dict(zip(HYBRID_SETTINGS, row[1:])))
+    finally:
+        cur.close()
+
+
+def _load_lock_for(key):
+    with _registry_lock:
+        lock = _load_locks.get(key)
+        if lock is None:
+            lock = _load_locks[key] = Lock()
+        return lock
+
+
+def get_corpus(chatbot_id, idioma=None):
+    chatbot_id = int(chatbot_id)
+    idioma = (idioma or "").strip().lower()[:2] or None
+    if idioma not in _IDIOMAS:
+        idioma = None
+    key = (chatbot_id, idioma)
+    # Read the version before loading: a write racing with the load bumps it again,
+    # so the next lookup reloads instead of keeping a stale corpus.
+    version = get_version(faq_scope(chatbot_id))
+    corpus = _corpora.get(key)
+    if corpus is not None and corpus.version == version:
+        return corpus
+    with _load_lock_for(key):
+        corpus = _corpora.get(key)
+        if corpus is not None and corpus.version == version:
+            return corpus
+        corpus = _load_corpus(chatbot_id, idioma, version)
+        _corpora[key] = corpus
+        logging.debug(f"Corpus de FAQs carregado para chatbot {chatbot_id} ({idioma or '*'}): {len(corpus)} FAQs")
+        return corpus
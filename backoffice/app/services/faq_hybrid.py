@@ -0,0 +1,111 @@
+"""Hybrid FAQ search: BM25 over the questions + the vector index, in one pass.
+
+Both retrievers return their top FAQ_HYBRID_CANDIDATES for the chatbot (and idioma);
+the lists are fused and only the best FAQ is checked against the thresholds:
+
+    rrf       rank by sum(1 / (FAQ_HYBRID_RRF_K + rank)) over both lists; answer if the
+              best FAQ's cosine >= dense_min or its normalized BM25 >= lexical_min
+    weighted  rank by dense_weight * cosine + (1 - dense_weight) * BM25; answer if that
+              is >= min_score
+
+A FAQ missing from one list counts 0 there. The thresholds come from Config unless the
+chatbot overrides them (chatbot.faq_fusion, faq_dense_min, faq_lexical_min,
+faq_dense_weight, faq_hybrid_min; see the /chatbots/<id>/pesquisa-hibrida endpoint).
+
+Vector hits are mapped onto the FAQ corpus, which follows the database exactly: FAQs
+deleted since the index was last updated are dropped, and FAQs not indexed yet can
+still be found lexically. Without a vector index the search is BM25 alone.
+"""
+
+from ..config import Config
+from .faq_corpus import get_corpus
+from .retreival import dense_candidates_batch
+
+FUSIONS = ("rrf", "weighted")
+
+
+def hybrid_settings(corpus):
+    """Effective settings of the corpus' chatbot (its overrides over the Config defaults)."""
+    overrides = corpus.hybrid
+    fusion = (overrides.get("faq_fusion") or Config.FAQ_HYBRID_FUSION or "rrf").strip().lower()
+
+    def _value(key, default):
+        value = overrides.get(key)
+        return float(default if value is None else value)
+
+    return {
+        "fusion": fusion if fusion in FUSIONS else "rrf",
+        "dense_min": _value("faq_dense_min", Config.FAQ_HYBRID_DENSE_MIN),
+        "lexical_min": _value("faq_lexical_min", Config.FAQ_HYBRID_LEXICAL_MIN),
+        "dense_weight": _value("faq_dense_weight", Config.FAQ_HYBRID_DENSE_WEIGHT),
+        "min_score": _value("faq_hybrid_min", Config.FAQ_HYBRID_MIN_SCORE),
+    }
+
+
+def fuse(dense, lexical, settings):
+    """Best FAQ of the two ranked candidate lists, or None below the thresholds.
+
+    `dense` and `lexical` are [(pos, score)] best first. Returns
+    (pos, fused score, cosine, BM25).
+    """
+    dense_scores = dict(dense)
+    lexical_scores = dict(lexical)
+    fused = {}
+    if settings["fusion"] == "weighted":
+        weight = min(max(settings["dense_weight"], 0.0), 1.0)
+        for pos in dense_scores.keys() | lexical_scores.keys():
+            fused[pos] = weight * max(dense_scores.get(pos, 0.0), 0.0) + (1.0 - weight) * lexical_scores.get(pos, 0.0)
+    else:
+        for ranked in (dense, lexical):
+            for rank, (pos, _) in enumerate(ranked, start=1):
+                fused[pos] = fused.get(pos, 0.0) + 1.0 / (Config.FAQ_HYBRID_RRF_K + rank)
+    if not fused:
+        return None
+    # Highest fused score first, lowest position (= faq_id order) on ties.
+    best = min(fused, key=lambda pos: (-fused[pos], pos))
+    cosine = dense_scores.get(best, 0.0)
+    bm25 = lexical_scores.get(best, 0.0)
+    if settings["fusion"] == "weighted":
+        if fused[best] < settings["min_score"]:
+            return None
+    elif cosine < settings["dense_min"] and bm25 < settings["lexical_min"]:
+        return None
+    return best, fused[best], cosine, bm25
+
+
+def obter_faq_hibrida(pergunta, chatbot_id, idioma=None):
+    """Best FAQ for `pergunta` by hybrid search, or None.
+
+    Same fields as `obter_faq_mais_semelhante`, with score the fused score plus
+    dense_score (cosine), lexical_score (BM25, 0-1) and fusion.
+    """
+    return obter_faqs_hibridas([pergunta], chatbot_id, idioma)[0]
+
+
+def obter_faqs_hibridas(perguntas, chatbot_id, idioma=None):
+    """`obter_faq_hibrida` for a list of questions (batched vector search)."""
+    perguntas = list(perguntas)
+    corpus = get_corpus(chatbot_id, idioma)
+    if not len(corpus):
+        return [None] * len(perguntas)
+    settings = hybrid_settings(corpus)
+    n = max(Config.FAQ_HYBRID_CANDIDATES, 1)
+    results = []
+    for pergunta, candidates in zip(perguntas, dense_candidates_batch(perguntas, chatbot_id, idioma, n)):
+        dense = []
+        for score, row in candidates:
+            pos = corpus.position(row[0])
+            if pos is not None:
+                dense.append((pos, score))
+        match = fuse(dense, corpus.lexical_search(pergunta, n), settings)
+        if match is None:
+            results.append(None)
+            continue
+        pos, score, cosine, bm25 = match
+        results.append({
+            **corpus.record(pos, score),
+            "dense_score": cosine,
+            "lexical_score": bm25,
+            "fusion": settings["fusion"],
+        })
+    return results
@@ -0,0 +1,410 @@
+"""Background builder for the FAQ vector index.
+
+Admin endpoints don't update the index inside the request: they call
+`schedule_faqs`, `schedule_chatbot_removal` or `schedule_rebuild` and return. One
+daemon thread per worker waits until edits stop arriving
+(FAQ_INDEX_BUILD_DEBOUNCE_SECONDS without a new one, at most
+FAQ_INDEX_BUILD_MAX_DELAY_SECONDS after the first), then applies everything queued
+so far as a single job:
+
+    full rebuild    replaces everything else queued
+    missing index   built at startup when there is none (`schedule_missing_index`)
+    chatbots        removed chatbots dropped, rebuilt chatbots re-encoded
+    faqs            changed faq_ids upserted (deleted ones are removed)
+
+The new partitions are encoded off to the side and swapped in when complete (see
+`build_faiss_index` / `upsert_faqs_in_index`); searches keep the previous ones until
+then. The fuzzy-match corpus is invalidated when the change is scheduled, so it never
+lags behind the database.
+
+Jobs are recorded in index_build_job; `get_index_build_status` reads them for the
+status endpoint.
+"""
+
+import logging
+import os
+import socket
+import time
+from threading import Condition, Lock, Thread
+
+from flask import current_app
+
+from ..config import Config
+from ..db import get_pool_conn, put_pool_conn
+from .embedding_store import embedding_cache_stats, prune_embedding_cache
+from .faq_corpus import invalidate_faq_cache
+from .retreival import (
+    build_faiss_index,
+    build_missing_index,
+    invalidate_faqs,
+    loaded_index_version,
+    remove_chatbot_from_index,
+    upsert_faqs_in_index,
+)
+
+_cond = Condition()
+_pending = None
+_first_change = 0.0
+_last_change = 0.0
+_retry_at = 0.0
+# index_build_job row of the pending changes ('queued'), see _QueuedJob.
+_queued_job = None
+# Bumped on every change to _pending, so job row writes can be ordered.
+_revision = 0
+_worker = None
+_app = None
+
+_WORKER_NAME = f"{socket.gethostname()}:{os.getpid()}"
+_KEEP_JOBS_DAYS = 7
+
+
+def _empty():
+    return {"full": False, "missing": False, "chatbots": set(), "removed_chatbots": set(), "faq_ids": set()}
+
+
+def _kind(pending):
+    if pending["full"] or pending["missing"]:
+        return "full"
+    if pending["chatbots"] or pending["removed_chatbots"]:
+        return "chatbots"
+    return "faqs"
+
+
+def _merge(into, other):
+    into["full"] = into["full"] or other["full"]
+    into["missing"] = into["missing"] or other["missing"]
+    for key in ("chatbots", "removed_chatbots", "faq_ids"):
+        into[key] |= other[key]
+
+
+def _execute(sql, params=(), fetch=False):
+    """Best-effort statement on a pooled connection (job bookkeeping never fails a build)."""
+    conn = None
+    cur = None
+    try:
+        conn = get_pool_conn()
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall() if fetch else None
+        conn.commit()
+        return rows
+    except Exception as exc:
+        logging.debug("index_build_job indisponível: %s", exc)
+        try:
+            if conn:
+                conn.rollback()
+        except Exception:
+            pass
+        return None
+    finally:
+        try:
+            if cur:
+                cur.close()
+        except Exception:
+            pass
+        try:
+            if conn:
+                put_pool_conn(conn)
+        except Exception:
+            pass
+
+
+class _QueuedJob:
+    """The 'queued' index_build_job row of one set of pending changes.
+
+    The row is written after `_cond` is released, so scheduling a change never holds
+    up the builder or the status endpoint on a DB round trip. `lock` orders the writes
+    of this row; each one writes the newest snapshot, so threads that were waiting
+    for it usually find their change already recorded.
+    """
+
+    __slots__ = ("lock", "job_id", "latest", "written")
+
+    def __init__(self):
+        self.lock = Lock()
+        self.job_id = None
+        self.latest = None
+        self.written = 0
+
+    def update(self, pending):
+        """Snapshot what the row needs from `pending`; call with `_cond` held."""
+        global _revision
+        _revision += 1
+        chatbot_ids = sorted(pending["chatbots"] | pending["removed_chatbots"])
+        self.latest = (_revision, _kind(pending), chatbot_ids, len(pending["faq_ids"]))
+
+
+def _record_queued(job):
+    """Create or update the job's 'queued' row; returns its id (None if the DB is unavailable)."""
+    with job.lock:
+        revision, kind, chatbot_ids, faq_count = job.latest
+        if revision <= job.written:
+            return job.job_id
+        if job.job_id is None:
+            rows = _execute(
+                """
+                INSERT INTO index_build_job (kind, status, chatbot_ids, faq_count, message, worker)
+                VALUES (%s, 'queued', %s, %s, 'Em espera', %s)
+                RETURNING job_id;
+                """,
+                (kind, chatbot_ids, faq_count, _WORKER_NAME),
+                fetch=True,
+            )
+            if not rows:
+                # Not written: a later snapshot (or the builder) tries the INSERT again.
+                return None
+            job.job_id = rows[0][0]
+        else:
+            _execute(
+                "UPDATE index_build_job SET kind=%s, chatbot_ids=%s, faq_count=%s, updated_at=NOW() WHERE job_id=%s",
+                (kind, chatbot_ids, faq_count, job.job_id),
+            )
+        job.written = revision
+        return job.job_id
+
+
+def _update_job(job_id, **fields):
+    if job_id is None or not fields:
+        return
+    cols = [f"{k}=%s" for k in fields]
+    if fields.get("status") == "processing":
+        cols.append("started_at=NOW()")
+    if fields.get("status") in {"done", "error"}:
+        cols.append("finished_at=NOW()")
+    cols.append("updated_at=NOW()")
+    _execute(f"UPDATE index_build_job SET {', '.join(cols)} WHERE job_id=%s", (*fields.values(), job_id))
+
+
+def _schedule(app, change):
+    global _pending, _queued_job, _first_change, _last_change, _worker, _app
+    with _cond:
+        now = time.monotonic()
+        if _pending is None:
+            _pending, _queued_job = _empty(), _QueuedJob()
+            _first_change = now
+        _merge(_pending, change)
+        _last_change = now
+        job = _queued_job
+        job.update(_pending)
+        if app is not None:
+            _app = app
+        if _worker is None or not _worker.is_alive():
+            _worker = Thread(target=_run, name="faq-index-builder", daemon=True)
+            _worker.start()
+        _cond.notify()
+    return {"job_id": _record_queued(job), "status": "queued"}
+
+
+def _current_app():
+    try:
+        return current_app._get_current_object()
+    except RuntimeError:
+        return None
+
+
+def schedule_faqs(faq_ids, chatbot_ids=()):
+    """Queue an upsert of `faq_ids` (ids no longer in the database are removed).
+
+    `chatbot_ids` are owners the caller already knows, e.g. of a FAQ it just deleted,
+    which can no longer be looked up in the database (nor in an index that never had it).
+    """
+    faq_ids = {int(faq_id) for faq_id in faq_ids}
+    if not faq_ids:
+        return None
+    invalidate_faqs(faq_ids, chatbot_ids)
+    change = _empty()
+    change["faq_ids"] = faq_ids
+    return _schedule(_current_app(), change)
+
+
+def schedule_chatbot_removal(chatbot_id):
+    invalidate_faq_cache(chatbot_id)
+    change = _empty()
+    change["removed_chatbots"] = {int(chatbot_id)}
+    return _schedule(_current_app(), change)
+
+
+def schedule_rebuild(chatbot_id=None):
+    """Queue a rebuild of one chatbot's partitions, or of the whole index."""
+    change = _empty()
+    if chatbot_id:
+        invalidate_faq_cache(chatbot_id)
+        change["chatbots"] = {int(chatbot_id)}
+    else:
+        change["full"] = True
+    return _schedule(_current_app(), change)
+
+
+def schedule_missing_index(app=None):
+    """Queue a build for a worker that started without a usable index.
+
+    Only one worker builds it (the others load it when it's published), and nothing
+    is done if an index appeared in the meantime (e.g. built with manage_indexes.py).
+    """
+    change = _empty()
+    change["missing"] = True
+    return _schedule(app or _current_app(), change)
+
+
+def _wait_for_batch():
+    """Block until the pending changes are due; return them with their job."""
+    global _pending, _queued_job
+    with _cond:
+        while True:
+            if _pending is None:
+                _cond.wait()
+                continue
+            due = min(
+                _last_change + Config.FAQ_INDEX_BUILD_DEBOUNCE_SECONDS,
+                _first_change + Config.FAQ_INDEX_BUILD_MAX_DELAY_SECONDS,
+            )
+            due = max(due, _retry_at)
+            remaining = due - time.monotonic()
+            if remaining <= 0:
+                break
+            _cond.wait(remaining)
+        batch, job = _pending, _queued_job
+        _pending, _queued_job = None, None
+        return batch, job
+
+
+def _steps(batch):
+    if batch["full"]:
+        return [("Reconstrução completa", lambda progress: build_faiss_index(progress=progress))]
+    steps = []
+    if batch["missing"]:
+        steps.append(("Construir índice em falta", lambda progress: build_missing_index(progress=progress)))
+    for chatbot_id in sorted(batch["removed_chatbots"]):
+        steps.append((f"Remover chatbot {chatbot_id}", lambda progress, c=chatbot_id: remove_chatbot_from_index(c)))
+    for chatbot_id in sorted(batch["chatbots"] - batch["removed_chatbots"]):
+        steps.append((
+            f"Reconstruir chatbot {chatbot_id}",
+            lambda progress, c=chatbot_id: build_faiss_index(c, progress=progress),
+        ))
+    if batch["faq_ids"]:
+        faq_ids = sorted(batch["faq_ids"])
+        steps.append((
+            f"Atualizar {len(faq_ids)} FAQs",
+            lambda progress: upsert_faqs_in_index(faq_ids, progress=progress),
+        ))
+    return steps
+
+
+def _run_batch(batch, job_id):
+    steps = _steps(batch)
+    started = time.perf_counter()
+    _update_job(job_id, status="processing", progress=0, message="A iniciar")
+    for i, (label, step) in enumerate(steps):
+        def progress(fraction, message="", i=i, label=label):
+            _update_job(
+                job_id,
+                progress=int(100 * (i + min(max(fraction, 0.0), 1.0)) / len(steps)),
+                message=f"{label}: {message}" if message else label,
+            )
+        progress(0.0)
+        step(progress)
+    if batch["full"]:
+        try:
+            prune_embedding_cache()
+        except Exception as e:
+            logging.warning(f"Erro ao limpar cache de embeddings: {e}")
+    elapsed = time.perf_counter() - started
+    _update_job(
+        job_id, status="done", progress=100, version=loaded_index_version(),
+        message=f"Concluído em {elapsed:.1f}s",
+    )
+    logging.info(f"Índice FAISS para FAQs atualizado em segundo plano ({_kind(batch)}, {elapsed:.1f}s)")
+
+
+def _run():
+    global _pending, _queued_job, _first_change, _last_change, _retry_at
+    while True:
+        batch, job = _wait_for_batch()
+        # Waits for a scheduler still writing the row, or writes it if that failed.
+        job_id = _record_queued(job)
+        try:
+            if _app is not None:
+                with _app.app_context():
+                    _run_batch(batch, job_id)
+            else:
+                _run_batch(batch, job_id)
+            _retry_at = 0.0
+        except Exception as e:
+            logging.error(f"Erro ao atualizar índice FAISS para FAQs em segundo plano: {e}")
+            _update_job(job_id, status="error", error=str(e), message="Erro")
+            # Put the changes back; they are retried with whatever arrives meanwhile.
+            with _cond:
+                now = time.monotonic()
+                if _pending is None:
+                    _pending, _queued_job = _empty(), _QueuedJob()
+                    _first_change = _last_change = now
+                _merge(_pending, batch)
+                job = _queued_job
+                job.update(_pending)
+                _retry_at = now + Config.FAQ_INDEX_BUILD_RETRY_SECONDS
+            _record_queued(job)
+        _execute(
+            "DELETE FROM index_build_job WHERE finished_at < NOW() - %s * INTERVAL '1 day'",
+            (_KEEP_JOBS_DAYS,),
+        )
+
+
+def _job_dict(row, stale_before):
+    job_id, kind, status, chatbot_ids, faq_count, progress, message, error, version, worker, \
+        requested_at, started_at, finished_at, updated_at = row
+    # A queued/processing job whose worker stopped reporting (killed/restarted) won't finish.
+    if status in {"queued", "processing"} and updated_at is not None and updated_at.timestamp() < stale_before:
+        status = "stale"
+    return {
+        "job_id": job_id,
+        "kind": kind,
+        "status": status,
+        "chatbot_ids": list(chatbot_ids or []),
+        "faq_count": faq_count,
+        "progress": int(progress or 0),
+        "message": message or "",
+        "error": error,
+        "version": version,
+        "worker": worker,
+        "requested_at": requested_at.isoformat() if requested_at else None,
+        "started_at": started_at.isoformat() if started_at else None,
+        "finished_at": finished_at.isoformat() if finished_at else None,
+        "updated_at": updated_at.isoformat() if updated_at else None,
+    }
+
+
+def get_index_build_status(limit=10):
+    """Status of the FAQ index builds (all workers) for the status endpoint."""
+    rows = _execute(
+        """
+        SELECT job_id, kind, status, chatbot_ids, faq_count, progress, message, error, version, worker,
+               requested_at, started_at, finished_at, updated_at
+        FROM index_build_job
+        ORDER BY job_id DESC
+        LIMIT %s;
+        """,
+        (int(limit),),
+        fetch=True,
+    ) or []
+    stale_before = time.time() - Config.FAQ_INDEX_BUILD_STALE_SECONDS
+    jobs = [_job_dict(row, stale_before) for row in rows]
+    with _cond:
+        pending = None if _pending is None else {
+            "kind": _kind(_pending),
+            "chatbot_ids": sorted(_pending["chatbots"] | _pending["removed_chatbots"]),
+            "faq_count": len(_pending["faq_ids"]),
+        }
+    statuses = {job["status"] for job in jobs}
+    if "processing" in statuses:
+        status = "processing"
+    elif "queued" in statuses or pending:
+        status = "queued"
+    else:
+        status = jobs[0]["status"] if jobs else "idle"
+    return {
+        "status": status,
+        "version": loaded_index_version(),
+        "pending": pending,
+        "embedding_cache": embedding_cache_stats(),
+        "jobs": jobs,
+    }
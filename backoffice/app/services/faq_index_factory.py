@@ -0,0 +1,209 @@
+"""FAISS index types for the FAQ vector index.
+
+`build_index` creates one of:
+
+    flat     exact inner product (IndexFlatIP)
+    hnsw     graph index (IndexHNSWFlat); fast and accurate, but can't remove vectors
+    ivfflat  inverted lists over raw vectors (IndexIVFFlat)
+    ivfpq    inverted lists over product-quantized codes (IndexIVFPQ), smallest memory
+    sq8      8-bit scalar quantization, exhaustive scan (IndexScalarQuantizer)
+    auto     picked from the partition size (see `choose_index_type`)
+
+Vectors are labelled with their faq_id: IVF indexes store the ids natively, the others
+are wrapped in IndexIDMap2 (an IDMap over IVF would break on remove_ids, since IVF
+doesn't renumber the entries left behind). All are searched by inner product over
+normalized embeddings. Search knobs (nprobe / efSearch) come from Config and are applied with
+`configure_search` after building or loading an index.
+
+Run `python -m app.services.faq_index_factory` (from backoffice/) for a recall@k vs
+latency report of every type against the exact index over the current FAQ snapshot.
+"""
+
+import logging
+import math
+import time
+
+import faiss
+import numpy as np
+
+from ..config import Config
+
+INDEX_TYPES = ("flat", "hnsw", "ivfflat", "ivfpq", "sq8")
+# Types whose vectors can't be removed; replaced/removed FAQs are tombstoned instead.
+NON_REMOVABLE = frozenset({"hnsw"})
+# Types that must be trained on the vectors before any can be added.
+NEEDS_TRAINING = frozenset({"ivfflat", "ivfpq", "sq8"})
+
+# Minimum training points per centroid FAISS recommends.
+_MIN_POINTS_PER_CENTROID = 39
+_PQ_NBITS = 8
+_SQ_MIN_TRAIN = 1000
+
+
+def choose_index_type(n, requested=None):
+    """Resolve the configured index type for a partition of `n` vectors."""
+    requested = (requested or Config.FAQ_INDEX_TYPE or "auto").strip().lower()
+    if requested == "auto":
+        if n < Config.FAQ_INDEX_AUTO_HNSW_MIN:
+            return "flat"
+        if n < Config.FAQ_INDEX_AUTO_IVFPQ_MIN:
+            return "hnsw"
+        requested = "ivfpq"
+    if requested not in INDEX_TYPES:
+        logging.warning(f"Tipo de índice FAISS desconhecido '{requested}', a usar 'flat'.")
+        return "flat"
+    # IVF/PQ need enough vectors to train; small partitions fall back to simpler types.
+    if requested == "ivfpq" and n < _MIN_POINTS_PER_CENTROID * (1 << _PQ_NBITS):
+        requested = "ivfflat"
+    if requested == "ivfflat" and n < _MIN_POINTS_PER_CENTROID * 2:
+        requested = "flat"
+    # SQ8 learns per-dimension ranges from the data; too few vectors give useless ranges.
+    if requested == "sq8" and n < _SQ_MIN_TRAIN:
+        requested = "flat"
+    return requested
+
+
+def _nlist(n):
+    if Config.FAQ_INDEX_NLIST > 0:
+        nlist = Config.FAQ_INDEX_NLIST
+    else:
+        nlist = int(4 * math.sqrt(n))
+    return max(1, min(nlist, n // _MIN_POINTS_PER_CENTROID))
+
+
+def _pq_m(dim):
+    # Number of sub-quantizers: the largest divisor of dim not above the configured value.
+    for m in range(min(Config.FAQ_INDEX_PQ_M, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def _create(kind, dim, n):
+    metric = faiss.METRIC_INNER_PRODUCT
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, Config.FAQ_INDEX_HNSW_M, metric)
+        index.hnsw.efConstruction = Config.FAQ_INDEX_HNSW_EF_CONSTRUCTION
+        return index
+    if kind == "ivfflat":
+        return faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, _nlist(n), metric)
+    if kind == "ivfpq":
+        return faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, _nlist(n), _pq_m(dim), _PQ_NBITS, metric)
+    if kind == "sq8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, metric)
+    return faiss.IndexFlatIP(dim)
+
+
+def build_index(kind, embeddings, ids):
+    """Index of type `kind` over `embeddings` (float32, normalized) labelled `ids`."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = _create(kind, embeddings.shape[1], embeddings.shape[0])
+    if not index.is_trained:
+        index.train(embeddings)
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap2(index)
+    if len(ids):
+        index.add_with_ids(embeddings, np.asarray(ids, dtype=np.int64))
+    configure_search(index)
+    return index
+
+
+def configure_search(index, nprobe=None, ef_search=None):
+    """Apply the nprobe / efSearch knobs to `index` (no-op for exhaustive types)."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search or Config.FAQ_INDEX_EF_SEARCH
+    elif isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(nprobe or Config.FAQ_INDEX_NPROBE, base.nlist)
+    return index
+
+
+def index_type_of(index):
+    """Type name of a (possibly IDMap-wrapped) index, as used in INDEX_TYPES."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivfflat"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+
+def recall_report(embeddings, k=10, n_queries=200, kinds=INDEX_TYPES, nprobes=(4, 16, 64),
+                  ef_searches=(16, 64, 256), seed=0):
+    """Recall@k and latency of each index type against exact search.
+
+    Queries are stored vectors with a little noise added, so every query has
+    realistic near neighbours. Returns one dict per (type, knob) configuration.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n = embeddings.shape[0]
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(n, size=min(n_queries, n), replace=False)]
+    queries = queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    ids = np.arange(n, dtype=np.int64)
+
+    exact = build_index("flat", embeddings, ids)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for requested in kinds:
+        kind = choose_index_type(n, requested)
+        started = time.perf_counter()
+        index = build_index(kind, embeddings, ids)
+        build_seconds = time.perf_counter() - started
+        if kind == "hnsw":
+            knobs = [{"ef_search": ef} for ef in ef_searches]
+        elif kind in ("ivfflat", "ivfpq"):
+            knobs = [{"nprobe": nprobe} for nprobe in nprobes]
+        else:
+            knobs = [{}]
+        for knob in knobs:
+            configure_search(index, **knob)
+            started = time.perf_counter()
+            _, found = index.search(queries, k)
+            elapsed = time.perf_counter() - started
+            hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+            results.append({
+                "type": kind,
+                **knob,
+                "recall": round(hits / float(truth.size), 4),
+                "ms_per_query": round(elapsed * 1000 / len(queries), 4),
+                "build_seconds": round(build_seconds, 3),
+                "bytes": faiss.serialize_index(index).nbytes,
+            })
+    return results
+
+
+def _main():
+    import argparse
+    from .faq_index_store import FaqArtifact, current_artifact_path
+
+    parser = argparse.ArgumentParser(description="Recall@k vs latency of the FAQ index types.")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--types", default=",".join(INDEX_TYPES))
+    args = parser.parse_args()
+
+    path = current_artifact_path(Config.FAQ_INDEX_DIR)
+    if not path:
+        raise SystemExit(f"Nenhum índice FAQ em {Config.FAQ_INDEX_DIR}")
+    artifact = FaqArtifact(path)
+    embeddings = np.asarray(artifact.embeddings)
+    print(f"{len(artifact)} FAQs, dim {artifact.dim}, k={args.k}")
+    print(f"{'type':8} {'knob':>14} {'recall':>7} {'ms/query':>9} {'build s':>8} {'MB':>8}")
+    for row in recall_report(embeddings, k=args.k, n_queries=args.queries, kinds=args.types.split(",")):
+        knob = next((f"{key}={row[key]}" for key in ("nprobe", "ef_search") if key in row), "-")
+        print(
+            f"{row['type']:8} {knob:>14} {row['recall']:7.3f} {row['ms_per_query']:9.3f} "
+            f"{row['build_seconds']:8.2f} {row['bytes'] / 1e6:8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    _main()
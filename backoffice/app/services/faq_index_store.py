@@ -0,0 +1,262 @@
+"""On-disk format for the FAQ vector index (memory-mapped, columnar).
+
+Each snapshot is a directory `v<version>/` under Config.FAQ_INDEX_DIR:
+
+    meta.json         format, version, dim, rows,
+                      partitions [{chatbot_id, idioma, start, end, index_file, index_type}]
+    faq_id.npy        int64   (rows ordered by chatbot_id, idioma, faq_id -> partitions are contiguous)
+    chatbot_id.npy    int32
+    idioma.npy        S2      (b"" when unknown)
+    embeddings.npy    float32 (rows, dim), opened with mmap_mode="r"
+    text_offsets.npy  int64   (2 * rows + 1) offsets into text.bin: pergunta_i, resposta_i
+    text.bin          UTF-8 string arena
+    partitions/*.faiss one FAISS index per partition (type: services/faq_index_factory.py),
+                      read with the mmap IO flags where the type allows it
+    delta.jsonl       incremental changes applied on top of this snapshot
+    manifest.json     kind, version, model, dim, rows, build time and sha256 checksum of
+                      the files above (delta.jsonl excepted; see `verify_artifact`)
+
+`CURRENT` holds the name of the active snapshot and is replaced atomically, so
+readers only ever open complete directories. Workers map the same files, so the
+pages are shared through the OS cache instead of being unpickled per process.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import faiss
+import numpy as np
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+DELTA_FILE = "delta.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+# IO_FLAG_MMAP_IFC (recent FAISS) also maps flat codes; older builds only map IVF lists.
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class FaqArtifact:
+    """Read-only view over one snapshot directory."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Formato de índice FAQ não suportado: {self.meta.get('format')}")
+        self.version = int(self.meta["version"])
+        self.dim = int(self.meta["dim"])
+        self.partitions = self.meta["partitions"]
+        self.manifest = read_manifest(path) or {}
+        self.faq_ids = self._load("faq_id.npy")
+        self.chatbot_ids = self._load("chatbot_id.npy")
+        self.idiomas = self._load("idioma.npy")
+        self.embeddings = self._load("embeddings.npy")
+        self.text_offsets = self._load("text_offsets.npy")
+        arena_path = os.path.join(path, "text.bin")
+        if os.path.getsize(arena_path):
+            self.text = np.memmap(arena_path, dtype=np.uint8, mode="r")
+        else:
+            self.text = np.zeros(0, dtype=np.uint8)
+        # faq_id -> position lookup without materializing a dict per worker.
+        self._order = np.argsort(self.faq_ids, kind="stable")
+        self._sorted_ids = self.faq_ids[self._order]
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode="r", allow_pickle=False)
+
+    @property
+    def delta_path(self):
+        return os.path.join(self.path, DELTA_FILE)
+
+    def __len__(self):
+        return int(self.faq_ids.shape[0])
+
+    def _text(self, i):
+        start, end = int(self.text_offsets[i]), int(self.text_offsets[i + 1])
+        return bytes(self.text[start:end]).decode("utf-8")
+
+    def row(self, pos):
+        """Return (faq_id, pergunta, resposta, chatbot_id, idioma) for row `pos`."""
+        idioma = self.idiomas[pos].decode("ascii") or None
+        return (
+            int(self.faq_ids[pos]),
+            self._text(2 * pos),
+            self._text(2 * pos + 1),
+            int(self.chatbot_ids[pos]),
+            idioma,
+        )
+
+    def position(self, faq_id):
+        i = int(np.searchsorted(self._sorted_ids, faq_id))
+        if i < len(self._sorted_ids) and int(self._sorted_ids[i]) == int(faq_id):
+            return int(self._order[i])
+        return None
+
+    def read_index(self, part):
+        path = os.path.join(self.path, part["index_file"])
+        # Mapped IVF lists become OnDiskInvertedLists, which can't be copied for an
+        # incremental update; they are read into memory like types without mmap support.
+        if not part.get("index_type", "flat").startswith("ivf"):
+            try:
+                return faiss.read_index(path, _MMAP_FLAGS), True
+            except RuntimeError:
+                pass
+        return faiss.read_index(path), False
+
+
+def _checksum(path):
+    """sha256 over the snapshot files (sorted by name), delta log and manifest excluded."""
+    digest = hashlib.sha256()
+    names = []
+    for folder, _, files in os.walk(path):
+        for name in files:
+            rel = os.path.relpath(os.path.join(folder, name), path).replace(os.sep, "/")
+            if rel not in (DELTA_FILE, MANIFEST_FILE):
+                names.append(rel)
+    for rel in sorted(names):
+        digest.update(rel.encode("utf-8") + b"\0")
+        with open(os.path.join(path, rel), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(path, kind, version, model, dim, rows, checksum, build_seconds=None, **extra):
+    manifest = {
+        "kind": kind,
+        "version": int(version),
+        "model": model,
+        "dim": int(dim),
+        "rows": int(rows),
+        "checksum": checksum,
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "build_seconds": None if build_seconds is None else round(build_seconds, 3),
+        **extra,
+    }
+    tmp = os.path.join(path, f"{MANIFEST_FILE}.tmp-{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, os.path.join(path, MANIFEST_FILE))
+    return manifest
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def verify_artifact(path):
+    """Recompute the checksum of a snapshot; returns (ok, manifest)."""
+    manifest = read_manifest(path)
+    if not manifest:
+        return False, None
+    return _checksum(path) == manifest.get("checksum"), manifest
+
+
+def write_artifact(root, version, partitions, dim, model=None, build_started=None):
+    """Write a snapshot directory and return its path (not activated yet).
+
+    `partitions` yields (chatbot_id, idioma, rows, embeddings, index, index_type) with
+    `rows` as (faq_id, pergunta, resposta, chatbot_id, idioma) tuples aligned with
+    `embeddings`. `model` and `build_started` (time.monotonic()) go into the manifest.
+    """
+    name = f"v{version:010d}"
+    path = os.path.join(root, name)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_path, "partitions"))
+
+    faq_ids, chatbot_ids, idiomas, blocks, offsets = [], [], [], [], [0]
+    parts_meta = []
+    with open(os.path.join(tmp_path, "text.bin"), "wb") as arena:
+        for chatbot_id, idioma, rows, embeddings, index, index_type in sorted(
+            partitions, key=lambda p: (p[0], p[1] or "")
+        ):
+            order = sorted(range(len(rows)), key=lambda i: int(rows[i][0]))
+            start = len(faq_ids)
+            for i in order:
+                faq_id, pergunta, resposta = rows[i][:3]
+                faq_ids.append(int(faq_id))
+                chatbot_ids.append(int(chatbot_id))
+                idiomas.append((idioma or "").encode("ascii", "ignore")[:2])
+                for value in (pergunta, resposta):
+                    data = (value or "").encode("utf-8")
+                    arena.write(data)
+                    offsets.append(offsets[-1] + len(data))
+            blocks.append(np.asarray(embeddings, dtype=np.float32)[order])
+            index_file = f"partitions/{chatbot_id}_{idioma or 'xx'}.faiss"
+            faiss.write_index(index, os.path.join(tmp_path, index_file))
+            parts_meta.append({
+                "chatbot_id": int(chatbot_id),
+                "idioma": idioma,
+                "start": start,
+                "end": len(faq_ids),
+                "index_file": index_file,
+                "index_type": index_type,
+            })
+
+    embeddings = np.vstack(blocks) if blocks else np.zeros((0, dim), dtype=np.float32)
+    np.save(os.path.join(tmp_path, "faq_id.npy"), np.asarray(faq_ids, dtype=np.int64))
+    np.save(os.path.join(tmp_path, "chatbot_id.npy"), np.asarray(chatbot_ids, dtype=np.int32))
+    np.save(os.path.join(tmp_path, "idioma.npy"), np.asarray(idiomas, dtype="S2"))
+    np.save(os.path.join(tmp_path, "embeddings.npy"), embeddings)
+    np.save(os.path.join(tmp_path, "text_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "format": FORMAT_VERSION,
+                "version": int(version),
+                "dim": int(dim),
+                "rows": len(faq_ids),
+                "partitions": parts_meta,
+            },
+            f,
+        )
+    open(os.path.join(tmp_path, DELTA_FILE), "w", encoding="utf-8").close()
+    write_manifest(
+        tmp_path, "faq", version, model, dim, len(faq_ids), _checksum(tmp_path),
+        build_seconds=None if build_started is None else time.monotonic() - build_started,
+        partitions=len(parts_meta),
+    )
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def current_artifact_path(root):
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(root, name)
+    return path if name and os.path.isdir(path) else None
+
+
+def activate_artifact(root, path, keep=2):
+    """Point CURRENT at `path` and drop snapshots older than the last `keep`."""
+    tmp = os.path.join(root, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(path))
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+    snapshots = sorted(
+        name for name in os.listdir(root)
+        if name.startswith("v") and os.path.isdir(os.path.join(root, name)) and ".tmp-" not in name
+    )
+    for name in snapshots[:-keep]:
+        # Other workers may still have the old files mapped; on POSIX unlinking is safe,
+        # elsewhere the removal is simply retried on the next activation.
+        try:
+            shutil.rmtree(os.path.join(root, name))
+        except OSError as exc:
+            logging.debug("Snapshot antigo do índice FAQ não removido (%s): %s", name, exc)
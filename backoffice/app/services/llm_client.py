@@ -0,0 +1,139 @@
+"""Ollama client shared by the RAG paths: pooled connections and admission control.
+
+All generations of a worker go through one `requests.Session`, so connections to
+Ollama are kept alive and reused. At most OLLAMA_MAX_CONCURRENCY generations run at a
+time per worker; up to OLLAMA_MAX_QUEUE more callers wait (at most
+OLLAMA_QUEUE_TIMEOUT_SECONDS) for a free slot, and anyone beyond that fails at once
+with `LLMBusy`. A burst of RAG questions therefore ties up a bounded number of web
+threads, and FAQ requests keep being served while the LLM is saturated.
+
+Requests carry OLLAMA_KEEP_ALIVE, how long Ollama keeps the model loaded after it;
+`warm_up_llm` loads it at startup so the first question doesn't pay for it.
+"""
+
+import json
+import logging
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..config import Config
+
+
+class LLMBusy(RuntimeError):
+    """No generation slot became free: the wait queue was full or the wait timed out."""
+
+
+_max_concurrency = max(Config.OLLAMA_MAX_CONCURRENCY, 1)
+_slots = BoundedSemaphore(_max_concurrency)
+_state_lock = Lock()
+_state = {"in_use": 0, "waiting": 0, "calls": 0, "rejected": 0, "timeouts": 0}
+
+_session = requests.Session()
+# One extra connection for the warm-up call.
+_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=_max_concurrency + 1))
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=_max_concurrency + 1))
+
+
+def _keep_alive():
+    value = (Config.OLLAMA_KEEP_ALIVE or "").strip()
+    # Ollama takes a duration ("30m") or a number of seconds (-1 keeps the model loaded).
+    try:
+        return int(value)
+    except ValueError:
+        return value or None
+
+
+def _payload(**fields):
+    payload = {"model": Config.OLLAMA_MODEL, **fields}
+    keep_alive = _keep_alive()
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    return payload
+
+
+def _update(**deltas):
+    with _state_lock:
+        for name, delta in deltas.items():
+            _state[name] += delta
+
+
+@contextmanager
+def llm_slot():
+    """Hold one of the worker's generation slots, queueing (boundedly) for it."""
+    if not _slots.acquire(blocking=False):
+        with _state_lock:
+            if _state["waiting"] >= Config.OLLAMA_MAX_QUEUE:
+                _state["rejected"] += 1
+                raise LLMBusy("fila de espera do LLM cheia")
+            _state["waiting"] += 1
+        try:
+            acquired = _slots.acquire(timeout=Config.OLLAMA_QUEUE_TIMEOUT_SECONDS)
+        finally:
+            _update(waiting=-1)
+        if not acquired:
+            _update(timeouts=1)
+            raise LLMBusy("tempo de espera pelo LLM esgotado")
+    _update(in_use=1, calls=1)
+    try:
+        yield
+    finally:
+        _update(in_use=-1)
+        _slots.release()
+
+
+def generate(prompt):
+    """Full completion of `prompt`. Raises LLMBusy, or the request error."""
+    with llm_slot():
+        resp = _session.post(
+            Config.OLLAMA_URL, json=_payload(prompt=prompt, stream=False), timeout=Config.OLLAMA_TIMEOUT
+        )
+        resp.raise_for_status()
+        return resp.json().get("response", "").strip()
+
+
+def generate_stream(prompt):
+    """Yield the completion of `prompt` piece by piece, as Ollama generates it.
+
+    The slot is held until the generator finishes or is closed; closing it early
+    (client gone) closes the connection, which makes Ollama stop generating.
+    """
+    with llm_slot():
+        # With stream=True the timeout applies between chunks, not to the whole generation.
+        with _session.post(
+            Config.OLLAMA_URL, json=_payload(prompt=prompt, stream=True), stream=True, timeout=Config.OLLAMA_TIMEOUT
+        ) as resp:
+            resp.raise_for_status()
+            # chunk_size=None hands over each chunk as it arrives (Ollama sends one per token).
+            for line in resp.iter_lines(chunk_size=None):
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    raise RuntimeError(data["error"])
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    break
+
+
+def warm_up_llm():
+    """Load the model in Ollama (a request without prompt only loads it)."""
+    try:
+        resp = _session.post(Config.OLLAMA_URL, json=_payload(stream=False), timeout=Config.OLLAMA_TIMEOUT)
+        resp.raise_for_status()
+    except Exception as e:
+        logging.warning(f"Não foi possível pré-carregar o modelo '{Config.OLLAMA_MODEL}' no Ollama: {e}")
+
+
+def llm_client_stats():
+    with _state_lock:
+        stats = dict(_state)
+    return {
+        **stats,
+        "max_concurrency": _max_concurrency,
+        "max_queue": Config.OLLAMA_MAX_QUEUE,
+        "keep_alive": _keep_alive(),
+    }
@@ -1,14 +1,19 @@
+import hashlib
 import logging
 import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import groupby, islice
 
 import PyPDF2
-import requests
-from sentence_transformers import SentenceTransformer
 
 from ..config import Config
 from ..db import get_conn
-
-embedding_model = SentenceTransformer(Config.RAG_EMBEDDING_MODEL)
+from .embeddings import EncodePool, encode_documents, encode_queries
+from .llm_client import LLMBusy, generate, generate_stream
+from .rag_ann_index import apply_search_settings
+from .rag_chunk_writer import write_rag_chunks
+from .rag_cache import get_cached_rag_answer, invalidate_rag_cache, store_rag_answer
 
 def _try_decrypt_pdf(reader) -> bool:
     """Attempt to open PDFs flagged as encrypted but with no password."""
@@ -27,22 +32,38 @@ def _try_decrypt_pdf(reader) -> bool:
     return False
 
 
+# Bump when the extraction or chunking changes the chunks a PDF produces.
+CHUNKER_VERSION = 1
+
+_PDF_COLUMNS = "pdf_id, chatbot_id, file_path, filename, content_sha256, chunker_version, embedding_model"
+
+
+def chunker_version():
+    return f"v{CHUNKER_VERSION}:{Config.RAG_CHUNK_SIZE_CHARS}:{Config.RAG_CHUNK_OVERLAP_CHARS}"
+
+
+def embedding_version():
+    return f"{Config.RAG_EMBEDDING_MODEL}:{Config.RAG_EMBEDDING_DIM}"
+
+
 def get_pdfs_from_db(chatbot_id=None, pdf_ids=None):
+    """Rows (pdf_id, chatbot_id, file_path, filename, content_sha256, chunker_version,
+    embedding_model); the last three describe what the PDF was last indexed from."""
     conn = get_conn()
     cur = conn.cursor()
     try:
         if pdf_ids:
             cur.execute(
-                "SELECT pdf_id, chatbot_id, file_path, filename FROM pdf_documents WHERE pdf_id = ANY(%s)",
+                f"SELECT {_PDF_COLUMNS} FROM pdf_documents WHERE pdf_id = ANY(%s)",
                 (list(pdf_ids),),
             )
         elif chatbot_id:
             cur.execute(
-                "SELECT pdf_id, chatbot_id, file_path, filename FROM pdf_documents WHERE chatbot_id = %s",
+                f"SELECT {_PDF_COLUMNS} FROM pdf_documents WHERE chatbot_id = %s",
                 (chatbot_id,),
             )
         else:
-            cur.execute("SELECT pdf_id, chatbot_id, file_path, filename FROM pdf_documents")
+            cur.execute(f"SELECT {_PDF_COLUMNS} FROM pdf_documents")
         return cur.fetchall()
     finally:
         cur.close()
@@ -81,106 +102,250 @@ def _chunk_text(text, max_chars, overlap):
     return chunks
 
 
-def _extract_pdf_pages(file_path):
+def _file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pdf_page_count(file_path):
+    with open(file_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        if not _try_decrypt_pdf(reader):
+            raise ValueError("PDF is encrypted")
+        return len(reader.pages)
+
+
+def _extract_pdf_chunks(file_path, first_page, last_page, chunk_size, overlap):
+    """[(page_num, chunks)] of pages first_page..last_page (1-based, inclusive).
+
+    Runs in the ingestion processes, so only a range of pages is ever extracted at once.
+    """
     pages = []
     with open(file_path, "rb") as f:
         reader = PyPDF2.PdfReader(f)
         if not _try_decrypt_pdf(reader):
             raise ValueError("PDF is encrypted")
-        for idx, page in enumerate(reader.pages, start=1):
-            text = page.extract_text()
+        for page_num in range(first_page, last_page + 1):
+            text = reader.pages[page_num - 1].extract_text()
             if text:
-                pages.append((idx, text))
+                pages.append((page_num, _chunk_text(text, chunk_size, overlap)))
     return pages
 
 
-def index_pdf_documents(chatbot_id=None, pdf_ids=None):
+class _UnreadablePdf(Exception):
+    pass
+
+
+def _extracted(ranges):
+    for _, future in ranges:
+        try:
+            yield future.result()
+        except Exception as exc:
+            raise _UnreadablePdf(exc) from exc
+
+
+def _ingest_processes():
+    return Config.RAG_INGEST_PROCESSES or os.cpu_count() or 1
+
+
+def _ordered_map(executor, fn, tasks, window):
+    """Yield (key, future) of `fn(*args)` for each (key, args) of `tasks`, in order.
+
+    At most `window` calls are submitted ahead of the consumer, which bounds the memory
+    held by finished results. Without an executor each call runs when its turn comes.
+    """
+    tasks = iter(tasks)
+    if executor is None:
+        for key, args in tasks:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+            yield key, future
+        return
+    pending = deque((key, executor.submit(fn, *args)) for key, args in islice(tasks, window))
+    while pending:
+        yield pending.popleft()
+        for key, args in islice(tasks, 1):
+            pending.append((key, executor.submit(fn, *args)))
+
+
+def _write_chunk_batch(cur, chatbot_id, pdf_id, batch, encode_pool):
+    embeddings = encode_documents([chunk for _, _, chunk in batch], Config.RAG_EMBEDDING_MODEL, pool=encode_pool)
+    if embeddings.shape[1] != Config.RAG_EMBEDDING_DIM:
+        raise ValueError(
+            f"RAG embedding dim mismatch: got {embeddings.shape[1]}, expected {Config.RAG_EMBEDDING_DIM}"
+        )
+    return write_rag_chunks(
+        cur,
+        (
+            (chatbot_id, pdf_id, page_num, chunk_idx, chunk, emb)
+            for (page_num, chunk_idx, chunk), emb in zip(batch, embeddings)
+        ),
+    )
+
+
+def _index_pdf(cur, chatbot_id, pdf_id, page_ranges, encode_pool):
+    """Replace the chunks of one PDF, encoding and writing RAG_INGEST_BATCH_SIZE at a time."""
+    cur.execute("DELETE FROM rag_chunks WHERE pdf_id = %s", (pdf_id,))
+    batch_size = max(Config.RAG_INGEST_BATCH_SIZE, 1)
+    batch = []
+    chunk_index = 0
+    inserted = 0
+    for pages in page_ranges:
+        for page_num, chunks in pages:
+            for chunk in chunks:
+                batch.append((page_num, chunk_index, chunk))
+                chunk_index += 1
+                if len(batch) >= batch_size:
+                    inserted += _write_chunk_batch(cur, chatbot_id, pdf_id, batch, encode_pool)
+                    batch = []
+    if batch:
+        inserted += _write_chunk_batch(cur, chatbot_id, pdf_id, batch, encode_pool)
+    return inserted
+
+
+def _mark_indexed(cur, pdf_id, content_sha256):
+    cur.execute(
+        """
+        UPDATE pdf_documents
+        SET content_sha256 = %s, chunker_version = %s, embedding_model = %s, indexed_at = NOW()
+        WHERE pdf_id = %s
+        """,
+        (content_sha256, chunker_version(), embedding_version(), pdf_id),
+    )
+
+
+def index_pdf_documents(chatbot_id=None, pdf_ids=None, force=False):
+    """(Re)build the rag_chunks of the PDFs that changed since they were last indexed.
+
+    A PDF is skipped when the sha256 of its file, the chunker version and the embedding
+    model all match what it was last indexed with (unless `force`). Returns
+    {"chunks": inserted, "refreshed", "skipped", "failed": number of PDFs}.
+
+    Pages are extracted and chunked RAG_INGEST_PAGES_PER_TASK at a time by a pool of
+    RAG_INGEST_PROCESSES processes, across PDFs, while the chunks already extracted are
+    encoded and written in batches, so memory stays bounded for very large PDFs. Each
+    PDF is replaced in its own transaction; a PDF that can't be read, or has no text,
+    keeps its chunks and counts as failed.
+    """
+    report = {"chunks": 0, "refreshed": 0, "skipped": 0, "failed": 0}
     pdfs = get_pdfs_from_db(chatbot_id=chatbot_id, pdf_ids=pdf_ids)
     if not pdfs:
-        return 0
+        return report
 
     conn = get_conn()
     cur = conn.cursor()
-    total_inserted = 0
+    changed_chatbots = set()
+    versions = (chunker_version(), embedding_version())
 
     chunk_size = Config.RAG_CHUNK_SIZE_CHARS
     overlap = Config.RAG_CHUNK_OVERLAP_CHARS
+    pages_per_task = max(Config.RAG_INGEST_PAGES_PER_TASK, 1)
 
-    for pdf_id, pdf_chatbot_id, file_path, _filename in pdfs:
+    tasks = []
+    for pdf_id, pdf_chatbot_id, file_path, _filename, indexed_sha256, *indexed_versions in pdfs:
         if not os.path.exists(file_path):
             logging.warning("RAG index: missing PDF at %s", file_path)
+            report["failed"] += 1
             continue
         try:
-            pages = _extract_pdf_pages(file_path)
+            content_sha256 = _file_sha256(file_path)
+            if not force and content_sha256 == indexed_sha256 and tuple(indexed_versions) == versions:
+                report["skipped"] += 1
+                continue
+            page_count = _pdf_page_count(file_path)
         except Exception as exc:
             logging.warning("RAG index: failed to read %s (%s)", file_path, exc)
+            report["failed"] += 1
             continue
+        key = (pdf_id, chatbot_id if chatbot_id is not None else pdf_chatbot_id, file_path, content_sha256)
+        for first_page in range(1, page_count + 1, pages_per_task):
+            last_page = min(first_page + pages_per_task - 1, page_count)
+            tasks.append((key, (file_path, first_page, last_page, chunk_size, overlap)))
+
+    processes = _ingest_processes()
+    parallel = processes > 1 and len(tasks) > 1
+    executor = ProcessPoolExecutor(max_workers=min(processes, len(tasks))) if parallel else None
+    try:
+        with EncodePool(Config.RAG_EMBEDDING_MODEL) as encode_pool:
+            results = _ordered_map(executor, _extract_pdf_chunks, tasks, processes * 2)
+            for (pdf_id, target_chatbot_id, file_path, content_sha256), ranges in groupby(
+                results, key=lambda r: r[0]
+            ):
+                try:
+                    inserted = _index_pdf(cur, target_chatbot_id, pdf_id, _extracted(ranges), encode_pool)
+                except _UnreadablePdf as exc:
+                    conn.rollback()
+                    logging.warning("RAG index: failed to read %s (%s)", file_path, exc.__cause__)
+                    report["failed"] += 1
+                    continue
+                except Exception:
+                    conn.rollback()
+                    raise
+                if not inserted:
+                    # No text at all: keep whatever was indexed before, and don't record
+                    # this file as indexed so the next run tries it again.
+                    conn.rollback()
+                    logging.warning("RAG index: no text extracted from %s", file_path)
+                    report["failed"] += 1
+                    continue
+                _mark_indexed(cur, pdf_id, content_sha256)
+                conn.commit()
+                report["chunks"] += inserted
+                report["refreshed"] += 1
+                changed_chatbots.add(target_chatbot_id)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        # Cached RAG answers of these chatbots were generated from the old chunks.
+        invalidate_rag_cache(*changed_chatbots)
+    logging.info(
+        "RAG index: %d PDF(s) atualizados, %d sem alterações, %d com erro (%d chunks)",
+        report["refreshed"], report["skipped"], report["failed"], report["chunks"],
+    )
+    return report
 
-        chunks = []
-        metadata = []
-        chunk_index = 0
-        for page_num, text in pages:
-            for chunk in _chunk_text(text, chunk_size, overlap):
-                chunks.append(chunk)
-                metadata.append((page_num, chunk_index))
-                chunk_index += 1
-
-        if not chunks:
-            continue
 
-        embeddings = embedding_model.encode(
-            chunks,
-            normalize_embeddings=True,
-            convert_to_numpy=True,
-            show_progress_bar=False,
-        )
-        if embeddings.shape[1] != Config.RAG_EMBEDDING_DIM:
-            raise ValueError(
-                f"RAG embedding dim mismatch: got {embeddings.shape[1]}, expected {Config.RAG_EMBEDDING_DIM}"
-            )
-
-        cur.execute("DELETE FROM rag_chunks WHERE pdf_id = %s", (pdf_id,))
-
-        rows = []
-        for chunk, emb, meta in zip(chunks, embeddings, metadata):
-            page_num, chunk_idx = meta
-            rows.append(
-                (
-                    chatbot_id if chatbot_id is not None else pdf_chatbot_id,
-                    pdf_id,
-                    page_num,
-                    chunk_idx,
-                    chunk,
-                    emb.tolist(),
-                )
-            )
-        cur.executemany(
+def rag_chunks_summary():
+    """(rows, checksum) of rag_chunks: md5 over (pdf_id, chunk_index, md5(content))."""
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT COUNT(*),
+                   md5(COALESCE(string_agg(pdf_id || ':' || chunk_index || ':' || md5(content), ','
+                                           ORDER BY pdf_id, chunk_index), ''))
+            FROM rag_chunks
             """
-            INSERT INTO rag_chunks
-            (chatbot_id, pdf_id, page_num, chunk_index, content, embedding)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """,
-            rows,
         )
-        total_inserted += len(rows)
+        rows, checksum = cur.fetchone()
+        return int(rows), checksum
+    finally:
+        cur.close()
 
-    conn.commit()
-    return total_inserted
 
+def _query_embedding(pergunta):
+    return encode_queries([" ".join(pergunta.split())], Config.RAG_EMBEDDING_MODEL)[0]
 
-def _search_pgvector(pergunta, chatbot_id, top_k):
+
+def _search_pgvector(pergunta, chatbot_id, top_k, query_emb=None):
     conn = get_conn()
     cur = conn.cursor()
     try:
-        query_emb = embedding_model.encode(
-            [pergunta],
-            normalize_embeddings=True,
-            convert_to_numpy=True,
-            show_progress_bar=False,
-        )[0].tolist()
+        if query_emb is None:
+            query_emb = _query_embedding(pergunta)
+        query_emb = query_emb.tolist()
+        apply_search_settings(cur, top_k)
         cur.execute(
             """
-            SELECT c.content,
+            SELECT c.chunk_id,
+                   c.content,
                    c.pdf_id,
                    c.page_num,
                    c.chunk_index,
@@ -196,9 +361,10 @@ def _search_pgvector(pergunta, chatbot_id, top_k):
         )
         rows = cur.fetchall()
         results = []
-        for content, pdf_id, page_num, chunk_index, filename, score in rows:
+        for chunk_id, content, pdf_id, page_num, chunk_index, filename, score in rows:
             results.append(
                 {
+                    "chunk_id": chunk_id,
                     "content": content,
                     "pdf_id": pdf_id,
                     "page_num": page_num,
@@ -244,15 +410,10 @@ def _build_prompt(pergunta, chunks):
 
 
 def _call_ollama(prompt):
-    payload = {
-        "model": Config.OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": False,
-    }
     try:
-        resp = requests.post(Config.OLLAMA_URL, json=payload, timeout=Config.OLLAMA_TIMEOUT)
-        resp.raise_for_status()
-        return resp.json().get("response", "").strip()
+        return generate(prompt)
+    except LLMBusy:
+        raise
     except Exception as exc:
         logging.error("Ollama error: %s", exc)
         return None
@@ -261,7 +422,12 @@ def _call_ollama(prompt):
 def pesquisar_pdf_pgvector(pergunta, chatbot_id=None):
     if not chatbot_id:
         return None, []
-    results = _search_pgvector(pergunta, chatbot_id, Config.RAG_TOP_K)
+    query_emb = _query_embedding(pergunta)
+    # A near-identical question answered from the same documents needs no generation.
+    cached = get_cached_rag_answer(chatbot_id, query_emb)
+    if cached:
+        return cached
+    results = _search_pgvector(pergunta, chatbot_id, Config.RAG_TOP_K, query_emb=query_emb)
     results = [r for r in results if r["score"] >= Config.RAG_MIN_SCORE]
     if not results:
         return None, []
@@ -269,4 +435,46 @@ def pesquisar_pdf_pgvector(pergunta, chatbot_id=None):
     resposta = _call_ollama(prompt)
     if not resposta:
         return None, sources
+    store_rag_answer(chatbot_id, query_emb, pergunta, [r["chunk_id"] for r in results[:len(sources)]], resposta, sources)
     return resposta, sources
+
+
+def pesquisar_pdf_pgvector_stream(pergunta, chatbot_id=None):
+    """Streaming variant of `pesquisar_pdf_pgvector`, yielding (event, value) pairs.
+
+    ("fontes", sources) comes first, as soon as the chunks are retrieved, then one
+    ("token", text) per piece Ollama generates and, if an answer came out, a final
+    ("resposta", full answer). Nothing is yielded when no chunk is relevant enough;
+    an Ollama failure ends the stream without "resposta". Cached answers are replayed
+    as a single token.
+    """
+    if not chatbot_id:
+        return
+    query_emb = _query_embedding(pergunta)
+    cached = get_cached_rag_answer(chatbot_id, query_emb)
+    if cached:
+        resposta, sources = cached
+        yield "fontes", sources
+        yield "token", resposta
+        yield "resposta", resposta
+        return
+    results = _search_pgvector(pergunta, chatbot_id, Config.RAG_TOP_K, query_emb=query_emb)
+    results = [r for r in results if r["score"] >= Config.RAG_MIN_SCORE]
+    if not results:
+        return
+    prompt, sources = _build_prompt(pergunta, results)
+    yield "fontes", sources
+    parts = []
+    try:
+        for token in generate_stream(prompt):
+            parts.append(token)
+            yield "token", token
+    except LLMBusy:
+        raise
+    except Exception as exc:
+        logging.error("Ollama error: %s", exc)
+        return
+    resposta = "".join(parts).strip()
+    if resposta:
+        store_rag_answer(chatbot_id, query_emb, pergunta, [r["chunk_id"] for r in results[:len(sources)]], resposta, sources)
+        yield "resposta", resposta
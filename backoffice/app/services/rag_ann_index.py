@@ -0,0 +1,377 @@
+"""Approximate nearest-neighbour index of rag_chunks (pgvector), sized and tuned to the data.
+
+`ensure_ann_index` keeps `rag_chunks_embedding_idx` matching the table:
+
+    none     no index; exact scans are fast enough below RAG_ANN_MIN_ROWS chunks
+    hnsw     graph index; no training, so it stays good as chunks are added
+    ivfflat  inverted lists, trained on the rows present when it is built, with
+             lists = sqrt(rows); rebuilt once the table has grown (or shrunk) by
+             RAG_ANN_REBUILD_GROWTH since
+    auto     none / hnsw / ivfflat by table size (RAG_ANN_MIN_ROWS, RAG_ANN_AUTO_IVFFLAT_MIN)
+
+Indexes are built with CREATE INDEX CONCURRENTLY under a new name and swapped in, so
+searches keep working during a rebuild. It runs after PDF ingestion and from
+`python manage_indexes.py rag-index`.
+
+`tune_search` measures recall@k and latency of each probes (ivfflat) / ef_search (hnsw)
+value on a sample of stored chunks against exact search, and keeps the most accurate
+value whose p95 latency meets RAG_ANN_TARGET_MS. `apply_search_settings` sets it
+(SET LOCAL) before each RAG search. The state lives in the `rag_ann_index` row, so all
+workers use the same settings.
+"""
+
+import logging
+import math
+import time
+from threading import Lock, Thread
+
+import numpy as np
+from psycopg2.extras import Json
+
+from ..config import Config
+from ..db import get_pool_conn, put_pool_conn, try_advisory_lock
+from .cache_versions import bump_version, get_version
+
+INDEX_TYPES = ("none", "hnsw", "ivfflat")
+INDEX_NAME = "rag_chunks_embedding_idx"
+ANN_SCOPE = "rag_ann_index"
+
+_PG_RAG_ANN_LOCK_KEY = 912340981276
+
+_settings_lock = Lock()
+_settings = {"version": None, "index_type": None, "lists": None, "probes": None, "ef_search": None}
+_maintenance_lock = Lock()
+
+
+def choose_ann_index(rows, requested=None):
+    """Resolve the configured index type for a table of `rows` chunks."""
+    requested = (requested or Config.RAG_ANN_INDEX or "auto").strip().lower()
+    if requested == "auto":
+        if rows < Config.RAG_ANN_MIN_ROWS:
+            return "none"
+        return "ivfflat" if rows >= Config.RAG_ANN_AUTO_IVFFLAT_MIN else "hnsw"
+    if requested not in INDEX_TYPES:
+        logging.warning(f"Tipo de índice pgvector desconhecido '{requested}', a usar 'hnsw'.")
+        return "hnsw"
+    # IVF lists are trained on the rows present: nothing to train on an empty table.
+    if requested == "ivfflat" and rows == 0:
+        return "none"
+    return requested
+
+
+def ivf_lists(rows):
+    return max(1, int(math.sqrt(rows)))
+
+
+def _default_probes(lists):
+    return max(1, int(round(math.sqrt(lists or 1))))
+
+
+def _run(fn, *args):
+    conn = get_pool_conn()
+    cur = conn.cursor()
+    try:
+        result = fn(cur, *args)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        put_pool_conn(conn)
+
+
+def _read_state(cur):
+    cur.execute(
+        """
+        SELECT index_type, lists, rows_at_build, built_at, build_seconds, probes, ef_search, tuned_at, report
+        FROM rag_ann_index WHERE id = 1
+        """
+    )
+    row = cur.fetchone()
+    keys = ("index_type", "lists", "rows_at_build", "built_at", "build_seconds", "probes", "ef_search",
+            "tuned_at", "report")
+    return dict(zip(keys, row)) if row else {}
+
+
+def _current_index(cur):
+    """(access method, reloptions) of the live index, or None."""
+    cur.execute(
+        """
+        SELECT am.amname, c.reloptions
+        FROM pg_class c JOIN pg_am am ON am.oid = c.relam
+        WHERE c.relname = %s
+        """,
+        (INDEX_NAME,),
+    )
+    return cur.fetchone()
+
+
+def _count_rows(cur):
+    cur.execute("SELECT COUNT(*) FROM rag_chunks")
+    return int(cur.fetchone()[0])
+
+
+def needs_rebuild(kind, rows, current, state):
+    current_type = current[0] if current else "none"
+    if kind != current_type:
+        return True
+    if kind != "ivfflat":
+        return False
+    rows_at_build = state.get("rows_at_build") if state.get("index_type") == "ivfflat" else None
+    if rows_at_build is None:
+        # Built elsewhere (e.g. the old fixed lists = 100, usually on an empty table).
+        return True
+    if rows_at_build == 0:
+        return rows > 0
+    growth = max(Config.RAG_ANN_REBUILD_GROWTH, 1.0)
+    return rows >= rows_at_build * growth or rows * growth <= rows_at_build
+
+
+def _index_ddl(kind, rows, name):
+    if kind == "hnsw":
+        options = f"m = {int(Config.RAG_ANN_HNSW_M)}, ef_construction = {int(Config.RAG_ANN_HNSW_EF_CONSTRUCTION)}"
+    else:
+        options = f"lists = {ivf_lists(rows)}"
+    return (
+        f"CREATE INDEX CONCURRENTLY {name} ON rag_chunks "
+        f"USING {kind} (embedding vector_cosine_ops) WITH ({options})"
+    )
+
+
+def _rebuild(kind, rows):
+    conn = get_pool_conn()
+    cur = conn.cursor()
+    new_name = f"{INDEX_NAME}_new"
+    started = time.monotonic()
+    try:
+        # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction.
+        conn.autocommit = True
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}")
+        if kind != "none":
+            cur.execute(_index_ddl(kind, rows, new_name))
+        conn.autocommit = False
+        cur.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+        if kind != "none":
+            cur.execute(f"ALTER INDEX {new_name} RENAME TO {INDEX_NAME}")
+        lists = ivf_lists(rows) if kind == "ivfflat" else None
+        cur.execute(
+            """
+            INSERT INTO rag_ann_index (id, index_type, lists, rows_at_build, built_at, build_seconds,
+                                       probes, ef_search, tuned_at, report)
+            VALUES (1, %s, %s, %s, NOW(), %s, %s, NULL, NULL, NULL)
+            ON CONFLICT (id) DO UPDATE SET
+                index_type = EXCLUDED.index_type, lists = EXCLUDED.lists,
+                rows_at_build = EXCLUDED.rows_at_build, built_at = EXCLUDED.built_at,
+                build_seconds = EXCLUDED.build_seconds, probes = EXCLUDED.probes,
+                ef_search = NULL, tuned_at = NULL, report = NULL
+            """,
+            (kind, lists, rows, time.monotonic() - started, _default_probes(lists) if lists else None),
+        )
+        conn.commit()
+    except Exception:
+        if not conn.autocommit:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = False
+        cur.close()
+        put_pool_conn(conn)
+    bump_version(ANN_SCOPE)
+    logging.info(f"Índice pgvector de rag_chunks: {kind} ({rows} chunks, {time.monotonic() - started:.1f}s)")
+
+
+def ensure_ann_index(requested=None, force=False, tune=None):
+    """Build or rebuild the index when the table calls for it; returns `ann_index_status()`.
+
+    Only one worker maintains the index at a time; the others return at once. After a
+    rebuild the search knob is tuned again (RAG_ANN_AUTOTUNE, or `tune`).
+    """
+    with try_advisory_lock(_PG_RAG_ANN_LOCK_KEY) as acquired:
+        if not acquired:
+            return ann_index_status()
+        rows = _run(_count_rows)
+        kind = choose_ann_index(rows, requested)
+        current = _run(_current_index)
+        state = _run(_read_state)
+        if force or needs_rebuild(kind, rows, current, state):
+            _rebuild(kind, rows)
+            if kind != "none" and (Config.RAG_ANN_AUTOTUNE if tune is None else tune):
+                tune_search()
+    return ann_index_status()
+
+
+def schedule_ann_maintenance():
+    """`ensure_ann_index` in a background thread (at most one per worker)."""
+    if not _maintenance_lock.acquire(blocking=False):
+        return
+
+    def _job():
+        try:
+            ensure_ann_index()
+        except Exception as e:
+            logging.error(f"Erro ao atualizar o índice pgvector de rag_chunks: {e}")
+        finally:
+            _maintenance_lock.release()
+
+    Thread(target=_job, daemon=True).start()
+
+
+def _sample_queries(cur, n, seed):
+    cur.execute("SELECT chatbot_id, embedding FROM rag_chunks ORDER BY random() LIMIT %s", (n,))
+    rng = np.random.default_rng(seed)
+    queries = []
+    for chatbot_id, embedding in cur.fetchall():
+        # Stored chunks with a little noise, so every query has realistic near neighbours.
+        query = np.asarray(embedding, dtype=np.float32) + rng.normal(scale=0.05, size=len(embedding))
+        queries.append((chatbot_id, (query / np.linalg.norm(query)).astype(np.float32).tolist()))
+    return queries
+
+
+def _timed_search(cur, queries, k, settings):
+    """([chunk ids per query], [seconds per query]) with the given SET LOCAL settings."""
+    found, seconds = [], []
+    for name, value in settings:
+        cur.execute(f"SET LOCAL {name} = {value}")
+    for chatbot_id, query in queries:
+        started = time.perf_counter()
+        cur.execute(
+            """
+            SELECT chunk_id FROM rag_chunks
+            WHERE chatbot_id = %s
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s
+            """,
+            (chatbot_id, query, k),
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        seconds.append(time.perf_counter() - started)
+        found.append(ids)
+    cur.connection.rollback()
+    return found, seconds
+
+
+def _latency(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {"ms_p50": round(float(np.percentile(ms, 50)), 3), "ms_p95": round(float(np.percentile(ms, 95)), 3)}
+
+
+def _knob_values(index_type, lists, k):
+    if index_type == "ivfflat":
+        values, probes = [], 1
+        while probes < lists:
+            values.append(probes)
+            probes *= 2
+        return values + [lists]
+    return sorted({max(ef, k) for ef in (k, 16, 32, 64, 128, 256, 512)})
+
+
+def recall_report(n_queries=50, k=None, seed=0):
+    """Recall@k and latency per knob value against exact search, on sampled chunks."""
+    k = k or Config.RAG_TOP_K
+    conn = get_pool_conn()
+    cur = conn.cursor()
+    try:
+        state = _read_state(cur)
+        index_type = state.get("index_type")
+        queries = _sample_queries(cur, n_queries, seed)
+        conn.rollback()
+        report = {"index_type": index_type, "lists": state.get("lists"), "k": k, "queries": len(queries)}
+        if not queries:
+            return {**report, "knobs": []}
+        truth, exact_seconds = _timed_search(
+            cur, queries, k, [("enable_indexscan", "off"), ("enable_bitmapscan", "off")]
+        )
+        report["exact"] = _latency(exact_seconds)
+        knobs = []
+        if index_type in ("hnsw", "ivfflat"):
+            name = "ivfflat.probes" if index_type == "ivfflat" else "hnsw.ef_search"
+            knob = "probes" if index_type == "ivfflat" else "ef_search"
+            for value in _knob_values(index_type, state.get("lists") or 1, k):
+                found, seconds = _timed_search(cur, queries, k, [(name, int(value))])
+                hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+                total = sum(len(t) for t in truth)
+                knobs.append({knob: value, "recall": round(hits / total, 4) if total else 1.0, **_latency(seconds)})
+        report["knobs"] = knobs
+        return report
+    finally:
+        conn.rollback()
+        cur.close()
+        put_pool_conn(conn)
+
+
+def tune_search(n_queries=None, target_ms=None):
+    """Pick and store the knob value for RAG searches from `recall_report`; returns the report."""
+    target_ms = Config.RAG_ANN_TARGET_MS if target_ms is None else target_ms
+    report = recall_report(n_queries or Config.RAG_ANN_TUNE_QUERIES)
+    knobs = report["knobs"]
+    if not knobs:
+        return report
+    within = [row for row in knobs if row["ms_p95"] <= target_ms]
+    # Most accurate value within the latency target (smallest on ties); else the fastest.
+    chosen = max(within, key=lambda row: (row["recall"], -row["ms_p95"])) if within else knobs[0]
+    report.update({"target_ms": target_ms, "chosen": chosen})
+    _run(
+        lambda cur: cur.execute(
+            "UPDATE rag_ann_index SET probes = %s, ef_search = %s, tuned_at = NOW(), report = %s WHERE id = 1",
+            (chosen.get("probes"), chosen.get("ef_search"), Json(report)),
+        )
+    )
+    bump_version(ANN_SCOPE)
+    return report
+
+
+def search_settings():
+    """Knob values for RAG searches ({"index_type", "lists", "probes", "ef_search"}), per worker."""
+    version = get_version(ANN_SCOPE)
+    with _settings_lock:
+        if _settings["version"] == version:
+            return dict(_settings)
+    try:
+        state = _run(_read_state)
+    except Exception as exc:
+        logging.debug("rag_ann_index indisponível: %s", exc)
+        state = {}
+    with _settings_lock:
+        _settings.update({
+            "version": version,
+            "index_type": state.get("index_type"),
+            "lists": state.get("lists"),
+            "probes": state.get("probes") or _default_probes(state.get("lists")),
+            "ef_search": state.get("ef_search") or Config.RAG_ANN_EF_SEARCH,
+        })
+        return dict(_settings)
+
+
+def apply_search_settings(cur, top_k):
+    """SET LOCAL the tuned probes / ef_search for the next search in this transaction."""
+    settings = search_settings()
+    if settings["index_type"] == "ivfflat":
+        cur.execute("SET LOCAL ivfflat.probes = %s", (int(settings["probes"]),))
+    elif settings["index_type"] == "hnsw":
+        # hnsw returns at most ef_search rows.
+        cur.execute("SET LOCAL hnsw.ef_search = %s", (max(int(settings["ef_search"]), int(top_k)),))
+
+
+def ann_index_status():
+    conn = get_pool_conn()
+    cur = conn.cursor()
+    try:
+        state = _read_state(cur)
+        current = _current_index(cur)
+        rows = _count_rows(cur)
+        conn.commit()
+    finally:
+        cur.close()
+        put_pool_conn(conn)
+    for key in ("built_at", "tuned_at"):
+        if state.get(key) is not None:
+            state[key] = state[key].isoformat()
+    return {
+        **state,
+        "rows": rows,
+        "live_index": {"type": current[0], "options": current[1]} if current else None,
+        "target_type": choose_ann_index(rows),
+        "needs_rebuild": needs_rebuild(choose_ann_index(rows), rows, current, state),
+    }
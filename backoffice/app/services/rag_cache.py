@@ -0,0 +1,149 @@
+"""Semantic cache of RAG answers (table `rag_answer_cache`, pgvector).
+
+Every generated answer is stored with the embedding of its question, the chunks it
+was generated from and its sources. A new question is answered from the cache when a
+cached question of the same chatbot is within RAG_ANSWER_CACHE_MAX_DISTANCE (cosine
+distance) and the chatbot's documents haven't changed since: entries carry the
+version of the scope `rag:<chatbot_id>`, which `index_pdf_documents` bumps, and the
+Ollama model that wrote them.
+
+Eviction: entries older than RAG_ANSWER_CACHE_TTL_SECONDS are ignored and deleted,
+and each chatbot keeps at most RAG_ANSWER_CACHE_MAX_ENTRIES (least recently used go
+first). The table is shared by all workers; errors only cost a miss.
+"""
+
+import logging
+from threading import Lock
+
+from psycopg2.extras import Json
+
+from ..config import Config
+from ..db import get_pool_conn, put_pool_conn
+from .cache_versions import bump_version, get_version
+
+_stats_lock = Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+
+def rag_scope(chatbot_id):
+    return f"rag:{int(chatbot_id)}"
+
+
+def invalidate_rag_cache(*chatbot_ids):
+    """Mark the cached RAG answers of the given chatbots as stale (documents changed)."""
+    for chatbot_id in {int(c) for c in chatbot_ids if c is not None}:
+        bump_version(rag_scope(chatbot_id))
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _run(fn, *args):
+    conn = get_pool_conn()
+    cur = conn.cursor()
+    try:
+        result = fn(cur, *args)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        put_pool_conn(conn)
+
+
+def _lookup(cur, chatbot_id, version, query_emb):
+    cur.execute(
+        """
+        SELECT cache_id, resposta, fontes, 1 - (embedding <=> %s::vector) AS score
+        FROM rag_answer_cache
+        WHERE chatbot_id = %s AND doc_version = %s AND llm_model = %s
+          AND created_at > NOW() - %s * INTERVAL '1 second'
+        ORDER BY embedding <=> %s::vector
+        LIMIT 1
+        """,
+        (query_emb, chatbot_id, version, Config.OLLAMA_MODEL, Config.RAG_ANSWER_CACHE_TTL_SECONDS, query_emb),
+    )
+    row = cur.fetchone()
+    if not row or row[3] is None or 1.0 - float(row[3]) > Config.RAG_ANSWER_CACHE_MAX_DISTANCE:
+        return None
+    cur.execute(
+        "UPDATE rag_answer_cache SET hits = hits + 1, last_hit_at = NOW() WHERE cache_id = %s",
+        (row[0],),
+    )
+    return row[1], list(row[2] or [])
+
+
+def _store(cur, chatbot_id, version, query_emb, pergunta, chunk_ids, resposta, fontes):
+    cur.execute(
+        """
+        INSERT INTO rag_answer_cache
+        (chatbot_id, doc_version, llm_model, embedding, pergunta, chunk_ids, resposta, fontes)
+        VALUES (%s, %s, %s, %s::vector, %s, %s, %s, %s)
+        """,
+        (chatbot_id, version, Config.OLLAMA_MODEL, query_emb, pergunta, list(chunk_ids), resposta, Json(fontes)),
+    )
+    # Evict this chatbot's stale, expired and least recently used entries.
+    cur.execute(
+        """
+        DELETE FROM rag_answer_cache
+        WHERE chatbot_id = %s
+          AND (doc_version <> %s OR created_at < NOW() - %s * INTERVAL '1 second'
+               OR cache_id IN (
+                   SELECT cache_id FROM rag_answer_cache
+                   WHERE chatbot_id = %s
+                   ORDER BY COALESCE(last_hit_at, created_at) DESC
+                   OFFSET %s
+               ))
+        """,
+        (chatbot_id, version, Config.RAG_ANSWER_CACHE_TTL_SECONDS, chatbot_id, Config.RAG_ANSWER_CACHE_MAX_ENTRIES),
+    )
+
+
+def get_cached_rag_answer(chatbot_id, query_emb):
+    """(resposta, fontes) of a cached answer close enough to `query_emb`, or None."""
+    if not Config.RAG_ANSWER_CACHE:
+        return None
+    try:
+        found = _run(_lookup, int(chatbot_id), get_version(rag_scope(chatbot_id)), list(map(float, query_emb)))
+    except Exception as exc:
+        logging.debug("rag_answer_cache indisponível: %s", exc)
+        _count("errors")
+        return None
+    _count("hits" if found else "misses")
+    return found
+
+
+def store_rag_answer(chatbot_id, query_emb, pergunta, chunk_ids, resposta, fontes):
+    if not Config.RAG_ANSWER_CACHE or not resposta:
+        return
+    try:
+        _run(
+            _store, int(chatbot_id), get_version(rag_scope(chatbot_id)), list(map(float, query_emb)),
+            pergunta, chunk_ids, resposta, fontes,
+        )
+        _count("stores")
+    except Exception as exc:
+        logging.debug("rag_answer_cache indisponível: %s", exc)
+        _count("errors")
+
+
+def _count_entries(cur):
+    cur.execute("SELECT COUNT(*) FROM rag_answer_cache")
+    return int(cur.fetchone()[0])
+
+
+def rag_answer_cache_stats():
+    """Counters of this worker plus the number of cached answers (all workers)."""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    try:
+        stats["entries"] = _run(_count_entries)
+    except Exception:
+        stats["entries"] = None
+    return {"enabled": Config.RAG_ANSWER_CACHE, **stats}
@@ -0,0 +1,165 @@
+"""Bulk writes of rag_chunks rows.
+
+`write_rag_chunks` streams a batch with `COPY ... FROM STDIN (FORMAT binary)`: integers
+and text go as raw bytes and embeddings in pgvector's binary encoding (int16 dim,
+int16 unused, big-endian float4s), so there is no float -> text conversion and no
+per-row statement. If the server refuses the binary COPY (a pgvector without binary
+I/O, a pooler without COPY support) the batch is written with batched `execute_values`
+instead, and the worker keeps using it. RAG_CHUNK_LOADER=values always uses the latter.
+
+`benchmark_writers` measures both (rows/second) on a temporary table:
+`python manage_indexes.py bench-rag-insert`.
+"""
+
+import io
+import logging
+import struct
+import time
+from functools import lru_cache
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from ..config import Config
+
+COLUMNS = ("chatbot_id", "pdf_id", "page_num", "chunk_index", "content", "embedding")
+
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+_NULL = struct.pack(">i", -1)
+
+_copy_supported = True
+
+
+def _int4(value):
+    return _NULL if value is None else struct.pack(">ii", 4, value)
+
+
+def _text(value):
+    data = value.encode("utf-8")
+    return struct.pack(">i", len(data)) + data
+
+
+def _vector(embedding):
+    embedding = np.asarray(embedding)
+    dim = embedding.shape[0]
+    return struct.pack(">ihh", 4 + 4 * dim, dim, 0) + embedding.astype(">f4").tobytes()
+
+
+def encode_copy_binary(rows):
+    """COPY binary payload of (chatbot_id, pdf_id, page_num, chunk_index, content, embedding) rows."""
+    buf = io.BytesIO()
+    buf.write(_COPY_HEADER)
+    field_count = struct.pack(">h", len(COLUMNS))
+    for chatbot_id, pdf_id, page_num, chunk_index, content, embedding in rows:
+        buf.write(field_count)
+        buf.write(_int4(chatbot_id))
+        buf.write(_int4(pdf_id))
+        buf.write(_int4(page_num))
+        buf.write(_int4(chunk_index))
+        buf.write(_text(content))
+        buf.write(_vector(embedding))
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+def copy_rag_chunks(cur, rows, table="rag_chunks"):
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT binary)",
+        encode_copy_binary(rows),
+    )
+
+
+@lru_cache(maxsize=4)
+def _literal_format(dim):
+    # %.9g round-trips float32 exactly.
+    return "[" + ",".join(["%.9g"] * dim) + "]"
+
+
+def _vector_literal(embedding):
+    values = np.asarray(embedding, dtype=np.float32).tolist()
+    return _literal_format(len(values)) % tuple(values)
+
+
+def insert_rag_chunks(cur, rows, table="rag_chunks", page_size=500):
+    # Embeddings as text literals: '[...]'::vector parses much faster than numeric[] casts.
+    execute_values(
+        cur,
+        f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES %s",
+        [
+            (chatbot_id, pdf_id, page_num, chunk_index, content, _vector_literal(embedding))
+            for chatbot_id, pdf_id, page_num, chunk_index, content, embedding in rows
+        ],
+        template="(%s, %s, %s, %s, %s, %s::vector)",
+        page_size=page_size,
+    )
+
+
+def write_rag_chunks(cur, rows, table="rag_chunks"):
+    """Write the rows with binary COPY, falling back to execute_values (see module docstring)."""
+    global _copy_supported
+    rows = list(rows)
+    if not rows:
+        return 0
+    if _copy_supported and Config.RAG_CHUNK_LOADER == "copy":
+        # The savepoint keeps the caller's transaction usable if the COPY is refused.
+        cur.execute("SAVEPOINT rag_chunks_copy")
+        try:
+            copy_rag_chunks(cur, rows, table)
+            cur.execute("RELEASE SAVEPOINT rag_chunks_copy")
+            return len(rows)
+        except psycopg2.Error as exc:
+            cur.execute("ROLLBACK TO SAVEPOINT rag_chunks_copy")
+            _copy_supported = False
+            logging.warning(f"COPY binário em {table} indisponível, a usar execute_values: {exc}")
+    insert_rag_chunks(cur, rows, table)
+    return len(rows)
+
+
+def _sample_rows(n, dim, content_chars):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((n, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    content = ("lorem ipsum " * (content_chars // 12 + 1))[:content_chars]
+    return [(1, 1, i // 4 + 1, i, content, embeddings[i]) for i in range(n)]
+
+
+def benchmark_writers(conn, rows=20000, batch_size=None, content_chars=None):
+    """Rows/second of binary COPY and execute_values into a temporary copy of rag_chunks.
+
+    Nothing is kept: the table is temporary and the transaction is rolled back.
+    """
+    batch_size = batch_size or Config.RAG_INGEST_BATCH_SIZE
+    content_chars = content_chars or Config.RAG_CHUNK_SIZE_CHARS
+    sample = _sample_rows(rows, Config.RAG_EMBEDDING_DIM, content_chars)
+    writers = {"copy": copy_rag_chunks, "execute_values": insert_rag_chunks}
+    results = {"rows": rows, "batch_size": batch_size}
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            CREATE TEMP TABLE rag_chunks_bench (
+                chunk_id SERIAL PRIMARY KEY,
+                chatbot_id INT,
+                pdf_id INT,
+                page_num INT,
+                chunk_index INT,
+                content TEXT NOT NULL,
+                embedding vector({Config.RAG_EMBEDDING_DIM}),
+                created_at TIMESTAMPTZ DEFAULT NOW()
+            )
+            """
+        )
+        for name, writer in writers.items():
+            cur.execute("TRUNCATE rag_chunks_bench")
+            started = time.perf_counter()
+            for start in range(0, rows, batch_size):
+                writer(cur, sample[start:start + batch_size], "rag_chunks_bench")
+            elapsed = time.perf_counter() - started
+            results[name] = {"seconds": round(elapsed, 3), "rows_per_second": round(rows / elapsed, 1)}
+        return results
+    finally:
+        conn.rollback()
+        cur.close()
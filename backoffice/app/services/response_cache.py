@@ -0,0 +1,164 @@
+"""Cache of the answers of /obter-resposta (final JSON payloads).
+
+Keyed by (chatbot_id, idioma, fonte, question) plus the versions of the data the answer
+was computed from: the chatbot's `faq:<id>` scope (bumped by every FAQ, document, video
+and chatbot-settings write, see faq_corpus.invalidate_faq_cache) and, for the hybrid
+search, the `faq_index` scope. A write therefore makes the old entries unreachable in
+every worker within CACHE_VERSION_CHECK_SECONDS; nothing has to be deleted.
+
+Two tiers:
+
+    memory    per-worker LRU (RESPONSE_CACHE_MAX_ENTRIES / _MAX_MB)
+    postgres  optional table `response_cache` shared by all workers
+              (RESPONSE_CACHE_SHARED=1); hits are copied into the memory tier
+
+Both drop entries older than RESPONSE_CACHE_TTL_SECONDS. Only answers are cached:
+"no answer" results are registered as unanswered questions on every request and RAG
+answers are left to the RAG path. Database errors only cost a miss.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from threading import Lock
+
+from psycopg2.extras import Json
+
+from ..config import Config
+from ..db import get_pool_conn, put_pool_conn
+from .cache import LRUCache
+from .cache_versions import get_version
+from .faq_corpus import faq_scope, normalize_question
+from .retreival import FAQ_INDEX_SCOPE
+
+_memory = LRUCache(
+    max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=int(Config.RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+    ttl=Config.RESPONSE_CACHE_TTL_SECONDS or None,
+    sizeof=lambda payload: len(json.dumps(payload, ensure_ascii=False, default=str)),
+)
+
+_stats_lock = Lock()
+_shared_stats = {"hits": 0, "misses": 0, "errors": 0}
+_pruned_at = 0.0
+_PRUNE_EVERY_SECONDS = 300
+
+
+def response_cache_key(chatbot_id, idioma, fonte, pergunta):
+    """Cache key of a question, or None when caching is off."""
+    if not Config.RESPONSE_CACHE:
+        return None
+    chatbot_id = int(chatbot_id)
+    versions = (get_version(faq_scope(chatbot_id)), get_version(FAQ_INDEX_SCOPE) if fonte == "faiss" else 0)
+    return (chatbot_id, idioma or "", fonte or "", normalize_question(pergunta), versions)
+
+
+def _digest(key):
+    return hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8")).digest()
+
+
+def _run(fn, *args):
+    conn = get_pool_conn()
+    cur = conn.cursor()
+    try:
+        result = fn(cur, *args)
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        put_pool_conn(conn)
+
+
+def _count(name):
+    with _stats_lock:
+        _shared_stats[name] += 1
+
+
+def _select(cur, digest):
+    cur.execute(
+        """
+        SELECT payload FROM response_cache
+        WHERE cache_key = %s AND created_at > NOW() - %s * INTERVAL '1 second'
+        """,
+        (digest, Config.RESPONSE_CACHE_TTL_SECONDS or 10 ** 9),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _insert(cur, digest, chatbot_id, payload, prune):
+    cur.execute(
+        """
+        INSERT INTO response_cache (cache_key, chatbot_id, payload) VALUES (%s, %s, %s)
+        ON CONFLICT (cache_key) DO UPDATE SET payload = EXCLUDED.payload, created_at = NOW()
+        """,
+        (digest, chatbot_id, Json(payload)),
+    )
+    if prune:
+        # Entries of older versions are never read again; they go with the TTL.
+        cur.execute(
+            "DELETE FROM response_cache WHERE created_at < NOW() - %s * INTERVAL '1 second'",
+            (Config.RESPONSE_CACHE_TTL_SECONDS,),
+        )
+
+
+def get_cached_response(key):
+    """Cached payload for `key` (from `response_cache_key`), or None."""
+    if key is None:
+        return None
+    payload = _memory.get(key)
+    if payload is not None or not Config.RESPONSE_CACHE_SHARED:
+        return payload
+    try:
+        payload = _run(_select, _digest(key))
+    except Exception as exc:
+        logging.debug("response_cache indisponível: %s", exc)
+        _count("errors")
+        return None
+    _count("hits" if payload is not None else "misses")
+    if payload is not None:
+        _memory.put(key, payload)
+    return payload
+
+
+def cache_response(key, payload):
+    """Store the payload answered for `key`; returns it for `return jsonify(...)`."""
+    global _pruned_at
+    if key is None:
+        return payload
+    _memory.put(key, payload)
+    if Config.RESPONSE_CACHE_SHARED:
+        now = time.monotonic()
+        prune = bool(Config.RESPONSE_CACHE_TTL_SECONDS) and now - _pruned_at > _PRUNE_EVERY_SECONDS
+        if prune:
+            _pruned_at = now
+        try:
+            _run(_insert, _digest(key), key[0], payload, prune)
+        except Exception as exc:
+            logging.debug("response_cache indisponível: %s", exc)
+            _count("errors")
+    return payload
+
+
+def response_cache_stats():
+    """Hit/miss counters of this worker: memory tier, shared tier and overall."""
+    memory = _memory.stats()
+    with _stats_lock:
+        shared = dict(_shared_stats)
+    lookups = memory["hits"] + memory["misses"]
+    hits = memory["hits"] + shared["hits"]
+    shared_lookups = shared["hits"] + shared["misses"]
+    shared["hit_rate"] = round(shared["hits"] / shared_lookups, 4) if shared_lookups else 0.0
+    return {
+        "enabled": Config.RESPONSE_CACHE,
+        "shared_enabled": Config.RESPONSE_CACHE_SHARED,
+        "memory": memory,
+        "shared": shared,
+        "hits": hits,
+        "lookups": lookups,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+    }
@@ -1,14 +1,23 @@
-from ..db import get_conn
-from sentence_transformers import SentenceTransformer
+from ..db import get_conn, advisory_lock, try_advisory_lock
 import numpy as np
 import faiss
 import pickle
 import logging
+import json
+import base64
+from threading import Lock, Thread
+from contextlib import contextmanager
 from ..config import Config
 import os
+import time
 from .text import preprocess_text
+from .cache_versions import get_version, fetch_version, bump_version
+from .embeddings import EncodePool, encode_queries, embedding_dim
+from .embedding_store import encode_cached
+from .faq_corpus import get_corpus, invalidate_faq_cache
+from .faq_index_factory import NEEDS_TRAINING, NON_REMOVABLE, build_index, choose_index_type, configure_search
+from .faq_index_store import FaqArtifact, write_artifact, activate_artifact, current_artifact_path, read_manifest
 
-embedding_model = SentenceTransformer('all-MiniLM-L12-v2')
 PDF_STORAGE_PATH = Config.PDF_STORAGE_PATH
 ICON_STORAGE_PATH = Config.ICON_STORAGE_PATH
 os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
@@ -21,136 +30,767 @@ def _faq_to_embedding_text(pergunta, resposta):
     return preprocess_text(combined)
 
 
-def build_faiss_index(chatbot_id=None):
-    conn = get_conn()
+def _idioma_key(idioma):
+    """Normalize a FAQ/query language to the two-letter key used by the partitions."""
+    return (idioma or "").strip().lower()[:2] or None
+
+
+_ROW_SQL = "SELECT faq_id, pergunta, resposta, chatbot_id, idioma FROM faq"
+
+
+def _row_key(row):
+    # Backwards compatibility: old cache may not have idioma
+    faq_idioma = row[4] if len(row) >= 5 else None
+    return int(row[3]), _idioma_key(faq_idioma)
+
+
+class _PartitionRows:
+    """faq_id -> row mapping of a partition.
+
+    Rows of the snapshot are read lazily from the memory-mapped artifact (positions
+    `start:end`). Rows added or replaced since then live in `overlay` (with their
+    embedding in `vectors`); snapshot rows that were removed or replaced are listed in
+    `hidden`.
+    """
+
+    __slots__ = ("artifact", "start", "end", "overlay", "vectors", "hidden")
+
+    def __init__(self, artifact=None, start=0, end=0, overlay=None, vectors=None, hidden=None):
+        self.artifact = artifact
+        self.start = start
+        self.end = end
+        self.overlay = overlay or {}
+        self.vectors = vectors or {}
+        self.hidden = hidden or set()
+
+    def _base_pos(self, faq_id):
+        if self.artifact is None or faq_id in self.hidden:
+            return None
+        pos = self.artifact.position(faq_id)
+        if pos is None or not (self.start <= pos < self.end):
+            return None
+        return pos
+
+    def __contains__(self, faq_id):
+        return faq_id in self.overlay or self._base_pos(faq_id) is not None
+
+    def __getitem__(self, faq_id):
+        row = self.overlay.get(faq_id)
+        if row is not None:
+            return row
+        pos = self._base_pos(faq_id)
+        if pos is None:
+            raise KeyError(faq_id)
+        return self.artifact.row(pos)
+
+    def __len__(self):
+        return (self.end - self.start) - len(self.hidden) + len(self.overlay)
+
+    def changed(self, remove_ids=(), rows=(), embeddings=None):
+        overlay = dict(self.overlay)
+        vectors = dict(self.vectors)
+        hidden = set(self.hidden)
+        for faq_id in remove_ids:
+            overlay.pop(faq_id, None)
+            vectors.pop(faq_id, None)
+            if self._base_pos(faq_id) is not None:
+                hidden.add(faq_id)
+        for row, emb in zip(rows, embeddings if len(rows) else []):
+            faq_id = int(row[0])
+            if self._base_pos(faq_id) is not None:
+                hidden.add(faq_id)
+            overlay[faq_id] = row
+            vectors[faq_id] = emb
+        return _PartitionRows(self.artifact, self.start, self.end, overlay, vectors, hidden)
+
+    def export(self):
+        """Return (rows, embeddings) of the live FAQs, with the original embeddings."""
+        rows, blocks = [], []
+        if self.artifact is not None and self.end > self.start:
+            positions = [
+                pos for pos in range(self.start, self.end)
+                if int(self.artifact.faq_ids[pos]) not in self.hidden
+            ]
+            rows.extend(self.artifact.row(pos) for pos in positions)
+            blocks.append(np.asarray(self.artifact.embeddings[positions], dtype=np.float32))
+        if self.overlay:
+            rows.extend(self.overlay.values())
+            blocks.append(np.vstack([self.vectors[faq_id] for faq_id in self.overlay]))
+        if not blocks:
+            return rows, None
+        return rows, np.vstack(blocks).astype(np.float32, copy=False)
+
+
+# Labels of non-removable index types: the low 32 bits hold the faq_id, the high bits
+# a generation that changes every time the FAQ is re-added.
+_LABEL_FAQ_MASK = (1 << 32) - 1
+
+
+class _FaqPartition:
+    """FAISS index over the FAQs of a single (chatbot_id, idioma) pair.
+
+    Vectors are stored under their faq_id (IndexIDMap2), so a search hit maps straight
+    to `rows[faq_id]` and single FAQs can be removed or replaced without a rebuild.
+    Index types that can't remove vectors (HNSW) keep them as tombstones: a hit only
+    counts if its label is the live label of a FAQ still in `rows` (`labels` holds the
+    faq_ids re-added since the last build). Tombstones are dropped when the snapshot
+    is rewritten.
+    Partitions are treated as immutable: `with_changes` returns an updated copy.
+    """
+
+    __slots__ = ("index", "rows", "mmapped", "kind", "labels")
+
+    def __init__(self, index, rows, mmapped=False, kind="flat", labels=None):
+        self.index = index
+        self.rows = rows
+        self.mmapped = mmapped
+        self.kind = kind
+        self.labels = labels or {}
+
+    @classmethod
+    def from_rows(cls, rows, embeddings, kind=None):
+        kind = choose_index_type(len(rows), kind)
+        ids = [int(r[0]) for r in rows]
+        index = build_index(kind, embeddings, ids)
+        return cls(index, _PartitionRows().changed(rows=rows, embeddings=embeddings), kind=kind)
+
+    @property
+    def tombstones(self):
+        return self.index.ntotal - len(self.rows)
+
+    def with_changes(self, remove_ids=(), rows=(), embeddings=None, copy=True):
+        if not copy:
+            index = self.index
+        elif self.mmapped:
+            # Read-only mapped indexes can't be mutated (nor shallow-cloned): materialize.
+            index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            configure_search(index)
+        else:
+            index = faiss.clone_index(self.index)
+            configure_search(index)
+        labels = dict(self.labels)
+        remove_ids = [faq_id for faq_id in remove_ids if faq_id in self.rows]
+        if self.kind in NON_REMOVABLE:
+            for faq_id in remove_ids:
+                labels.setdefault(faq_id, faq_id)
+        elif remove_ids:
+            index.remove_ids(np.asarray(remove_ids, dtype=np.int64))
+        if len(rows):
+            ids = []
+            for row in rows:
+                faq_id = int(row[0])
+                if self.kind in NON_REMOVABLE and (faq_id in labels or faq_id in self.rows):
+                    # The old vector stays in the index: give the new one a fresh label.
+                    label = ((labels.get(faq_id, faq_id) >> 32) + 1) << 32 | faq_id
+                    labels[faq_id] = label
+                    ids.append(label)
+                else:
+                    ids.append(faq_id)
+            index.add_with_ids(np.ascontiguousarray(embeddings, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+        return _FaqPartition(index, self.rows.changed(remove_ids, rows, embeddings), kind=self.kind, labels=labels)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def export(self):
+        """Return (rows, embeddings) of the live FAQs."""
+        return self.rows.export()
+
+    def compacted(self):
+        """Partition to persist: rebuilt when it has tombstones or outgrew its type."""
+        if not self.tombstones and self.kind == choose_index_type(len(self.rows)):
+            return self
+        rows, embeddings = self.export()
+        return _FaqPartition.from_rows(rows, embeddings)
+
+    def search(self, query_emb, k):
+        return self.search_batch(query_emb[:1], k)[0]
+
+    def search_batch(self, query_embs, k):
+        """Top `k` (score, row) per query row of `query_embs`, in one index search."""
+        # Tombstoned vectors may take some of the top slots: fetch enough to cover them.
+        n = min(k + self.tombstones, self.index.ntotal)
+        if n <= 0:
+            return [[] for _ in range(len(query_embs))]
+        D, I = self.index.search(query_embs, n)
+        batch = []
+        for scores, labels in zip(D, I):
+            results = []
+            for score, label in zip(scores, labels):
+                if label == -1:
+                    continue
+                faq_id = int(label) & _LABEL_FAQ_MASK
+                if faq_id not in self.rows or self.labels.get(faq_id, faq_id) != label:
+                    continue
+                results.append((float(score), self.rows[faq_id]))
+                if len(results) >= k:
+                    break
+            batch.append(results)
+        return batch
+
+
+# Registry of per-(chatbot_id, idioma) partitions. The dict is never mutated in place:
+# rebuilds, incremental updates and hot reloads assemble a new dict and swap the module
+# reference, so in-flight searches that grabbed the previous one keep a consistent view.
+_partitions = {}
+# cache_version of the artifact `_partitions` was loaded from / last written as.
+_loaded_version = 0
+# Active on-disk snapshot (None until one was written, e.g. legacy pickle loaded).
+_artifact = None
+# Serializes writers within the process; the advisory lock below does it across workers.
+_index_lock = Lock()
+_delta_entries = 0
+_reload_thread = None
+
+FAQ_INDEX_SCOPE = "faq_index"
+# Guards the snapshot + delta log files: exclusive for writers, shared for loaders.
+_PG_FAQ_INDEX_LOCK_KEY = 912340981274
+# Held while building a missing index at startup, so only one worker does it.
+_PG_FAQ_INDEX_BUILD_LOCK_KEY = 912340981275
+
+
+def _build_partitions(faqs, embeddings):
+    grouped = {}
+    for pos, row in enumerate(faqs):
+        grouped.setdefault(_row_key(row), []).append(pos)
+    return {
+        key: _FaqPartition.from_rows([faqs[p] for p in positions], embeddings[positions])
+        for key, positions in grouped.items()
+    }
+
+
+def _open_partitions(artifact):
+    partitions = {}
+    for part in artifact.partitions:
+        index, mmapped = artifact.read_index(part)
+        configure_search(index)
+        rows = _PartitionRows(artifact, part["start"], part["end"])
+        kind = part.get("index_type", "flat")
+        partitions[(part["chatbot_id"], part["idioma"])] = _FaqPartition(index, rows, mmapped, kind)
+    return partitions
+
+
+def _encode_faqs(faqs, progress=None, pool=None):
+    textos = [_faq_to_embedding_text(f[1], f[2]) for f in faqs]
+    scaled = (lambda fraction, message="": progress(0.9 * fraction, message)) if progress else None
+    return encode_cached(textos, Config.FAQ_EMBEDDING_MODEL, progress=scaled, pool=pool)
+
+
+class _PartitionBuilder:
+    """One partition being filled while the faq table is streamed.
+
+    The index type is chosen up front from the expected row count. Types that need no
+    training get every batch added as it arrives; trained types (IVF, SQ8) are built
+    from the collected vectors at the end.
+    """
+
+    def __init__(self, expected, dim):
+        self.kind = choose_index_type(expected)
+        self.rows = []
+        self.embeddings = np.empty((max(expected, 1), dim), dtype=np.float32)
+        self.index = None
+        if self.kind not in NEEDS_TRAINING:
+            self.index = build_index(self.kind, self.embeddings[:0], [])
+
+    def add(self, rows, embeddings):
+        start, end = len(self.rows), len(self.rows) + len(rows)
+        if end > len(self.embeddings):
+            # FAQs inserted after the rows were counted.
+            grown = np.empty((max(end, 2 * len(self.embeddings)), self.embeddings.shape[1]), dtype=np.float32)
+            grown[:start] = self.embeddings[:start]
+            self.embeddings = grown
+        self.embeddings[start:end] = embeddings
+        self.rows.extend(rows)
+        if self.index is not None:
+            ids = np.asarray([int(row[0]) for row in rows], dtype=np.int64)
+            self.index.add_with_ids(self.embeddings[start:end], ids)
+
+    def finish(self):
+        embeddings = self.embeddings[:len(self.rows)]
+        if self.index is None or self.kind != choose_index_type(len(self.rows)):
+            return _FaqPartition.from_rows(self.rows, embeddings)
+        rows = _PartitionRows().changed(rows=self.rows, embeddings=embeddings)
+        return _FaqPartition(self.index, rows, kind=self.kind)
+
+
+def _stream_partitions(conn, chatbot_id=None, progress=None):
+    """Build partitions from the faq table without loading it at once.
+
+    Rows come from a server-side cursor in FAQ_INDEX_BUILD_BATCH_SIZE batches; each
+    batch is encoded (cache misses only, over an `EncodePool` when configured) and
+    appended to its partition before the next one is fetched.
+    """
+    where, params = (" WHERE chatbot_id = %s", (chatbot_id,)) if chatbot_id else ("", ())
     cur = conn.cursor()
     try:
-        if chatbot_id:
-            cur.execute(
-                "SELECT faq_id, pergunta, resposta, chatbot_id, idioma FROM faq WHERE chatbot_id = %s",
-                (chatbot_id,),
-            )
-        else:
-            cur.execute("SELECT faq_id, pergunta, resposta, chatbot_id, idioma FROM faq")
-        faqs = cur.fetchall()
-        textos = [_faq_to_embedding_text(f[1], f[2]) for f in faqs]
-        if not textos:
-            emb_dim = embedding_model.get_sentence_embedding_dimension()
-            embeddings = np.zeros((1, emb_dim), dtype=np.float32)
-            index = faiss.IndexFlatIP(emb_dim)
+        cur.execute(f"SELECT chatbot_id, idioma, COUNT(*) FROM faq{where} GROUP BY chatbot_id, idioma", params)
+        expected = {}
+        for row_chatbot, idioma, count in cur.fetchall():
+            key = (int(row_chatbot), _idioma_key(idioma))
+            expected[key] = expected.get(key, 0) + int(count)
+    finally:
+        cur.close()
+    total = sum(expected.values())
+    dim = embedding_dim(Config.FAQ_EMBEDDING_MODEL)
+    builders = {}
+    done = 0
+    cur = conn.cursor(name="faq_index_build")
+    cur.itersize = Config.FAQ_INDEX_BUILD_BATCH_SIZE
+    try:
+        cur.execute(f"{_ROW_SQL}{where} ORDER BY faq_id", params)
+        with EncodePool(Config.FAQ_EMBEDDING_MODEL) as pool:
+            while True:
+                batch = cur.fetchmany(Config.FAQ_INDEX_BUILD_BATCH_SIZE)
+                if not batch:
+                    break
+                batch = [tuple(row) for row in batch]
+                embeddings = _encode_faqs(batch, pool=pool)
+                grouped = {}
+                for pos, row in enumerate(batch):
+                    grouped.setdefault(_row_key(row), []).append(pos)
+                for key, positions in grouped.items():
+                    builder = builders.get(key)
+                    if builder is None:
+                        builder = builders[key] = _PartitionBuilder(expected.get(key, len(positions)), dim)
+                    builder.add([batch[p] for p in positions], embeddings[positions])
+                done += len(batch)
+                if progress:
+                    progress(0.9 * min(done / max(total, 1), 1.0), f"{done}/{total} FAQs codificadas")
+    finally:
+        cur.close()
+    return {key: builder.finish() for key, builder in builders.items()}
+
+
+def _apply_changes(partitions, remove_ids=(), rows=(), embeddings=None):
+    """Return a new registry with `remove_ids` dropped and `rows` added/replaced.
+
+    A FAQ whose chatbot or language changed is removed from its old partition and
+    added to the new one.
+    """
+    drop = {int(faq_id) for faq_id in remove_ids} | {int(row[0]) for row in rows}
+    added = {}
+    for pos, row in enumerate(rows):
+        added.setdefault(_row_key(row), []).append(pos)
+
+    updated = dict(partitions)
+    for key, part in partitions.items():
+        stale = [faq_id for faq_id in drop if faq_id in part.rows]
+        if stale and key not in added:
+            part = part.with_changes(remove_ids=stale)
+            if len(part):
+                updated[key] = part
+            else:
+                del updated[key]
+    for key, positions in added.items():
+        new_rows = [rows[p] for p in positions]
+        part = updated.get(key)
+        if part is None:
+            updated[key] = _FaqPartition.from_rows(new_rows, embeddings[positions])
         else:
-            embeddings = embedding_model.encode(textos, show_progress_bar=True)
-            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-            index = faiss.IndexFlatIP(embeddings.shape[1])
-            index.add(np.array(embeddings, dtype=np.float32))
-        with open(Config.FAQ_EMBEDDINGS_PATH, 'wb') as f:
-            pickle.dump({'faqs': faqs, 'embeddings': embeddings}, f)
-        faiss.write_index(index, Config.INDEX_PATH)
-        logging.info(f"Índice FAISS para FAQs salvo em {Config.INDEX_PATH}")
+            stale = [faq_id for faq_id in drop if faq_id in part.rows]
+            updated[key] = part.with_changes(stale, new_rows, embeddings[positions])
+    return updated
+
+
+def _save_partitions(partitions, version, build_started=None):
+    """Write a new snapshot, activate it and return (partitions, artifact) mapped from it."""
+    global _delta_entries
+    parts = []
+    for (chatbot_id, idioma), part in partitions.items():
+        part = part.compacted()
+        rows, embeddings = part.export()
+        parts.append((chatbot_id, idioma, rows, embeddings, part.index, part.kind))
+    os.makedirs(Config.FAQ_INDEX_DIR, exist_ok=True)
+    path = write_artifact(
+        Config.FAQ_INDEX_DIR, version, parts, embedding_dim(Config.FAQ_EMBEDDING_MODEL),
+        model=Config.FAQ_EMBEDDING_MODEL, build_started=build_started,
+    )
+    activate_artifact(Config.FAQ_INDEX_DIR, path)
+    _delta_entries = 0
+    artifact = FaqArtifact(path)
+    return _open_partitions(artifact), artifact
+
+
+def _append_delta(entries, version, partitions):
+    """Persist incremental changes; the log is folded into a new snapshot when it grows.
+
+    Returns the (partitions, artifact) to install.
+    """
+    global _delta_entries
+    if _artifact is None:
+        return _save_partitions(partitions, version)
+    with open(_artifact.delta_path, 'a', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps({**entry, "version": version}, ensure_ascii=False) + "\n")
+    _delta_entries += len(entries)
+    if _delta_entries >= Config.FAQ_INDEX_DELTA_MAX_ENTRIES:
+        return _save_partitions(partitions, version)
+    return partitions, _artifact
+
+
+def _read_delta(delta_path):
+    """Entries of a delta log, in the order they were written."""
+    if not os.path.exists(delta_path):
+        return
+    with open(delta_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A torn last line (crash mid-write) only loses that change.
+                logging.warning("Entrada inválida no log de alterações do índice FAISS ignorada.")
+
+
+def _apply_entry(partitions, entry):
+    if entry["op"] == "upsert":
+        row = tuple(entry["row"])
+        emb = np.frombuffer(base64.b64decode(entry["embedding"]), dtype=np.float32)
+        return _apply_changes(partitions, rows=[row], embeddings=emb.reshape(1, -1))
+    if entry["op"] == "remove":
+        return _apply_changes(partitions, remove_ids=entry["faq_ids"])
+    if entry["op"] == "remove_chatbot":
+        return {k: p for k, p in partitions.items() if k[0] != int(entry["chatbot_id"])}
+    return partitions
+
+
+def _replay_delta(partitions, version, delta_path):
+    global _delta_entries
+    _delta_entries = 0
+    for entry in _read_delta(delta_path):
+        _delta_entries += 1
+        version = max(version, int(entry.get("version", 0)))
+        partitions = _apply_entry(partitions, entry)
+    return partitions, version
+
+
+def _index_exists():
+    return bool(current_artifact_path(Config.FAQ_INDEX_DIR)) or os.path.exists(Config.FAQ_EMBEDDINGS_PATH)
+
+
+def _index_usable():
+    """An index exists and was built with the configured embedding model."""
+    path = current_artifact_path(Config.FAQ_INDEX_DIR)
+    if not path:
+        return os.path.exists(Config.FAQ_EMBEDDINGS_PATH)
+    model = (read_manifest(path) or {}).get("model")
+    if model not in (None, Config.FAQ_EMBEDDING_MODEL):
+        logging.warning(
+            f"Índice FAQ em {path} foi construído com '{model}', "
+            f"mas FAQ_EMBEDDING_MODEL é '{Config.FAQ_EMBEDDING_MODEL}'."
+        )
+        return False
+    return True
+
+
+def _read_partitions():
+    """Map the active snapshot and replay its delta log.
+
+    Returns (partitions, version, artifact). Falls back to the legacy pickle
+    (FAQ_EMB_PATH) until the first snapshot is written. Callers hold the advisory
+    lock (shared or exclusive).
+    """
+    path = current_artifact_path(Config.FAQ_INDEX_DIR)
+    if path:
+        artifact = FaqArtifact(path)
+        partitions, version = _replay_delta(_open_partitions(artifact), artifact.version, artifact.delta_path)
+        return partitions, version, artifact
+    with open(Config.FAQ_EMBEDDINGS_PATH, 'rb') as f:
+        data = pickle.load(f)
+    faqs = data['faqs']
+    partitions = {}
+    if faqs:
+        partitions = _build_partitions(faqs, np.asarray(data['embeddings'], dtype=np.float32))
+    return partitions, int(data.get('version', 0)), None
+
+
+@contextmanager
+def _writing_index():
+    """Exclusive, cross-worker write section for the index files.
+
+    Catches up with changes persisted by other workers first, then yields the version
+    the change must be written with. The shared version is only bumped if the block
+    completes, i.e. after the files were written.
+    """
+    global _partitions, _loaded_version, _artifact
+    with _index_lock, advisory_lock(_PG_FAQ_INDEX_LOCK_KEY) as lock_conn:
+        current = fetch_version(FAQ_INDEX_SCOPE, conn=lock_conn)
+        if current > _loaded_version and _index_exists():
+            _partitions, _loaded_version, _artifact = _read_partitions()
+        version = max(current, _loaded_version) + 1
+        yield version
+        _loaded_version = version
+        bump_version(FAQ_INDEX_SCOPE, at_least=version - 1, conn=lock_conn)
+
+
+def _replay_since(partitions, since):
+    """Apply to `partitions` the logged changes published after version `since`.
+
+    Replaying is idempotent: upserts replace the whole row and removals of absent
+    FAQs are no-ops, so entries already reflected in `partitions` do no harm.
+    """
+    for entry in _read_delta(_artifact.delta_path):
+        if int(entry.get("version", 0)) > since:
+            partitions = _apply_entry(partitions, entry)
+    return partitions
+
+
+def build_faiss_index(chatbot_id=None, progress=None):
+    """(Re)build the FAQ partitions.
+
+    Without `chatbot_id` every partition is rebuilt; otherwise only the partitions of
+    that chatbot are re-encoded and the others are kept as they are. The new partitions
+    are encoded before the write lock is taken and swapped in at the end, so searches
+    keep using the previous ones meanwhile. Changes other workers published while the
+    FAQs were being encoded are replayed from the delta log before saving (or, if a
+    snapshot has folded them in since, the FAQs are streamed again under the lock).
+    `progress(fraction, message)` is called as the encoding advances.
+    """
+    global _partitions, _artifact
+    started = time.monotonic()
+    chatbot_id = int(chatbot_id) if chatbot_id else None
+    try:
+        since = fetch_version(FAQ_INDEX_SCOPE)
+        partitions = _stream_partitions(get_conn(), chatbot_id, progress)
+        if progress:
+            progress(0.95, "A gravar índice")
+        with _writing_index() as version:
+            if version - 1 > since and (_artifact is None or _artifact.version > since):
+                logging.info("Índice FAQ alterado durante a construção; a reler as FAQs.")
+                partitions = _stream_partitions(get_conn(), chatbot_id)
+                since = version - 1
+            if chatbot_id:
+                kept = {key: part for key, part in _partitions.items() if key[0] != chatbot_id}
+                kept.update(partitions)
+                partitions = kept
+            if version - 1 > since:
+                partitions = _replay_since(partitions, since)
+            _partitions, _artifact = _save_partitions(partitions, version, build_started=started)
+        logging.info(
+            f"Índice FAISS para FAQs salvo em {_artifact.path} "
+            f"({len(partitions)} partições, versão {version})"
+        )
     except Exception as e:
         logging.error(f"Erro ao construir índice FAISS para FAQs: {e}")
         raise
+
+
+def _chatbots_of(faq_ids):
+    """Chatbots whose indexed FAQs include any of `faq_ids`."""
+    return {
+        key[0] for key, part in _partitions.items()
+        if any(faq_id in part.rows for faq_id in faq_ids)
+    }
+
+
+def invalidate_faqs(faq_ids, chatbot_ids=()):
+    """Invalidate the fuzzy corpus of the chatbots owning `faq_ids`, before or after
+    the write (indexed chatbot, current one in the database and `chatbot_ids`)."""
+    faq_ids = [int(faq_id) for faq_id in faq_ids]
+    if not faq_ids:
+        return
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT DISTINCT chatbot_id FROM faq WHERE faq_id = ANY(%s)", (faq_ids,))
+        owners = [row[0] for row in cur.fetchall()]
+    finally:
+        cur.close()
+    invalidate_faq_cache(*_chatbots_of(faq_ids), *owners, *chatbot_ids)
+
+
+def upsert_faqs_in_index(faq_ids, progress=None):
+    """Add or replace the given FAQs in the index (one embedding per FAQ).
+
+    Ids that no longer exist in the database are removed from the index.
+    """
+    global _partitions, _artifact
+    faq_ids = [int(faq_id) for faq_id in faq_ids]
+    if not faq_ids:
+        return
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"{_ROW_SQL} WHERE faq_id = ANY(%s)", (faq_ids,))
+        rows = [tuple(row) for row in cur.fetchall()]
     finally:
         cur.close()
+    embeddings = _encode_faqs(rows, progress) if rows else None
+    missing = set(faq_ids) - {int(row[0]) for row in rows}
+    entries = [
+        {"op": "upsert", "row": list(row), "embedding": base64.b64encode(emb.tobytes()).decode("ascii")}
+        for row, emb in zip(rows, embeddings if rows else [])
+    ]
+    if missing:
+        entries.append({"op": "remove", "faq_ids": sorted(missing)})
+    # Already done when the change was scheduled; again here for a corpus reloaded in between.
+    invalidate_faq_cache(*_chatbots_of(faq_ids), *(row[3] for row in rows))
+    with _writing_index() as version:
+        partitions = _apply_changes(_partitions, remove_ids=missing, rows=rows, embeddings=embeddings)
+        _partitions, _artifact = _append_delta(entries, version, partitions)
+
+
+def remove_faqs_from_index(faq_ids):
+    global _partitions, _artifact
+    faq_ids = [int(faq_id) for faq_id in faq_ids]
+    if not faq_ids:
+        return
+    invalidate_faq_cache(*_chatbots_of(faq_ids))
+    with _writing_index() as version:
+        partitions = _apply_changes(_partitions, remove_ids=faq_ids)
+        _partitions, _artifact = _append_delta([{"op": "remove", "faq_ids": faq_ids}], version, partitions)
+
+
+def remove_chatbot_from_index(chatbot_id):
+    global _partitions, _artifact
+    invalidate_faq_cache(chatbot_id)
+    with _writing_index() as version:
+        partitions = {k: p for k, p in _partitions.items() if k[0] != int(chatbot_id)}
+        _partitions, _artifact = _append_delta(
+            [{"op": "remove_chatbot", "chatbot_id": int(chatbot_id)}], version, partitions
+        )
+
+
+def _reload_in_background(target_version):
+    """Load the persisted index off to the side and swap it in when complete."""
+    global _partitions, _loaded_version, _artifact, _reload_thread
+    try:
+        with advisory_lock(_PG_FAQ_INDEX_LOCK_KEY, shared=True):
+            partitions, version, artifact = _read_partitions()
+        with _index_lock:
+            if version > _loaded_version:
+                _partitions, _artifact = partitions, artifact
+            # Also covers an artifact older than the shared version (writer died between
+            # the two), so we don't reload in a loop.
+            _loaded_version = max(_loaded_version, version, target_version)
+        logging.info(f"Índice FAISS para FAQs recarregado (versão {version})")
+    except Exception as e:
+        logging.error(f"Erro ao recarregar índice FAISS para FAQs: {e}")
+    finally:
+        _reload_thread = None
+
+
+def _maybe_reload():
+    """Cheap per-request staleness check against the shared index version."""
+    global _reload_thread
+    target = get_version(FAQ_INDEX_SCOPE)
+    if target <= _loaded_version or _reload_thread is not None:
+        return
+    with _index_lock:
+        if _reload_thread is not None:
+            return
+        _reload_thread = Thread(target=_reload_in_background, args=(target,), daemon=True)
+        _reload_thread.start()
+
+
+def loaded_index_version():
+    """Version of the FAQ index this worker is serving."""
+    return _loaded_version
+
 
 def load_faiss_index():
+    """Map the active prebuilt snapshot (see manage_indexes.py); never builds.
+
+    Returns True when an index was loaded. Otherwise searches return nothing until
+    a build (scheduled by the caller, or run offline) is published.
+    """
+    global _partitions, _loaded_version, _artifact
+    if not _index_usable():
+        logging.warning("Índice FAISS para FAQs não encontrado ou incompatível.")
+        return False
     try:
-        if not os.path.exists(Config.INDEX_PATH) or not os.path.exists(Config.FAQ_EMBEDDINGS_PATH):
-            logging.info("Índice FAISS ou embeddings de FAQs não encontrados. Reconstruindo...")
-            build_faiss_index()
-        index = faiss.read_index(Config.INDEX_PATH)
-        with open(Config.FAQ_EMBEDDINGS_PATH, 'rb') as f:
-            data = pickle.load(f)
-        return index, data['faqs'], data['embeddings']
+        with advisory_lock(_PG_FAQ_INDEX_LOCK_KEY, shared=True):
+            _partitions, _loaded_version, _artifact = _read_partitions()
     except Exception as e:
         logging.error(f"Erro ao carregar índice FAISS para FAQs: {e}")
-        logging.info("Reconstruindo índice FAISS para FAQs...")
-        build_faiss_index()
-        index = faiss.read_index(Config.INDEX_PATH)
-        with open(Config.FAQ_EMBEDDINGS_PATH, 'rb') as f:
-            data = pickle.load(f)
-        return index, data['faqs'], data['embeddings']
+        return False
+    logging.info(f"Índice FAISS para FAQs carregado (versão {_loaded_version}, {len(_partitions)} partições)")
+    return True
 
-faiss_index, faqs_db, faq_embeddings = load_faiss_index()
 
-def pesquisar_faiss(pergunta, chatbot_id=None, idioma=None, k=1, min_sim=0.7, relax_min_sim=None):
-    pergunta = preprocess_text(pergunta)
-    results = []
-    if len(faqs_db) == 0:
-        return []
+def build_missing_index(progress=None):
+    """Build the index if no usable one exists and no other worker is building it.
+
+    Returns True if this call built it.
+    """
+    with try_advisory_lock(_PG_FAQ_INDEX_BUILD_LOCK_KEY) as acquired:
+        if not acquired or _index_usable():
+            return False
+        build_faiss_index(progress=progress)
+        return True
+
+
+def dense_candidates(pergunta, chatbot_id=None, idioma=None, k=1):
+    """Top `k` (cosine, row) pairs of the vector index, best first; rows are
+    (faq_id, pergunta, resposta, chatbot_id, idioma)."""
+    return dense_candidates_batch([pergunta], chatbot_id, idioma, k)[0]
 
-    idioma_norm = (idioma or "").strip().lower()[:2] if idioma else None
+
+def dense_candidates_batch(perguntas, chatbot_id=None, idioma=None, k=1):
+    """`dense_candidates` for several questions: one encode call and one matrix search
+    per partition."""
+    perguntas = list(perguntas)
+    _maybe_reload()
+    partitions = _partitions
+    if not partitions or not perguntas:
+        return [[] for _ in perguntas]
+
+    idioma_norm = _idioma_key(idioma) if idioma else None
     if idioma_norm and idioma_norm not in {"pt", "en"}:
         idioma_norm = None
 
-    query_emb = embedding_model.encode([pergunta])
-    query_emb = query_emb / np.linalg.norm(query_emb, axis=1, keepdims=True)
+    # Only the partitions that can satisfy the filters are searched, so the cost of a
+    # query scales with the chatbot's FAQ count instead of the whole corpus.
+    selected = [
+        part
+        for (part_chatbot_id, part_idioma), part in partitions.items()
+        if (not chatbot_id or part_chatbot_id == int(chatbot_id))
+        and (not idioma_norm or part_idioma == idioma_norm)
+    ]
+    if not selected:
+        return [[] for _ in perguntas]
+
+    # FAQ texts are embedded after preprocess_text, so the queries are too; this also
+    # makes it the key of the query-embedding cache.
+    query_embs = encode_queries([preprocess_text(p) for p in perguntas], Config.FAQ_EMBEDDING_MODEL)
 
-    max_results = len(faqs_db)
     target_k = max(k, 1)
-    n = min(max(target_k * 5, 10), max_results)
-    seen = set()
+    candidates = [[] for _ in perguntas]
+    for part in selected:
+        for found, results in zip(candidates, part.search_batch(query_embs, target_k)):
+            found.extend(results)
+    for found in candidates:
+        found.sort(key=lambda c: c[0], reverse=True)
+        del found[target_k:]
+    return candidates
 
-    while True:
-        D, I = faiss_index.search(np.array(query_emb, dtype=np.float32), n)
-        for score, idx_faq in zip(D[0], I[0]):
-            if idx_faq == -1 or idx_faq in seen:
-                continue
-            seen.add(idx_faq)
-            if score < min_sim:
-                continue
-            row = faqs_db[idx_faq]
-            if row is None:
-                continue
-            # Backwards compatibility: old cache may not have idioma
-            if len(row) >= 5:
-                faq_id, pergunta_faq, resposta_faq, chatbot_id_faq, faq_idioma = row[:5]
-            else:
-                faq_id, pergunta_faq, resposta_faq, chatbot_id_faq = row[:4]
-                faq_idioma = None
-            if chatbot_id and int(chatbot_id_faq) != int(chatbot_id):
-                continue
-            if idioma_norm and (faq_idioma or "").strip().lower()[:2] != idioma_norm:
-                continue
+
+def pesquisar_faiss(pergunta, chatbot_id=None, idioma=None, k=1, min_sim=0.7, relax_min_sim=None):
+    target_k = max(k, 1)
+    candidates = dense_candidates(pergunta, chatbot_id, idioma, target_k)
+
+    def _collect(threshold):
+        results = []
+        for score, row in candidates:
+            if score < threshold:
+                break
+            faq_id, pergunta_faq, resposta_faq = row[:3]
             results.append({
                 'faq_id': faq_id,
                 'pergunta': pergunta_faq,
                 'resposta': resposta_faq,
-                'score': float(score)
+                'score': score
             })
             if len(results) >= target_k:
                 break
-        if len(results) >= target_k or n >= max_results:
-            break
-        n = min(n * 2, max_results)
+        return results
 
+    results = _collect(min_sim)
     if not results and relax_min_sim is not None and relax_min_sim < min_sim:
         # Relax threshold with the same FAISS candidates before returning empty.
-        D, I = faiss_index.search(np.array(query_emb, dtype=np.float32), n)
-        for score, idx_faq in zip(D[0], I[0]):
-            if idx_faq == -1 or score < relax_min_sim:
-                continue
-            row = faqs_db[idx_faq]
-            if row is None:
-                continue
-            if len(row) >= 5:
-                faq_id, pergunta_faq, resposta_faq, chatbot_id_faq, faq_idioma = row[:5]
-            else:
-                faq_id, pergunta_faq, resposta_faq, chatbot_id_faq = row[:4]
-                faq_idioma = None
-            if chatbot_id and int(chatbot_id_faq) != int(chatbot_id):
-                continue
-            if idioma_norm and (faq_idioma or "").strip().lower()[:2] != idioma_norm:
-                continue
-            results.append({
-                'faq_id': faq_id,
-                'pergunta': pergunta_faq,
-                'resposta': resposta_faq,
-                'score': float(score)
-            })
-            if len(results) >= target_k:
-                break
-
+        results = _collect(relax_min_sim)
     return results
     
 def get_faqs_from_db(chatbot_id=None, idioma=None):
@@ -174,37 +814,19 @@ def get_faqs_from_db(chatbot_id=None, idioma=None):
     finally:
         cur.close()
 
+def obter_faq_exata(pergunta, chatbot_id, idioma=None):
+    """FAQ whose question is exactly `pergunta` (e.g. a clicked suggestion), or None.
+
+    Same fields as `obter_faq_mais_semelhante`; the score is left to the caller, which
+    sets a perfect one on its own scale.
+    """
+    return get_corpus(chatbot_id, idioma).exact_match(pergunta)
+
+
 def obter_faq_mais_semelhante(pergunta, chatbot_id, idioma=None, threshold=70):
-    from rapidfuzz import fuzz
-    from .text import preprocess_text_for_matching
-    conn = get_conn()
-    cur = conn.cursor()
-    try:
-        idioma_norm = (idioma or "").strip().lower()[:2] if idioma else None
-        if idioma_norm and idioma_norm in {"pt", "en"}:
-            cur.execute(
-                "SELECT faq_id, pergunta, resposta FROM faq WHERE chatbot_id = %s AND idioma = %s",
-                (chatbot_id, idioma_norm),
-            )
-        else:
-            cur.execute("SELECT faq_id, pergunta, resposta FROM faq WHERE chatbot_id = %s", (chatbot_id,))
-        faqs = cur.fetchall()
-        if not faqs:
-            return None
-        pergunta_processed = preprocess_text_for_matching(pergunta)
-        melhor_score = 0
-        melhor_faq = None
-        for faq_id, pergunta_faq, resposta in faqs:
-            pergunta_faq_processed = preprocess_text_for_matching(pergunta_faq)
-            score = max(
-                fuzz.ratio(pergunta_processed, pergunta_faq_processed),
-                fuzz.token_set_ratio(pergunta_processed, pergunta_faq_processed),
-            )
-            if score > melhor_score:
-                melhor_score = score
-                melhor_faq = {"faq_id": faq_id, "pergunta": pergunta_faq, "resposta": resposta, "score": score}
-        if melhor_faq and melhor_faq["score"] >= threshold:
-            return melhor_faq
-        return None
-    finally:
-        cur.close()
+    """Best fuzzy match among the chatbot's FAQs (see services/faq_corpus.py).
+
+    Returns faq_id, pergunta, resposta, score plus the cached idioma, categoria_id,
+    video_status and documentos of the FAQ, or None below `threshold`.
+    """
+    return get_corpus(chatbot_id, idioma).best_match(pergunta, threshold)
@@ -0,0 +1,231 @@
+"""Single-flight: concurrent identical questions share one computation.
+
+`single_flight(key, fn)` deduplicates within a worker: the first caller for `key`
+runs `fn`, callers arriving while it runs wait and get the same result (or exception).
+
+`shared_flight(key, fn)` also deduplicates across workers, for the RAG path where a
+computation is a full LLM generation. The in-process leader claims the key's row in
+`rag_flight` (result NULL while it computes). The leader of another worker finds the
+claim taken and polls the row every _POLL_SECONDS until the result is stored, instead
+of calling the LLM again; it gives up after RAG_SINGLE_FLIGHT_WAIT_SECONDS and computes
+it itself. No connection is held between polls, so waiters don't drain the DB pool.
+If the first one fails it drops its claim and the next one computes it. Results must
+be JSON-serializable; finished rows are kept for RAG_SINGLE_FLIGHT_RESULT_SECONDS
+(enough for the waiters to pick them up; caching answers is not the point here).
+"""
+
+import hashlib
+import json
+import logging
+import time
+from threading import Event, Lock
+
+from psycopg2.extras import Json
+
+from ..config import Config
+from ..db import get_pool_conn, put_pool_conn
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """In-process request coalescing keyed by any hashable key."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+_local = SingleFlight()
+
+_shared_lock = Lock()
+_shared_stats = {"computed": 0, "reused": 0, "timeouts": 0}
+_cleaned_at = 0.0
+_CLEAN_EVERY_SECONDS = 60
+_POLL_SECONDS = 0.25
+
+
+def single_flight(key, fn):
+    """Run `fn()` once for all concurrent callers of this worker with the same `key`."""
+    return _local.do(key, fn)
+
+
+def _digest(key):
+    return hashlib.sha256(json.dumps(key, ensure_ascii=False, default=str).encode("utf-8")).digest()
+
+
+def _run(sql, params, fetch=False):
+    conn = get_pool_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute(sql, params)
+        row = cur.fetchone() if fetch else None
+        conn.commit()
+        return row
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        put_pool_conn(conn)
+
+
+def _claim(digest, reclaim_finished):
+    """Take the key's row for computing it. A claim older than the wait is abandoned
+    (its worker died) and can be taken over; a finished row only if `reclaim_finished`."""
+    row = _run(
+        """
+        INSERT INTO rag_flight (flight_key) VALUES (%s)
+        ON CONFLICT (flight_key) DO UPDATE SET result = NULL, started_at = NOW(), finished_at = NULL
+        WHERE (%s AND rag_flight.finished_at IS NOT NULL)
+           OR (rag_flight.finished_at IS NULL AND rag_flight.started_at < NOW() - %s * INTERVAL '1 second')
+        RETURNING 1
+        """,
+        (digest, reclaim_finished, Config.RAG_SINGLE_FLIGHT_WAIT_SECONDS),
+        fetch=True,
+    )
+    return row is not None
+
+
+def _flight_state(digest):
+    """(result, finished) of the key's row, or None when there is no row."""
+    return _run(
+        "SELECT result, finished_at IS NOT NULL FROM rag_flight WHERE flight_key = %s",
+        (digest,),
+        fetch=True,
+    )
+
+
+def _release(digest):
+    _run("DELETE FROM rag_flight WHERE flight_key = %s AND finished_at IS NULL", (digest,))
+
+
+def _store_result(digest, result):
+    global _cleaned_at
+    _run(
+        """
+        INSERT INTO rag_flight (flight_key, result, finished_at) VALUES (%s, %s, NOW())
+        ON CONFLICT (flight_key) DO UPDATE SET result = EXCLUDED.result, finished_at = NOW()
+        """,
+        (digest, Json(result)),
+    )
+    now = time.monotonic()
+    if now - _cleaned_at > _CLEAN_EVERY_SECONDS:
+        _cleaned_at = now
+        _run(
+            """
+            DELETE FROM rag_flight
+            WHERE finished_at < NOW() - %s * INTERVAL '1 second'
+               OR (finished_at IS NULL AND started_at < NOW() - %s * INTERVAL '1 second')
+            """,
+            (Config.RAG_SINGLE_FLIGHT_RESULT_SECONDS, Config.RAG_SINGLE_FLIGHT_WAIT_SECONDS),
+        )
+
+
+def _count(name):
+    with _shared_lock:
+        _shared_stats[name] += 1
+
+
+def _wait_or_claim(digest):
+    """Return ("compute", None) once this worker holds the claim, ("reuse", result) when
+    the worker holding it stored its result, or ("timeout", None)."""
+    deadline = time.monotonic() + Config.RAG_SINGLE_FLIGHT_WAIT_SECONDS
+    # A row already finished belongs to an earlier flight, not one we could queue behind.
+    if _claim(digest, reclaim_finished=True):
+        return "compute", None
+    while time.monotonic() < deadline:
+        time.sleep(_POLL_SECONDS)
+        state = _flight_state(digest)
+        if state is not None and state[1]:
+            return "reuse", state[0]
+        # No row: the claimant failed and dropped it.
+        if _claim(digest, reclaim_finished=False):
+            return "compute", None
+    return "timeout", None
+
+
+def _flight_across_workers(key, fn):
+    digest = _digest(key)
+    try:
+        outcome, stored = _wait_or_claim(digest)
+    except Exception as exc:
+        logging.debug("rag_flight indisponível: %s", exc)
+        return fn()
+    if outcome == "reuse":
+        _count("reused")
+        return stored
+    if outcome == "timeout":
+        _count("timeouts")
+        logging.warning("RAG single-flight: tempo de espera esgotado, a calcular sem partilhar")
+        return fn()
+    try:
+        result = fn()
+    except BaseException:
+        try:
+            _release(digest)
+        except Exception as exc:
+            logging.debug("rag_flight indisponível: %s", exc)
+        raise
+    _count("computed")
+    try:
+        _store_result(digest, result)
+    except Exception as exc:
+        logging.debug("rag_flight indisponível: %s", exc)
+    return result
+
+
+def shared_flight(key, fn):
+    """Like `single_flight`, deduplicating across workers too (see the module docstring).
+
+    `fn()` must return a JSON-serializable value; waiters in other workers get it
+    decoded from JSON (tuples come back as lists).
+    """
+    if not Config.RAG_SINGLE_FLIGHT:
+        return fn()
+    return _local.do(("shared", key), lambda: _flight_across_workers(key, fn))
+
+
+def single_flight_stats():
+    with _shared_lock:
+        shared = dict(_shared_stats)
+    return {**_local.stats(), "across_workers": shared}
@@ -12,6 +12,7 @@ import shutil
 from dotenv import load_dotenv
 
 from ..db import get_pool_conn, put_pool_conn
+from .faq_corpus import invalidate_faq_cache
 from ..video.src.piper_tts import speak as piper_speak
 from flask import current_app
 
@@ -485,8 +486,10 @@ def queue_video_for_faq(faq_id: int) -> bool:
     try:
         conn = get_pool_conn()
         cur = conn.cursor()
-        cur.execute("UPDATE faq SET video_status=%s WHERE faq_id=%s", ("queued", faq_id))
+        cur.execute("UPDATE faq SET video_status=%s WHERE faq_id=%s RETURNING chatbot_id", ("queued", faq_id))
+        updated = cur.fetchone()
         conn.commit()
+        _invalidate_faq_status(updated)
     except Exception:
         # Best-effort only; the worker will update status again.
         try:
@@ -736,6 +739,12 @@ def _generate_video(
         _current_process = None
 
 
+def _invalidate_faq_status(updated) -> None:
+    """video_status is served from the cached FAQ corpus; mark it stale after a change."""
+    if updated:
+        invalidate_faq_cache(updated[0])
+
+
 def _run_video_job(faq_id: int, app) -> None:
     with app.app_context():
         conn = get_pool_conn()
@@ -777,10 +786,12 @@ def _run_video_job(faq_id: int, app) -> None:
                 video_text = f"{video_text} {suffix}".strip()
 
             cur.execute(
-                "UPDATE faq SET video_status=%s, video_text=%s WHERE faq_id=%s",
+                "UPDATE faq SET video_status=%s, video_text=%s WHERE faq_id=%s RETURNING chatbot_id",
                 ("processing", video_text, faq_id),
             )
+            updated = cur.fetchone()
             conn.commit()
+            _invalidate_faq_status(updated)
 
             _set_job(progress=25, message="A gerar áudio com Piper...")
 
@@ -816,18 +827,25 @@ def _run_video_job(faq_id: int, app) -> None:
 
             _set_job(progress=90, message="A finalizar vídeo...")
             cur.execute(
-                "UPDATE faq SET video_status=%s, video_path=%s WHERE faq_id=%s",
+                "UPDATE faq SET video_status=%s, video_path=%s WHERE faq_id=%s RETURNING chatbot_id",
                 ("ready", video_path, faq_id),
             )
+            updated = cur.fetchone()
             conn.commit()
+            _invalidate_faq_status(updated)
 
             _set_job(status="done", progress=100, message="Vídeo gerado com sucesso.", error=None)
         except VideoJobCancelled:
             conn.rollback()
             _reset_job_state()
             try:
-                cur.execute("UPDATE faq SET video_status=%s, video_path=NULL WHERE faq_id=%s", ("cancelled", faq_id))
+                cur.execute(
+                    "UPDATE faq SET video_status=%s, video_path=NULL WHERE faq_id=%s RETURNING chatbot_id",
+                    ("cancelled", faq_id),
+                )
+                updated = cur.fetchone()
                 conn.commit()
+                _invalidate_faq_status(updated)
             except Exception:
                 conn.rollback()
             # remove final folder entirely
@@ -842,10 +860,12 @@ def _run_video_job(faq_id: int, app) -> None:
             _set_job(status="error", progress=100, message="Falha ao gerar vídeo.", error=str(e))
             try:
                 cur.execute(
-                    "UPDATE faq SET video_status=%s WHERE faq_id=%s",
+                    "UPDATE faq SET video_status=%s WHERE faq_id=%s RETURNING chatbot_id",
                     ("failed", faq_id),
                 )
+                updated = cur.fetchone()
                 conn.commit()
+                _invalidate_faq_status(updated)
             except Exception:
                 conn.rollback()
         finally:
@@ -1768,26 +1768,50 @@ function responderPergunta(pergunta) {
               confirmarRag.style.pointerEvents = "none";
               confirmarRag.style.opacity = "0.6";
               confirmarRag.textContent = "A procurar nos documentos PDF...";
-              fetch("/obter-resposta", {
+              // The answer is streamed: the bubble fills in as the model writes it.
+              let ragMsgDiv = null;
+              let ragTexto = "";
+              fetch("/obter-resposta/stream", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
                 body: JSON.stringify({
                   pergunta,
                   chatbot_id: chatbotId,
-                  fonte: "faq+raga",
-                  feedback: "try_rag",
-                  idioma,
                 }),
               })
-                .then((res) => res.json())
+                .then((res) =>
+                  lerEventosSSE(res, (evento, dados) => {
+                    if (evento !== "token") return;
+                    ragTexto += dados.texto || "";
+                    if (!ragMsgDiv) {
+                      ragMsgDiv = adicionarMensagemComHTML(
+                        "bot",
+                        "",
+                        iconBot,
+                        localStorage.getItem("nomeBot"),
+                      );
+                    }
+                    ragMsgDiv.textContent = ragTexto;
+                    const chatBody = document.getElementById("chatBody");
+                    chatBody.scrollTop = chatBody.scrollHeight;
+                  }),
+                )
                 .then((ragData) => {
                   if (ragData.success) {
-                    adicionarMensagemComHTML(
-                      "bot",
-                      ragData.resposta || "",
-                      iconBot,
-                      localStorage.getItem("nomeBot"),
-                    );
+                    if (ragMsgDiv) {
+                      ragMsgDiv.innerHTML = ragData.resposta || "";
+                    } else {
+                      adicionarMensagemComHTML(
+                        "bot",
+                        ragData.resposta || "",
+                        iconBot,
+                        localStorage.getItem("nomeBot"),
+                      );
+                    }
+                  } else if (ragMsgDiv) {
+                    ragMsgDiv.textContent =
+                      ragData.erro ||
+                      "❌ Nenhuma resposta encontrada nos documentos PDF.";
                   } else {
                     adicionarMensagem(
                       "bot",
@@ -1905,6 +1929,35 @@ async function playChatbotAuxVideo(kind) {
   });
 }
 
+// Reads a text/event-stream response, calling onEvento(evento, dados) for each
+// event; resolves with the data of the final "resposta" or "erro" event.
+async function lerEventosSSE(res, onEvento) {
+  if (!res.ok || !res.body) return res.json();
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let final = { success: false };
+  for (;;) {
+    const { value, done } = await reader.read();
+    buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+    let fim;
+    while ((fim = buffer.indexOf("\n\n")) !== -1) {
+      const bloco = buffer.slice(0, fim);
+      buffer = buffer.slice(fim + 2);
+      let evento = "message";
+      let dados = "";
+      bloco.split("\n").forEach((linha) => {
+        if (linha.startsWith("event:")) evento = linha.slice(6).trim();
+        if (linha.startsWith("data:")) dados += linha.slice(5).trim();
+      });
+      const payload = dados ? JSON.parse(dados) : {};
+      if (evento === "resposta" || evento === "erro") final = payload;
+      else onEvento(evento, payload);
+    }
+    if (done) return final;
+  }
+}
+
 function adicionarMensagemComHTML(
   tipo,
   html,
@@ -2013,6 +2066,7 @@ function adicionarMensagemComHTML(
       }
     });
   }, 10);
+  return msgDiv;
 }
 
 function obterPerguntasSemelhantes(perguntaOriginal, chatbotId, idioma = null) {
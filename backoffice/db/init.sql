@@ -29,7 +29,13 @@ CREATE TABLE IF NOT EXISTS chatbot (
     video_negative_path TEXT,
     video_no_answer_path TEXT,
     ativo BOOLEAN NOT NULL DEFAULT FALSE,
-    publicado BOOLEAN NOT NULL DEFAULT FALSE
+    publicado BOOLEAN NOT NULL DEFAULT FALSE,
+    -- Pesquisa híbrida de FAQs (NULL = valor por omissão da configuração)
+    faq_fusion VARCHAR(16),
+    faq_dense_min REAL,
+    faq_lexical_min REAL,
+    faq_dense_weight REAL,
+    faq_hybrid_min REAL
 );
 
 -- Tabela: video_job (singleton global status for cross-worker video generation)
@@ -48,6 +54,59 @@ CREATE TABLE IF NOT EXISTS video_job (
 );
 INSERT INTO video_job (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
 
+-- Tabela: cache_version (contadores de versão partilhados entre workers: índices/caches)
+CREATE TABLE IF NOT EXISTS cache_version (
+    scope TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Tabela: index_build_job (atualizações do índice FAISS das FAQs em segundo plano)
+CREATE TABLE IF NOT EXISTS index_build_job (
+    job_id SERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    chatbot_ids INT[],
+    faq_count INT NOT NULL DEFAULT 0,
+    progress INT NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    error TEXT,
+    version BIGINT,
+    worker TEXT,
+    requested_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Tabela: embedding_cache (embeddings já calculados, por modelo e hash do texto)
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model TEXT NOT NULL,
+    text_hash BYTEA NOT NULL,
+    dim INT NOT NULL,
+    embedding BYTEA NOT NULL,
+    used_on DATE NOT NULL DEFAULT CURRENT_DATE,
+    PRIMARY KEY (model, text_hash)
+);
+
+-- Tabela: response_cache (respostas de /obter-resposta partilhadas entre workers; descartável)
+CREATE UNLOGGED TABLE IF NOT EXISTS response_cache (
+    cache_key BYTEA PRIMARY KEY,
+    chatbot_id INT NOT NULL,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS response_cache_created_idx ON response_cache (created_at);
+
+-- Tabela: rag_flight (resultado RAG partilhado por pedidos iguais em simultâneo; descartável)
+CREATE UNLOGGED TABLE IF NOT EXISTS rag_flight (
+    flight_key BYTEA PRIMARY KEY,
+    -- NULL enquanto a resposta está a ser calculada (pedido em curso)
+    result JSONB,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMPTZ
+);
+
 -- Tabela: chatbot_categoria
 CREATE TABLE IF NOT EXISTS chatbot_categoria (
     chatbot_id INT REFERENCES chatbot(chatbot_id) ON DELETE CASCADE,
@@ -131,7 +190,11 @@ CREATE TABLE IF NOT EXISTS pdf_documents (
     chatbot_id INT REFERENCES chatbot(chatbot_id) ON DELETE CASCADE,
     filename VARCHAR(255) NOT NULL,
     file_path TEXT NOT NULL,
-    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    content_sha256 VARCHAR(64),
+    chunker_version VARCHAR(64),
+    embedding_model VARCHAR(255),
+    indexed_at TIMESTAMP
 );
 
 -- Tabela: rag_chunks (pgvector)
@@ -147,5 +210,36 @@ CREATE TABLE IF NOT EXISTS rag_chunks (
 );
 CREATE INDEX IF NOT EXISTS rag_chunks_chatbot_idx ON rag_chunks (chatbot_id);
 CREATE INDEX IF NOT EXISTS rag_chunks_pdf_idx ON rag_chunks (pdf_id);
-CREATE INDEX IF NOT EXISTS rag_chunks_embedding_idx
-    ON rag_chunks USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
+-- O índice ANN rag_chunks_embedding_idx (hnsw/ivfflat) é criado e dimensionado pela aplicação
+-- (backoffice/app/services/rag_ann_index.py) depois da ingestão dos PDFs.
+
+-- Tabela: rag_ann_index (como foi construído o índice ANN dos chunks e parâmetros de pesquisa afinados)
+CREATE TABLE IF NOT EXISTS rag_ann_index (
+    id INT PRIMARY KEY DEFAULT 1,
+    index_type VARCHAR(16) NOT NULL,
+    lists INT,
+    rows_at_build BIGINT,
+    built_at TIMESTAMPTZ,
+    build_seconds REAL,
+    probes INT,
+    ef_search INT,
+    tuned_at TIMESTAMPTZ,
+    report JSONB
+);
+
+-- Tabela: rag_answer_cache (respostas RAG já geradas, procuradas por semelhança da pergunta)
+CREATE TABLE IF NOT EXISTS rag_answer_cache (
+    cache_id SERIAL PRIMARY KEY,
+    chatbot_id INT NOT NULL REFERENCES chatbot(chatbot_id) ON DELETE CASCADE,
+    doc_version BIGINT NOT NULL,
+    llm_model TEXT NOT NULL,
+    embedding vector(384) NOT NULL,
+    pergunta TEXT NOT NULL,
+    chunk_ids INT[] NOT NULL DEFAULT '{}',
+    resposta TEXT NOT NULL,
+    fontes JSONB NOT NULL DEFAULT '[]',
+    hits INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_hit_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS rag_answer_cache_chatbot_idx ON rag_answer_cache (chatbot_id, doc_version);
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Build the FAQ and RAG indexes ahead of time (project root, next to wsgi.py).
+
+  python manage_indexes.py build                 # FAQ + RAG
+  python manage_indexes.py build --faq [--chatbot ID]
+  python manage_indexes.py build --rag [--chatbot ID] [--force]
+  python manage_indexes.py status                # manifests of the active versions
+  python manage_indexes.py verify                # recompute the FAQ snapshot checksum
+  python manage_indexes.py bench-rag-insert [--rows N]   # rag_chunks writers, rows/s
+  python manage_indexes.py rag-index [--type T] [--force] # size the pgvector index of rag_chunks
+  python manage_indexes.py rag-tune [--queries N] [--target-ms MS]  # recall vs latency, tune knob
+
+FAQ builds write a new snapshot v<version>/ (with manifest.json) under FAQ_INDEX_DIR
+and make it the active one; running workers load it on their next search, no restart
+needed. The app itself only maps the active snapshot at startup.
+
+RAG chunks live in pgvector (rag_chunks), so `--rag` re-ingests the PDFs into the
+database and records the manifest of the result under RAG_INDEX_DIR/v<version>/.
+PDFs whose file, chunker and embedding model haven't changed since they were last
+indexed are skipped; `--force` re-ingests them too. After ingesting, the pgvector
+index of rag_chunks is rebuilt if the table size calls for it (see rag_ann_index.py).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from flask import Flask
+
+from backoffice.app.config import Config
+from backoffice.app.db import close_conn, ensure_schema, get_conn, init_pool
+from backoffice.app.services.cache_versions import bump_version
+from backoffice.app.services.faq_index_store import (
+    activate_artifact,
+    current_artifact_path,
+    read_manifest,
+    verify_artifact,
+    write_manifest,
+)
+from backoffice.app.services.rag import index_pdf_documents, rag_chunks_summary
+from backoffice.app.services.rag_ann_index import INDEX_TYPES as RAG_ANN_TYPES
+from backoffice.app.services.rag_ann_index import ensure_ann_index, tune_search
+from backoffice.app.services.rag_chunk_writer import benchmark_writers
+from backoffice.app.services.retreival import build_faiss_index
+
+RAG_INDEX_SCOPE = "rag_index"
+
+
+def _app():
+    # Just the config and DB pool: no blueprints, warm-up or index loading.
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    init_pool(app)
+    ensure_schema()
+    app.teardown_appcontext(lambda error: close_conn())
+    return app
+
+
+def _print_progress(fraction, message=""):
+    print(f"\r  {fraction * 100:5.1f}%  {message:<40}", end="", flush=True)
+
+
+def build_faq(chatbot_id=None):
+    print(f"FAQ: a construir índice{f' do chatbot {chatbot_id}' if chatbot_id else ''}...")
+    build_faiss_index(chatbot_id, progress=_print_progress)
+    print()
+    path = current_artifact_path(Config.FAQ_INDEX_DIR)
+    print(json.dumps(read_manifest(path), indent=2, ensure_ascii=False))
+
+
+def build_rag(chatbot_id=None, force=False):
+    print(f"RAG: a indexar PDFs{f' do chatbot {chatbot_id}' if chatbot_id else ''}...")
+    started = time.monotonic()
+    report = index_pdf_documents(chatbot_id=chatbot_id, force=force)
+    rows, checksum = rag_chunks_summary()
+    version = bump_version(RAG_INDEX_SCOPE) or int(time.time())
+    os.makedirs(Config.RAG_INDEX_DIR, exist_ok=True)
+    path = os.path.join(Config.RAG_INDEX_DIR, f"v{version:010d}")
+    os.makedirs(path, exist_ok=True)
+    manifest = write_manifest(
+        path, "rag", version, Config.RAG_EMBEDDING_MODEL, Config.RAG_EMBEDDING_DIM, rows, checksum,
+        build_seconds=time.monotonic() - started, chunks_inserted=report["chunks"], chatbot_id=chatbot_id,
+        pdfs_refreshed=report["refreshed"], pdfs_skipped=report["skipped"], pdfs_failed=report["failed"],
+    )
+    activate_artifact(Config.RAG_INDEX_DIR, path)
+    print(json.dumps(manifest, indent=2, ensure_ascii=False))
+    print("RAG: índice pgvector...")
+    print(json.dumps(ensure_ann_index(), indent=2, ensure_ascii=False, default=str))
+
+
+def print_recall_report(report):
+    print(f"{report['index_type']} (lists={report.get('lists')}), k={report['k']}, {report['queries']} perguntas")
+    if "exact" in report:
+        print(f"{'exata':>14} {1.0:7.3f} {report['exact']['ms_p50']:9.3f} {report['exact']['ms_p95']:9.3f}")
+    for row in report["knobs"]:
+        knob = next(f"{key}={row[key]}" for key in ("probes", "ef_search") if key in row)
+        mark = " *" if row == report.get("chosen") else ""
+        print(f"{knob:>14} {row['recall']:7.3f} {row['ms_p50']:9.3f} {row['ms_p95']:9.3f}{mark}")
+
+
+def status():
+    for label, root in (("FAQ", Config.FAQ_INDEX_DIR), ("RAG", Config.RAG_INDEX_DIR)):
+        path = current_artifact_path(root)
+        manifest = read_manifest(path) if path else None
+        print(f"{label}: {path or 'sem versão ativa'}")
+        if manifest:
+            print(json.dumps(manifest, indent=2, ensure_ascii=False))
+
+
+def verify():
+    path = current_artifact_path(Config.FAQ_INDEX_DIR)
+    if not path:
+        print(f"FAQ: sem versão ativa em {Config.FAQ_INDEX_DIR}")
+        return False
+    ok, manifest = verify_artifact(path)
+    if manifest is None:
+        print(f"FAQ: {path} não tem manifest.json")
+    else:
+        print(f"FAQ: {path} checksum {'OK' if ok else 'INVÁLIDO'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construção offline dos índices FAQ/RAG.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="constrói e publica novas versões dos índices")
+    build.add_argument("--faq", action="store_true", help="só o índice FAQ")
+    build.add_argument("--rag", action="store_true", help="só os chunks RAG")
+    build.add_argument("--chatbot", type=int, default=None, help="só um chatbot")
+    build.add_argument("--force", action="store_true", help="RAG: reindexa também os PDFs sem alterações")
+    sub.add_parser("status", help="mostra os manifestos das versões ativas")
+    sub.add_parser("verify", help="verifica o checksum da versão FAQ ativa")
+    bench = sub.add_parser("bench-rag-insert", help="mede a escrita de chunks RAG (COPY vs execute_values)")
+    bench.add_argument("--rows", type=int, default=20000, help="linhas a escrever por método")
+    bench.add_argument("--batch", type=int, default=None, help="linhas por lote (RAG_INGEST_BATCH_SIZE)")
+    rag_index = sub.add_parser("rag-index", help="cria/redimensiona o índice pgvector dos chunks RAG")
+    rag_index.add_argument("--type", choices=("auto",) + RAG_ANN_TYPES, default=None, help="RAG_ANN_INDEX")
+    rag_index.add_argument("--force", action="store_true", help="reconstrói mesmo sem necessidade")
+    rag_tune = sub.add_parser("rag-tune", help="recall vs latência do índice pgvector e afinação")
+    rag_tune.add_argument("--queries", type=int, default=None, help="perguntas de amostra (RAG_ANN_TUNE_QUERIES)")
+    rag_tune.add_argument("--target-ms", type=float, default=None, help="latência alvo p95 (RAG_ANN_TARGET_MS)")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        status()
+        return
+    if args.command == "verify":
+        sys.exit(0 if verify() else 1)
+
+    with _app().app_context():
+        if args.command == "bench-rag-insert":
+            print(json.dumps(benchmark_writers(get_conn(), rows=args.rows, batch_size=args.batch), indent=2))
+            return
+        if args.command == "rag-index":
+            ann_status = ensure_ann_index(requested=args.type, force=args.force)
+            print(json.dumps(ann_status, indent=2, ensure_ascii=False, default=str))
+            return
+        if args.command == "rag-tune":
+            print_recall_report(tune_search(n_queries=args.queries, target_ms=args.target_ms))
+            return
+        both = not args.faq and not args.rag
+        if args.faq or both:
+            build_faq(args.chatbot)
+        if args.rag or both:
+            build_rag(args.chatbot, force=args.force)
+
+
+if __name__ == "__main__":
+    main()